@@ -0,0 +1,173 @@
+"""
+Falante dominante e top-k de cada sala, para dicas de assinatura de áudio.
+
+Em malha completa cada cliente recebe e decodifica o áudio de todos os
+outros, mesmo quando quase todos estão calados entre uma música e outra. Os
+clientes informam o nível do próprio microfone (RMS de 0 a 1 numa janela
+curta, evento ``audio_level``) e o ``SpeakerTracker`` mantém por sala:
+
+- o nível suavizado de cada participante (sobe rápido, ``ATTACK``; desce
+  devagar, ``DECAY``), para que uma pausa entre frases não derrube ninguém;
+- o conjunto ativo (até ``TOP_K``): entra quem passa de ``ENTER_LEVEL``;
+  com o conjunto cheio, só se superar o mais fraco por ``SWITCH_RATIO`` e se
+  esse já estiver ativo há ``MIN_ACTIVE_S``; sai quem fica abaixo de
+  ``EXIT_LEVEL`` por ``RELEASE_S``;
+- o falante dominante, trocado só quando outro ativo o supera por
+  ``SWITCH_RATIO`` (ou quando ele deixa o conjunto ativo);
+- quem está calado há ``PAUSE_AFTER_S`` (pode pausar o envio).
+
+Cada mudança gera uma versão nova das dicas (``speaker_hints``): quem está
+fora do conjunto ativo reduz o próprio bitrate para ``INACTIVE_KBPS`` e quem
+está na lista ``paused`` para de enviar até voltar a tocar. Participantes
+que ainda não informaram nível não aparecem em nenhuma lista e continuam com
+o bitrate cheio.
+"""
+import time
+import threading
+
+import metrics
+from config import SERVER_CONFIG
+
+CHANGES = metrics.counter('mesa_speaker_changes_total', 'Mudanças nas dicas de falante ativo', ('kind',))
+
+
+class RoomSpeakers:
+    """Níveis suavizados, conjunto ativo e dominante de uma sala."""
+
+    def __init__(self):
+        self.level = {}  # {sid: nível suavizado}
+        self.loud_at = {}  # {sid: último instante acima de EXIT_LEVEL}
+        self.active_since = {}  # {sid: entrada no conjunto ativo}
+        self.dominant = None
+        self.dominant_since = 0.0
+        self.state = None  # (dominante, ativos, pausados, todos com nível) da última versão
+        self.version = 0
+
+    def forget(self, sid):
+        self.level.pop(sid, None)
+        self.loud_at.pop(sid, None)
+        self.active_since.pop(sid, None)
+        if self.dominant == sid:
+            self.dominant = None
+
+
+class SpeakerTracker:
+    """Ranking de falantes por sala, atualizado a cada nível informado."""
+
+    def __init__(self, config=None):
+        self.config = dict(SERVER_CONFIG['ACTIVE_SPEAKER'], **(config or {}))
+        self._rooms = {}  # {room_id: RoomSpeakers}
+        self._lock = threading.Lock()
+
+    def report(self, room_id, sid, level, now=None):
+        """Registra o nível (0 a 1) de ``sid``; retorna as dicas se mudaram, senão None."""
+        level = min(max(float(level), 0.0), 1.0)
+        now = time.monotonic() if now is None else now
+        config = self.config
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = RoomSpeakers()
+            previous = room.level.get(sid)
+            if previous is None:
+                room.level[sid] = level
+                # O tempo para pausar conta a partir do primeiro nível informado
+                room.loud_at[sid] = now
+            else:
+                alpha = config['ATTACK'] if level > previous else config['DECAY']
+                room.level[sid] = previous + alpha * (level - previous)
+            if room.level[sid] >= config['EXIT_LEVEL']:
+                room.loud_at[sid] = now
+            self._rank(room, now)
+            return self._publish(room_id, room, now)
+
+    def _rank(self, room, now):
+        config = self.config
+        level = room.level
+        active = room.active_since
+        for sid in [sid for sid in active
+                    if level[sid] < config['EXIT_LEVEL'] and now - room.loud_at[sid] >= config['RELEASE_S']]:
+            del active[sid]
+
+        candidates = sorted((sid for sid in level if sid not in active and level[sid] >= config['ENTER_LEVEL']),
+                            key=level.get, reverse=True)
+        for sid in candidates:
+            if len(active) < config['TOP_K']:
+                active[sid] = now
+                continue
+            weakest = min(active, key=level.get)
+            if level[sid] <= level[weakest] * config['SWITCH_RATIO'] or now - active[weakest] < config['MIN_ACTIVE_S']:
+                break  # Os próximos candidatos são mais fracos ainda
+            del active[weakest]
+            active[sid] = now
+
+        if active:
+            best = max(active, key=level.get)
+            if room.dominant not in active or (
+                    best != room.dominant
+                    and level[best] > level[room.dominant] * config['SWITCH_RATIO']
+                    and now - room.dominant_since >= config['MIN_ACTIVE_S']):
+                room.dominant = best
+                room.dominant_since = now
+
+    def _publish(self, room_id, room, now):
+        """Nova versão das dicas se o dominante, o conjunto ativo, os pausados ou os participantes mudaram."""
+        pause_after = self.config['PAUSE_AFTER_S']
+        active = frozenset(room.active_since)
+        paused = frozenset(sid for sid in room.level if sid not in active and pause_after
+                           and now - room.loud_at[sid] >= pause_after)
+        state = (room.dominant, active, paused, frozenset(room.level))
+        if state == room.state:
+            return None
+        if room.state is not None:
+            if room.state[0] != room.dominant:
+                CHANGES.labels('dominant').inc()
+            if room.state[1] != active:
+                CHANGES.labels('active').inc()
+            if room.state[2] != paused:
+                CHANGES.labels('paused').inc()
+        room.state = state
+        room.version += 1
+        return self._hints(room_id, room)
+
+    def _hints(self, room_id, room):
+        active, paused = room.state[1], room.state[2]
+        return {
+            'roomId': room_id,
+            'version': room.version,
+            'dominant': room.dominant,
+            'active': sorted(active, key=room.level.get, reverse=True),
+            'inactive': sorted(sid for sid in room.level if sid not in active and sid not in paused),
+            'paused': sorted(paused),
+            'inactiveKbps': self.config['INACTIVE_KBPS'],
+        }
+
+    def hints(self, room_id):
+        """Dicas atuais da sala (para quem acabou de entrar), ou None se ninguém informou nível."""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None or room.state is None:
+                return None
+            return self._hints(room_id, room)
+
+    def leave(self, room_id, sid, now=None):
+        """Tira ``sid`` do ranking; retorna as dicas se mudaram, senão None."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None or sid not in room.level:
+                return None
+            room.forget(sid)
+            if not room.level:
+                del self._rooms[room_id]
+                return None
+            self._rank(room, now)
+            return self._publish(room_id, room, now)
+
+    def release_room(self, room_id):
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+
+# Instância global
+speaker_tracker = SpeakerTracker()
@@ -0,0 +1,277 @@
+"""
+Microbenchmarks dos handlers Socket.IO do flask_app.py.
+
+Cada cenário dirige os handlers reais pelo ``socketio.test_client`` (sem rede
+nem Engine.IO, mas com os wrappers de métricas e profiling), numa sala já
+montada:
+
+- entrada e saída de um visitante em salas de 2, 10 e 100 participantes;
+- repasse de sinalização WebRTC (oferta direta e candidatos agrupados);
+- mensagem de chat com fan-out para salas de 10 e 100;
+- operações de playlist (add, move e remove).
+
+As salas são montadas uma vez por tamanho e compartilhadas entre os
+cenários (montar a de 100 já passa por 100 joins). O número de operações
+por rodada se ajusta ao custo do cenário (até ``--ops``), para que salas
+grandes não levem minutos.
+
+Para cada cenário mede ops/s (melhor de ``--rounds``) e blocos de memória
+retidos por operação (``sys.getallocatedblocks`` antes/depois, após
+``gc.collect``), e compara com ``handlers_baseline.json``. Falha (código de
+saída 1) se um cenário ficar mais lento que a linha de base além da
+tolerância ou passar a reter memória.
+
+O test client decodifica o pacote uma vez por destinatário, então o fan-out
+também conta o custo de quem recebe. Os limites de taxa (``RATE_LIMITS``)
+são desligados: repetir o mesmo evento milhares de vezes por segundo é
+justamente o que eles descartam. O banco e a mídia vão para um diretório
+temporário.
+
+A linha de base depende da máquina: gere-a no ambiente onde o teste vai
+rodar com ``--update``.
+
+Uso:
+    python benchmarks/bench_handlers.py [--ops 300] [--rounds 5] [--tolerance 0.25]
+                                        [--only chat_10,chat_100] [--update]
+"""
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'handlers_baseline.json')
+sys.path.insert(0, SERVER_DIR)
+
+# Duração alvo de uma rodada; cenários caros rodam menos operações (mínimo MIN_OPS)
+ROUND_SECONDS = 0.5
+MIN_OPS = 5
+# Folga absoluta de blocos retidos por operação (caches, dicionários que crescem em degraus)
+RETAINED_SLACK = 2.0
+
+SONG = {'id': 'dQw4w9WgXcQ', 'title': 'Ensaio', 'duration': 212, 'thumbnail': None,
+        'uploader': 'MesaDigital', 'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'}
+
+
+def load_app(project_dir):
+    """Importa o flask_app com banco/mídia em ``project_dir`` e sem limites de taxa."""
+    os.environ['PROJECT_DIR'] = project_dir
+    from config import SERVER_CONFIG
+    SERVER_CONFIG['RATE_LIMITS'].clear()
+    import flask_app
+    logging.getLogger().setLevel(logging.WARNING)
+    return flask_app
+
+
+class Room:
+    """Sala com ``size`` clientes de teste; ``clients[0]`` é o dono."""
+
+    def __init__(self, app_module, size):
+        self.app_module = app_module
+        self.clients = [self.connect()]
+        response = self.clients[0].emit('create_room', {'name': 'u0', 'instrument': 'Vocal'}, callback=True)
+        self.room_id = response['room']['id']
+        self.sids = [response['room']['users'][0]['id']]
+        for i in range(1, size):
+            client = self.connect()
+            response = client.emit('join_room', {'roomId': self.room_id, 'name': f'u{i}',
+                                                 'instrument': 'Baixo'}, callback=True)
+            self.clients.append(client)
+            self.sids.append(next(u['id'] for u in response['room']['users'] if u['name'] == f'u{i}'))
+        self.drain()
+
+    def connect(self):
+        return self.app_module.socketio.test_client(self.app_module.app)
+
+    def drain(self):
+        for client in self.clients:
+            client.get_received()
+
+    def close(self):
+        for client in self.clients:
+            client.disconnect()
+
+
+class Rooms:
+    """Salas montadas por tamanho, reaproveitadas pelos cenários."""
+
+    def __init__(self, app_module):
+        self.app_module = app_module
+        self._rooms = {}
+
+    def get(self, size):
+        if size not in self._rooms:
+            self._rooms[size] = Room(self.app_module, size)
+        room = self._rooms[size]
+        room.drain()
+        return room
+
+    def close(self):
+        for room in self._rooms.values():
+            room.close()
+
+
+def scenario_join(size):
+    def setup(rooms):
+        room = rooms.get(size)
+        guest = room.connect()
+        room.clients.append(guest)
+        join = {'roomId': room.room_id, 'name': 'visitante', 'instrument': 'Bateria'}
+        leave = {'roomId': room.room_id}
+
+        def op():
+            guest.emit('join_room', join, callback=True)
+            guest.emit('leave_room', leave, callback=True)
+
+        return room, op
+    return setup
+
+
+def scenario_offer(rooms):
+    room = rooms.get(2)
+    sender = room.clients[0]
+    data = {'to': room.sids[1], 'roomId': room.room_id, 'type': 'offer',
+            'signal': {'type': 'offer', 'sdp': 'v=0\r\n' + 'a=x\r\n' * 40}}
+    return room, lambda: sender.emit('webrtc_signal', data, callback=True)
+
+
+def scenario_candidates(rooms):
+    room = rooms.get(2)
+    sender = room.clients[0]
+    data = {'to': room.sids[1], 'roomId': room.room_id, 'type': 'candidate',
+            'signal': {'candidate': 'candidate:1 1 udp 2122260223 192.168.0.2 54321 typ host',
+                       'sdpMid': '0', 'sdpMLineIndex': 0}}
+    return room, lambda: sender.emit('webrtc_signal', data, callback=True)
+
+
+def scenario_chat(size):
+    def setup(rooms):
+        room = rooms.get(size)
+        sender = room.clients[0]
+        data = {'text': 'bora do refrão', 'type': 'text'}
+        return room, lambda: sender.emit('send_message', data, callback=True)
+    return setup
+
+
+def scenario_playlist(rooms):
+    room = rooms.get(10)
+    editor = room.clients[0]
+    room_id = room.room_id
+
+    def op():
+        added = editor.emit('music_add_song', {'roomId': room_id, 'song': SONG}, callback=True)
+        song_uuid = added['ops'][0]['song']['uuid']
+        editor.emit('music_move_song', {'roomId': room_id, 'uuid': song_uuid, 'after': None}, callback=True)
+        editor.emit('music_remove_song', {'roomId': room_id, 'uuid': song_uuid}, callback=True)
+
+    return room, op
+
+
+SCENARIOS = [
+    ('join_2', scenario_join(2)),
+    ('join_10', scenario_join(10)),
+    ('join_100', scenario_join(100)),
+    ('signal_offer', scenario_offer),
+    ('signal_candidates', scenario_candidates),
+    ('chat_10', scenario_chat(10)),
+    ('chat_100', scenario_chat(100)),
+    ('playlist_ops', scenario_playlist),
+]
+
+
+def run(room, op, max_ops, rounds):
+    """Retorna (ops/s na melhor rodada, blocos retidos por operação)."""
+    # Aquecimento (caches, labels de métricas, statements) e calibração do tamanho da rodada
+    warmup = 0
+    start = time.perf_counter()
+    while warmup == 0 or (warmup < max_ops and time.perf_counter() - start < ROUND_SECONDS):
+        op()
+        warmup += 1
+    per_op = (time.perf_counter() - start) / warmup
+    room.drain()
+    ops = max(MIN_OPS, min(max_ops, int(ROUND_SECONDS / per_op)))
+    best = float('inf')
+    for _ in range(rounds):
+        # Como no timeit: coletas do gc no meio da rodada só somam ruído
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(ops):
+                op()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+        room.drain()
+
+    gc.collect()
+    before = sys.getallocatedblocks()
+    for _ in range(ops):
+        op()
+    room.drain()
+    gc.collect()
+    retained = (sys.getallocatedblocks() - before) / ops
+    return ops / best, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--ops', type=int, default=300, help='Máximo de operações por rodada')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Queda relativa de ops/s permitida sobre a linha de base')
+    parser.add_argument('--only', help='Só estes cenários (nomes separados por vírgula)')
+    parser.add_argument('--update', action='store_true', help='Grava os valores medidos como linha de base')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    project_dir = tempfile.mkdtemp(prefix='mesa-bench-')
+    failures = []
+    measured = dict(baseline) if args.only else {}
+    rooms = None
+    try:
+        rooms = Rooms(load_app(project_dir))
+        print(f"{'cenário':<20}{'ops/s':>10}{'base':>10}{'mínimo':>10}{'blocos/op':>11}")
+        for name, setup in SCENARIOS:
+            if args.only and name not in args.only.split(','):
+                continue
+            room, op = setup(rooms)
+            ops_per_sec, retained = run(room, op, args.ops, args.rounds)
+            measured[name] = {'ops_per_sec': round(ops_per_sec, 1), 'retained_blocks': round(retained, 2)}
+            base = baseline.get(name, {})
+            minimum = base['ops_per_sec'] * (1 - args.tolerance) if 'ops_per_sec' in base else None
+            print(f"{name:<20}{ops_per_sec:>10.1f}{base.get('ops_per_sec', 0):>10.1f}"
+                  f"{minimum or 0:>10.1f}{retained:>11.2f}")
+            if args.update:
+                continue
+            if minimum and ops_per_sec < minimum:
+                failures.append(f"{name}: {ops_per_sec:.0f} ops/s < mínimo {minimum:.0f}")
+            if 'retained_blocks' in base and retained > max(base['retained_blocks'], 0) + RETAINED_SLACK:
+                failures.append(f"{name}: {retained:.2f} blocos retidos/op (base {base['retained_blocks']:.2f})")
+    finally:
+        if rooms is not None:
+            rooms.close()
+        shutil.rmtree(project_dir, ignore_errors=True)
+
+    if args.update:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(measured, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Linha de base gravada em {BASELINE_FILE}")
+
+    for failure in failures:
+        print(f"REGRESSÃO: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark do custo de logging por requisição.
+
+Compara, na thread que atende a requisição, o custo de uma linha de log por
+requisição com:
+  - sync:    basicConfig + FileHandler (configuração antiga)
+  - queue:   QueueHandler/QueueListener sem amostragem
+  - sampled: QueueHandler/QueueListener com a amostragem do logger mesa.requests
+
+Com ``--slow-disk-ms`` cada flush do arquivo sofre, a cada 100 linhas, uma
+pausa que simula o sistema de arquivos em rede do PythonAnywhere; é aí que
+o modo síncrono trava a requisição e a fila não.
+
+Uso:
+    python benchmarks/bench_logging.py [--requests 50000] [--threads 4] [--slow-disk-ms 5]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_setup  # noqa: E402
+from config import SERVER_CONFIG  # noqa: E402
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    request_logger = logging.getLogger(log_setup.REQUEST_LOGGER)
+    for log_filter in request_logger.filters[:]:
+        request_logger.removeFilter(log_filter)
+    log_setup.shutdown_logging()
+
+
+def slow_down_flushes(delay):
+    """Faz 1 em cada 100 flushes de arquivo demorar ``delay`` segundos."""
+    original_flush = logging.StreamHandler.flush
+    counter = [0]
+
+    def flush(self):
+        original_flush(self)
+        if isinstance(self, logging.FileHandler):
+            counter[0] += 1
+            if counter[0] % 100 == 0:
+                time.sleep(delay)
+
+    logging.StreamHandler.flush = flush
+
+
+def run(logger, requests, threads):
+    """Mede o custo de cada linha de log na thread da requisição (µs)."""
+    per_thread = requests // threads
+    samples = []
+
+    def worker():
+        local = []
+        clock = time.perf_counter
+        for i in range(per_thread):
+            start = clock()
+            logger.info("Requisição recebida: %s %s", 'GET', f'/api/events?i={i}')
+            local.append(clock() - start)
+        samples.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    samples.sort()
+    mean = sum(samples) / len(samples) * 1e6
+    p99 = samples[int(len(samples) * 0.99)] * 1e6
+    return mean, p99, samples[-1] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--slow-disk-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    if args.slow_disk_ms:
+        slow_down_flushes(args.slow_disk_ms / 1000)
+
+    tmpdir = tempfile.mkdtemp(prefix='mesa_bench_logging_')
+    results = []
+    request_logger = logging.getLogger(log_setup.REQUEST_LOGGER)
+
+    reset_logging()
+    logging.basicConfig(level=logging.INFO, filename=os.path.join(tmpdir, 'sync.log'),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    results.append(('sync',) + run(request_logger, args.requests, args.threads) + (0,))
+
+    for name, rate in (('queue', 1.0), ('sampled', SERVER_CONFIG['LOGGING']['REQUEST_SAMPLE_RATE'])):
+        reset_logging()
+        SERVER_CONFIG['LOGGING']['REQUEST_SAMPLE_RATE'] = rate
+        log_setup.setup_logging(os.path.join(tmpdir, f'{name}.log'))
+        timings = run(request_logger, args.requests, args.threads)
+        dropped = logging.getLogger().handlers[0].dropped
+        results.append((name,) + timings + (dropped,))
+    reset_logging()
+
+    print(f"{args.requests} linhas em {args.threads} threads, disco lento: {args.slow_disk_ms} ms "
+          f"(arquivos em {tmpdir})")
+    print(f"  {'modo':<8}{'média µs':>10}{'p99 µs':>10}{'máx µs':>12}{'descartadas':>13}")
+    for name, mean, p99, worst, dropped in results:
+        print(f"  {name:<8}{mean:>10.2f}{p99:>10.2f}{worst:>12.0f}{dropped:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark da persistência em SQLite (persistence.py) contra o JSON inteiro.
+
+O lado "json" reproduz o ``controllers/persistence.js``: cada criação relê,
+interpreta e regrava o arquivo inteiro (``indent=2``). O lado "sqlite" usa
+``Store`` com escritas agrupadas. Para cada tamanho inicial da agenda mede:
+
+- criação sequencial (uma requisição por vez);
+- criação concorrente (``--threads`` requisições simultâneas, como vários
+  workers; no SQLite elas dividem a mesma transação);
+- listagem completa (GET /api/events, corpo JSON pronto).
+
+Uso:
+    python benchmarks/bench_persistence.py [--sizes 100,1000,10000] [--ops 200] [--threads 8]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persistence import Store  # noqa: E402
+
+
+def sample_event(i):
+    return {'title': f'Ensaio {i}', 'start': f'2026-{i % 12 + 1:02d}-10T20:00:00.000Z',
+            'end': f'2026-{i % 12 + 1:02d}-10T22:00:00.000Z', 'location': 'Estúdio', 'notes': 'x' * 80}
+
+
+class JsonFileStore:
+    """Mesma lógica do persistence.js, com um lock no lugar do event loop do Node.js."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def list_events(self):
+        with self._lock:
+            return self._read()
+
+    def create_event(self, body):
+        with self._lock:
+            events = self._read()
+            event = dict({'id': str(int(time.time() * 1000))}, **body)
+            events.append(event)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(events, f, indent=2)
+            return event
+
+
+def run_creates(store, ops, threads, offset):
+    def worker(t):
+        for i in range(t, ops, threads):
+            store.create_event(dict(sample_event(offset + i), id=f'b{offset}-{i}'))
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return ops / (time.perf_counter() - start)
+
+
+def preload(name, store, size):
+    """Agenda inicial com ``size`` eventos."""
+    if name == 'json':
+        # Direto no arquivo: pelo caminho lento a carga levaria minutos
+        with open(store.path, 'w', encoding='utf-8') as f:
+            json.dump([dict(sample_event(i), id=f's{i}') for i in range(size)], f, indent=2)
+    else:
+        run_creates(store, size, min(64, max(size, 1)), 10 ** 6)
+
+
+def measure(store, args):
+    sequential = run_creates(store, args.ops, 1, 2 * 10 ** 6)
+    concurrent = run_creates(store, args.ops, args.threads, 3 * 10 ** 6)
+    start = time.perf_counter()
+    for _ in range(5):
+        count = len(store.list_events()) if isinstance(store, JsonFileStore) else store.events_json().count('"id"')
+    listing = (time.perf_counter() - start) / 5 * 1000
+    return sequential, concurrent, listing, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--ops', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'agenda':>7} {'backend':<7} {'criação seq.':>13} {'criação conc.':>14} {'listagem':>10}")
+    for size in [int(value) for value in args.sizes.split(',')]:
+        directory = tempfile.mkdtemp(prefix='mesa-bench-')
+        try:
+            backends = [
+                ('json', JsonFileStore(os.path.join(directory, 'events.json'))),
+                ('sqlite', Store(os.path.join(directory, 'mesa.db'))),
+            ]
+            for name, store in backends:
+                preload(name, store, size)
+                sequential, concurrent, listing, count = measure(store, args)
+                print(f"{size:>7} {name:<7} {sequential:>9.0f} op/s {concurrent:>10.0f} op/s "
+                      f"{listing:>7.1f} ms  ({count} eventos)")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark da inicialização a frio dos pontos de entrada WSGI.
+
+Importa cada ponto de entrada num processo novo com ``python -X importtime``
+(várias vezes, usando a mediana) e compara o tempo cumulativo da importação
+com ``startup_baseline.json``. Falha (código de saída 1) se algum ponto de
+entrada ficar mais lento que a linha de base além da tolerância, ou se
+importar um módulo que deveria ser carregado só no primeiro uso (yt_dlp).
+
+A linha de base depende da máquina: gere-a no ambiente onde o teste vai
+rodar com ``--update``.
+
+Uso:
+    python benchmarks/bench_startup.py [--runs 5] [--tolerance 0.25] [--update]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_DIR = os.path.dirname(SERVER_DIR)
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_baseline.json')
+
+# Módulo importado por cada ponto de entrada
+ENTRY_POINTS = ['wsgi', 'pythonanywhere_wsgi']
+# Módulos que não podem ser importados na inicialização
+LAZY_MODULES = ['yt_dlp']
+# Folga absoluta (ms) somada à tolerância relativa, para absorver ruído em tempos pequenos
+SLACK_MS = 20
+
+
+def import_profile(module):
+    """Importa ``module`` num processo novo; retorna ({módulo: cumulativo µs}, stderr)."""
+    env = dict(os.environ, PROJECT_DIR=PROJECT_DIR)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, timeout=120,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {module}:\n{result.stderr[-2000:]}")
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        try:
+            cumulative[name.strip()] = int(cumulative_us)
+        except ValueError:
+            continue  # cabeçalho
+    return cumulative
+
+
+def measure(module, runs):
+    times = []
+    imported = set()
+    for _ in range(runs):
+        profile = import_profile(module)
+        times.append(profile[module] / 1000)
+        imported.update(profile)
+    return statistics.median(times), imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Aumento relativo permitido sobre a linha de base')
+    parser.add_argument('--update', action='store_true', help='Grava os tempos medidos como linha de base')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    failures = []
+    measured = {}
+    print(f"{'ponto de entrada':<22}{'mediana ms':>12}{'base ms':>10}{'limite ms':>11}")
+    for module in ENTRY_POINTS:
+        median_ms, imported = measure(module, args.runs)
+        measured[module] = {'import_ms': round(median_ms, 1)}
+        base = baseline.get(module, {}).get('import_ms')
+        limit = base * (1 + args.tolerance) + SLACK_MS if base else None
+        print(f"{module:<22}{median_ms:>12.1f}{base or 0:>10.1f}{limit or 0:>11.1f}")
+        if limit and median_ms > limit and not args.update:
+            failures.append(f"{module}: {median_ms:.1f} ms > limite {limit:.1f} ms")
+        for lazy in LAZY_MODULES:
+            if lazy in imported:
+                failures.append(f"{module} importa {lazy} na inicialização")
+
+    if args.update:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(measured, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Linha de base gravada em {BASELINE_FILE}")
+
+    for failure in failures:
+        print(f"REGRESSÃO: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
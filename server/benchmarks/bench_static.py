@@ -0,0 +1,113 @@
+"""
+Benchmark da entrega de arquivos estáticos (pré-compressão + negociação).
+
+Pré-comprime o build, sobe o StaticIndex num servidor WSGI local e mede,
+para o bundle principal (o maior ``static/js/main.*.js``), os bytes
+transferidos e o time-to-first-byte com identity, gzip e brotli.
+
+Uso:
+    python benchmarks/bench_static.py [--build-dir ../build] [--requests 200]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import http.client
+import statistics
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from static_files import StaticIndex, precompress, brotli  # noqa: E402
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def find_main_bundle(index):
+    bundles = [entry for relpath, entry in index.files.items()
+               if relpath.startswith('static/js/main.') and relpath.endswith('.js')]
+    if not bundles:
+        bundles = [entry for entry in index.files.values() if entry.relpath.endswith('.js')]
+    return max(bundles, key=lambda entry: entry.size) if bundles else None
+
+
+def measure(port, path, accept_encoding, requests):
+    ttfb, total = [], []
+    size = 0
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    for _ in range(requests):
+        headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+        start = time.perf_counter()
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        response.read(1)
+        ttfb.append(time.perf_counter() - start)
+        size = 1 + len(response.read())
+        total.append(time.perf_counter() - start)
+    conn.close()
+    return size, statistics.median(ttfb) * 1000, statistics.median(total) * 1000
+
+
+def main():
+    default_build = os.path.join(os.environ.get(
+        'PROJECT_DIR', os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), 'build')
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--build-dir', default=default_build)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--bandwidth-kbps', type=int, default=4000,
+                        help='banda usada para estimar o tempo de download (padrão: 4G fraco)')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.build_dir):
+        print(f"Build não encontrado em {args.build_dir}; rode 'npm run build' antes.")
+        return 1
+
+    start = time.perf_counter()
+    stats = precompress(args.build_dir)
+    print(f"Pré-compressão: {stats['files']} arquivos em {time.perf_counter() - start:.2f}s")
+    original = stats['original_bytes'] or 1
+    print(f"  total original {stats['original_bytes']} B | gzip {stats['gzip_bytes']} B "
+          f"({100 - 100 * stats['gzip_bytes'] / original:.1f}% menor) | brotli {stats['br_bytes']} B "
+          f"({100 - 100 * stats['br_bytes'] / original:.1f}% menor)")
+
+    index = StaticIndex(args.build_dir, precompress_on_start=False)
+    bundle = find_main_bundle(index)
+    if bundle is None:
+        print("Nenhum bundle JavaScript encontrado no build.")
+        return 1
+
+    def app(environ, start_response):
+        status, headers, body = index.serve(environ, environ.get('PATH_INFO', ''))
+        start_response(status, headers)
+        return body
+
+    server = make_server('127.0.0.1', 0, app, server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    print(f"\nBundle principal: {bundle.relpath} ({bundle.size} B), {args.requests} requisições")
+    print(f"{'codificação':<12}{'bytes':>10}{'economia':>10}{'TTFB ms':>10}{'total ms':>10}"
+          f"{'@' + str(args.bandwidth_kbps) + 'kbps ms':>18}")
+    variants = [('identity', None), ('gzip', 'gzip')]
+    if brotli is not None:
+        variants.append(('br', 'br, gzip'))
+    for label, accept_encoding in variants:
+        size, ttfb, total = measure(port, '/' + bundle.relpath, accept_encoding, args.requests)
+        transfer = size * 8 / args.bandwidth_kbps
+        print(f"{label:<12}{size:>10}{100 - 100 * size / bundle.size:>9.1f}%{ttfb:>10.3f}{total:>10.3f}{transfer:>18.0f}")
+
+    server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
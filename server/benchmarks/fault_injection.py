@@ -0,0 +1,392 @@
+"""
+Injeção de falhas no Node.js para medir a cauda de latência do proxy WSGI.
+
+Sobe ``--backends`` substitutos locais do Node.js (HTTP/1.1 com keep-alive,
+como o Express) e coloca o ``pythonanywhere_wsgi.application`` na frente
+deles, num servidor WSGI com ``--workers`` threads fixas (como os workers
+do PythonAnywhere, a fila fica no accept). Todos os backends respondem com a
+distribuição de ``--latency``; os ``--faulty-backends`` primeiros também
+injetam, por requisição:
+
+- ``--stall``: trava por ``--stall-seconds`` antes de responder;
+- ``--reset``: derruba a conexão com RST sem responder;
+- ``--slow-body``: manda os headers e o corpo em pedaços, ``--slow-body-ms`` entre eles;
+- ``--partial``: anuncia o Content-Length e fecha no meio do corpo;
+- ``--flap``: fica fora do ar (RST em tudo) metade de cada período de N segundos.
+
+Distribuições de latência (ms): ``fixed:20``, ``uniform:5,50``,
+``lognormal:MEDIANA,SIGMA`` e ``bimodal:RÁPIDA,LENTA,PROB_LENTA``.
+
+``--clients`` clientes em laço fechado fazem GET /api/events (query única:
+passa pelo micro-cache sem acertar), GET /api/rooms e POST /api/events, e o
+relatório mostra, para cada política do proxy, p50/p90/p99/máximo, status,
+tentativas extras (retry, hedge, hedge vencedor, sem orçamento) e a
+saturação dos workers (média ocupada, fração do tempo com todos ocupados e
+maior fila).
+
+Políticas comparadas (``--policies``):
+
+- ``fixo``: o comportamento anterior, timeout de 15 s em tudo e uma tentativa;
+- ``rotas``: ``SERVER_CONFIG['PROXY']`` (timeouts por rota, retry e hedge).
+
+Uso:
+    python benchmarks/fault_injection.py [--duration 20] [--workers 4] [--clients 12]
+        [--backends 2] [--faulty-backends 1] [--latency lognormal:20,0.8]
+        [--stall 0.01] [--stall-seconds 20] [--reset 0.02] [--slow-body 0.02]
+        [--slow-body-ms 100] [--partial 0.01] [--flap 0] [--policies fixo,rotas] [--seed 1]
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import struct
+import logging
+import argparse
+import tempfile
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tamanho dos pedaços do corpo lento
+SLOW_CHUNK = 256
+# Intervalo de amostragem da ocupação dos workers
+SAMPLE_SECONDS = 0.01
+# Timeout do cliente: maior que qualquer timeout do proxy
+CLIENT_TIMEOUT = 60
+NULL_STREAM = open(os.devnull, 'w')
+# Mistura de operações: (nome, método, caminho, peso)
+OPERATIONS = [
+    ('get_events', 'GET', '/api/events', 0.6),
+    ('get_rooms', 'GET', '/api/rooms', 0.3),
+    ('post_event', 'POST', '/api/events', 0.1),
+]
+
+
+def latency_sampler(spec, rng):
+    """Função sem argumentos que sorteia uma latência (segundos) da distribuição ``spec``."""
+    kind, _, params = spec.partition(':')
+    try:
+        values = [float(value) for value in params.split(',') if value]
+        if kind == 'fixed':
+            delay, = values
+            return lambda: delay / 1000
+        if kind == 'uniform':
+            low, high = values
+            return lambda: rng.uniform(low, high) / 1000
+        if kind == 'lognormal':
+            median, sigma = values
+            return lambda: rng.lognormvariate(math.log(median), sigma) / 1000
+        if kind == 'bimodal':
+            fast, slow, p_slow = values
+            return lambda: (slow if rng.random() < p_slow else fast) / 1000
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"Distribuição de latência inválida: {spec}")
+
+
+class Faults:
+    """Falhas de um backend substituto, sorteadas por requisição."""
+
+    def __init__(self, args, rng, faulty, phase):
+        self.latency = latency_sampler(args.latency, rng)
+        self.rng = rng
+        self.faulty = faulty
+        self.args = args
+        self.phase = phase
+        self.started = time.monotonic()
+
+    def pick(self):
+        """Falha desta requisição: None, 'stall', 'reset', 'slow_body' ou 'partial'."""
+        if not self.faulty:
+            return None
+        args = self.args
+        if args.flap and (time.monotonic() - self.started + self.phase) % args.flap < args.flap / 2:
+            return 'reset'
+        roll = self.rng.random()
+        for fault, probability in (('stall', args.stall), ('reset', args.reset),
+                                   ('slow_body', args.slow_body), ('partial', args.partial)):
+            if roll < probability:
+                return fault
+            roll -= probability
+        return None
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.respond(200, {'path': self.path, 'items': ['x' * 64] * (self.server.body_bytes // 70)})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.respond(201, {'received': len(self.rfile.read(length))})
+
+    def respond(self, status, payload):
+        faults = self.server.faults
+        fault = faults.pick()
+        if fault == 'reset':
+            # SO_LINGER zerado: close() manda RST em vez de FIN
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+            self.close_connection = True
+            return
+        time.sleep(faults.latency())
+        if fault == 'stall':
+            time.sleep(faults.args.stall_seconds)
+
+        body = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if fault == 'partial':
+                self.wfile.write(body[:len(body) // 2])
+                self.close_connection = True
+            elif fault == 'slow_body':
+                for i in range(0, len(body), SLOW_CHUNK):
+                    self.wfile.write(body[i:i + SLOW_CHUNK])
+                    time.sleep(faults.args.slow_body_ms / 1000)
+            else:
+                self.wfile.write(body)
+        except OSError:
+            # O proxy desistiu (timeout ou hedge vencido por outro backend)
+            self.close_connection = True
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, faults, body_bytes):
+        super().__init__(('127.0.0.1', 0), UpstreamHandler)
+        self.faults = faults
+        self.body_bytes = body_bytes
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def get_stderr(self):
+        # Corpo truncado no meio do streaming: o cliente já conta como erro
+        return NULL_STREAM
+
+
+class PoolWSGIServer(WSGIServer):
+    """Servidor WSGI com ``workers`` threads fixas; conexões aceitas esperam na fila."""
+
+    def __init__(self, workers):
+        super().__init__(('127.0.0.1', 0), QuietHandler)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wsgi-worker')
+        self.busy = 0
+        self.queued = 0
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.queued += 1
+        self.executor.submit(self._work, request, client_address)
+
+    def _work(self, request, client_address):
+        with self._lock:
+            self.queued -= 1
+            self.busy += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock:
+                self.busy -= 1
+
+
+class Saturation:
+    """Amostra a ocupação dos workers e a fila do servidor WSGI."""
+
+    def __init__(self, server):
+        self.server = server
+        self.samples = []  # [(ocupados, na fila)]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='saturation', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_SECONDS):
+            self.samples.append((self.server.busy, self.server.queued))
+
+    def summary(self):
+        if not self.samples:
+            return 0.0, 0.0, 0
+        workers = self.server.workers
+        mean_busy = sum(busy for busy, _ in self.samples) / len(self.samples)
+        saturated = sum(1 for busy, _ in self.samples if busy >= workers) / len(self.samples)
+        return mean_busy, saturated, max(queued for _, queued in self.samples)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def drive(port, clients, duration, rng):
+    """Clientes em laço fechado até ``duration``; retorna [(operação, latência, status ou 'erro')]."""
+    results = []
+    deadline = time.monotonic() + duration
+    names, weights = [op[0] for op in OPERATIONS], [op[3] for op in OPERATIONS]
+    operations = {op[0]: op for op in OPERATIONS}
+    counter = iter(range(10 ** 9))
+
+    def client():
+        local = random.Random(rng.random())
+        while time.monotonic() < deadline:
+            name, method, path, _ = operations[local.choices(names, weights)[0]]
+            body = None
+            if name == 'get_events':
+                path += f'?start={next(counter)}'
+            elif method == 'POST':
+                body = json.dumps({'title': 'Ensaio', 'date': '2026-01-01'})
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=CLIENT_TIMEOUT)
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                outcome = response.status
+            except (OSError, http.client.HTTPException):
+                outcome = 'erro'
+            finally:
+                conn.close()
+            results.append((name, time.perf_counter() - start, outcome))
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def load_proxy(backend_urls):
+    os.environ['PROJECT_DIR'] = tempfile.mkdtemp(prefix='mesa-faults-')
+    os.environ['NODE_BACKENDS'] = ','.join(backend_urls)
+    import pythonanywhere_wsgi
+    # Timeouts e resets viram logs de erro a cada requisição
+    logging.getLogger().setLevel(logging.CRITICAL)
+    return pythonanywhere_wsgi
+
+
+def use_policy(proxy, name):
+    """Troca os singletons de política do proxy e zera o estado dos backends."""
+    import upstream
+    from config import SERVER_CONFIG
+    config = SERVER_CONFIG['PROXY']
+    if name == 'fixo':
+        proxy.route_policies = upstream.RoutePolicies({'CONNECT_TIMEOUT': 15, 'DEFAULT_TIMEOUT': 15, 'ROUTES': {}})
+    elif name == 'rotas':
+        proxy.route_policies = upstream.RoutePolicies(config)
+    else:
+        raise SystemExit(f"Política desconhecida: {name}")
+    proxy.hedger = upstream.Hedger(upstream.RetryBudget(config['RETRY_RATIO'], config['RETRY_MIN_PER_SECOND']),
+                                   config['HEDGE_WORKERS'])
+    for backend in proxy.backend_pool.backends:
+        backend.breaker = upstream.CircuitBreaker()
+
+
+def extra_attempts():
+    import upstream
+    return {kind: upstream.EXTRA_ATTEMPTS.labels(kind).value for kind in ('retry', 'hedge', 'hedge_won', 'no_budget')}
+
+
+def report(name, results, elapsed, saturation, workers, attempts):
+    latencies = [latency * 1000 for _, latency, _ in results]
+    statuses = {}
+    for _, _, outcome in results:
+        key = 'erro' if outcome == 'erro' else f'{outcome // 100}xx'
+        statuses[key] = statuses.get(key, 0) + 1
+    mean_busy, saturated, max_queue = saturation.summary()
+    print(f"{name:<8}{len(results) / elapsed:>8.1f}{percentile(latencies, 0.5):>9.1f}"
+          f"{percentile(latencies, 0.9):>9.1f}{percentile(latencies, 0.99):>9.1f}{max(latencies or [0]):>9.1f}"
+          f"  {' '.join(f'{k}={v}' for k, v in sorted(statuses.items())):<22}"
+          f"{attempts['retry']:>7.0f}{attempts['hedge']:>7.0f}{attempts['hedge_won']:>7.0f}{attempts['no_budget']:>7.0f}"
+          f"{mean_busy:>7.1f}/{workers:<3}{saturated * 100:>6.0f}%{max_queue:>6}")
+    for op in OPERATIONS:
+        op_latencies = [latency * 1000 for op_name, latency, _ in results if op_name == op[0]]
+        print(f"  {op[0]:<14}p50 {percentile(op_latencies, 0.5):7.1f} ms  p99 {percentile(op_latencies, 0.99):8.1f} ms"
+              f"  ({len(op_latencies)} req)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duration', type=float, default=20, help='Segundos por política')
+    parser.add_argument('--workers', type=int, default=4, help='Workers WSGI do proxy')
+    parser.add_argument('--clients', type=int, default=12, help='Clientes simultâneos')
+    parser.add_argument('--backends', type=int, default=2)
+    parser.add_argument('--faulty-backends', type=int, default=1, help='Quantos backends injetam falhas')
+    parser.add_argument('--latency', default='lognormal:20,0.8', help='Distribuição de latência de todos os backends')
+    parser.add_argument('--stall', type=float, default=0.01, help='Probabilidade de travar')
+    parser.add_argument('--stall-seconds', type=float, default=20)
+    parser.add_argument('--reset', type=float, default=0.02, help='Probabilidade de RST sem resposta')
+    parser.add_argument('--slow-body', type=float, default=0.02, help='Probabilidade de corpo lento')
+    parser.add_argument('--slow-body-ms', type=float, default=100, help='Pausa entre pedaços do corpo lento')
+    parser.add_argument('--partial', type=float, default=0.01, help='Probabilidade de corpo truncado')
+    parser.add_argument('--flap', type=float, default=0, help='Período (s) do backend que cai e volta (0 = não cai)')
+    parser.add_argument('--body-bytes', type=int, default=2048)
+    parser.add_argument('--policies', default='fixo,rotas')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    latency_sampler(args.latency, random.Random())  # valida antes de subir os servidores
+
+    rng = random.Random(args.seed)
+    upstreams = []
+    for i in range(args.backends):
+        faults = Faults(args, random.Random(rng.random()), i < args.faulty_backends,
+                        phase=i * args.flap / 2)
+        server = UpstreamServer(faults, args.body_bytes)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        upstreams.append(server)
+    proxy = load_proxy([f'http://127.0.0.1:{server.server_port}' for server in upstreams])
+
+    print(f"{args.backends} backend(s), {args.faulty_backends} com falhas; {args.workers} workers, "
+          f"{args.clients} clientes, {args.duration:.0f} s por política")
+    print(f"{'política':<8}{'req/s':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'máx ms':>9}  {'status':<22}"
+          f"{'retry':>7}{'hedge':>7}{'venceu':>7}{'s/orç':>7}{'workers':>11}{'satur':>7}{'fila':>6}")
+    for name in args.policies.split(','):
+        use_policy(proxy, name)
+        server = PoolWSGIServer(args.workers)
+        server.set_app(proxy.application)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        before = extra_attempts()
+        start = time.monotonic()
+        with Saturation(server) as saturation:
+            results = drive(server.server_port, args.clients, args.duration, rng)
+        elapsed = time.monotonic() - start
+        after = extra_attempts()
+        server.shutdown()
+        report(name, results, elapsed, saturation, args.workers,
+               {kind: after[kind] - before[kind] for kind in after})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
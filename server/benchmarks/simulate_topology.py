@@ -0,0 +1,145 @@
+"""
+Simulador offline dos planos de topologia (topology.py).
+
+Gera salas sintéticas com uma mistura de perfis de rede (fibra, Wi-Fi,
+Android em 4G), aplica uma sequência aleatória de entradas e saídas e
+pontua, a cada passo, três estratégias:
+
+- ``mesh``: malha completa, o comportamento anterior;
+- ``planner``: ``TopologyPlanner`` como no servidor (incremental);
+- ``full``: plano refeito do zero a cada passo (referência de qualidade).
+
+Para cada uma: fração de passos viáveis (nenhum uplink estourado), uso
+máximo de uplink, latência média/máxima entre pares e conexões trocadas
+por passo (churn, que custa renegociação ICE).
+
+Uso:
+    python benchmarks/simulate_topology.py [--rooms 200] [--size 8] [--steps 30]
+        [--mix fibra=0.2,wifi=0.5,4g=0.3] [--seed 1]
+"""
+import os
+import sys
+import math
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import topology  # noqa: E402
+
+# (uplink mínimo, máximo em kbps, atraso de acesso em ms)
+PROFILES = {
+    'fibra': (20000, 100000, 2),
+    'wifi': (2000, 20000, 8),
+    '4g': (250, 1500, 35),
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, weight = part.split('=')
+        if name not in PROFILES:
+            raise SystemExit(f"Perfil desconhecido: {name} (use {', '.join(PROFILES)})")
+        mix[name] = float(weight)
+    return mix
+
+
+class Participant:
+    def __init__(self, sid, rng, mix):
+        self.sid = sid
+        self.profile = rng.choices(list(mix), weights=list(mix.values()))[0]
+        low, high, self.access_ms = PROFILES[self.profile]
+        self.uplink = rng.uniform(low, high)
+        # Posição num mapa de ~3000 km; 1 ms de ida e volta a cada 100 km
+        self.position = (rng.uniform(0, 3000), rng.uniform(0, 3000))
+
+    def rtt_to(self, other):
+        distance = math.hypot(self.position[0] - other.position[0], self.position[1] - other.position[1])
+        return distance / 100 + 2 * (self.access_ms + other.access_ms)
+
+
+def true_state(members, config):
+    """Estado com as medições reais, usado para pontuar qualquer plano."""
+    state = topology.RoomState(config)
+    state.members = [p.sid for p in members]
+    state.uplink = {p.sid: p.uplink for p in members}
+    for i, a in enumerate(members):
+        for b in members[i + 1:]:
+            state.rtt[topology._pair(a.sid, b.sid)] = a.rtt_to(b)
+    return state
+
+
+def churn(previous, plan):
+    if previous is None:
+        return 0
+    return len(set(previous.links) ^ set(plan.links))
+
+
+def simulate_room(rng, args, mix, config, totals):
+    planner = topology.TopologyPlanner(config)
+    room_id = 'sim'
+    members = []
+    previous = {'mesh': None, 'planner': None, 'full': None}
+    counter = 0
+    for _ in range(args.steps):
+        joining = len(members) < 2 or (len(members) < args.size and rng.random() < 0.65)
+        if joining:
+            counter += 1
+            participant = Participant(f'p{counter:03d}', rng, mix)
+            members.append(participant)
+            planner.join(room_id, participant.sid)
+            # O cliente informa o uplink e os RTTs para quem já está na sala
+            planner.report(room_id, participant.sid, uplink_kbps=participant.uplink,
+                           rtts={p.sid: participant.rtt_to(p) for p in members if p is not participant})
+        else:
+            participant = members.pop(rng.randrange(len(members)))
+            planner.leave(room_id, participant.sid)
+        if len(members) < 2:
+            continue
+
+        state = true_state(members, config)
+        plans = {
+            'mesh': topology.mesh_plan(state),
+            'planner': planner._rooms[room_id].plan,
+            'full': topology.full_plan(state, previous['full']),
+        }
+        for name, plan in plans.items():
+            score = topology.score_plan(state, plan)
+            total = totals[name]
+            total['steps'] += 1
+            total['feasible'] += score['feasible']
+            total['utilization'] += score['max_utilization']
+            total['latency'] += score['mean_latency_ms']
+            total['max_latency'] = max(total['max_latency'], score['max_latency_ms'])
+            total['churn'] += churn(previous[name], plan)
+            previous[name] = plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=200)
+    parser.add_argument('--size', type=int, default=8, help='tamanho máximo da sala')
+    parser.add_argument('--steps', type=int, default=30, help='entradas/saídas por sala')
+    parser.add_argument('--mix', default='fibra=0.2,wifi=0.5,4g=0.3')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    config = dict(topology.SERVER_CONFIG['TOPOLOGY'])
+    rng = random.Random(args.seed)
+    totals = {name: {'steps': 0, 'feasible': 0, 'utilization': 0.0, 'latency': 0.0,
+                     'max_latency': 0.0, 'churn': 0} for name in ('mesh', 'planner', 'full')}
+    for _ in range(args.rooms):
+        simulate_room(rng, args, mix, config, totals)
+
+    print(f"{args.rooms} salas, até {args.size} participantes, {args.steps} passos, perfis {args.mix}")
+    print(f"{'estratégia':<10} {'viável':>8} {'uso máx':>8} {'lat. média':>11} {'lat. máx':>9} {'churn/passo':>12}")
+    for name, total in totals.items():
+        steps = max(total['steps'], 1)
+        print(f"{name:<10} {total['feasible'] / steps:>7.1%} {total['utilization'] / steps:>8.2f} "
+              f"{total['latency'] / steps:>9.1f}ms {total['max_latency']:>7.1f}ms {total['churn'] / steps:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
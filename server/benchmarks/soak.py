@@ -0,0 +1,267 @@
+"""
+Teste de longa duração (soak) do flask_app.py com detecção de vazamento.
+
+Roda ciclos de rotatividade sintética de salas pelo ``socketio.test_client``:
+cada ciclo cria ``--rooms`` salas, entra com alguns músicos em cada uma,
+troca mensagens, sinais WebRTC, relatórios de rede e edições de playlist
+(busca por ``/api/music/search``) e depois esvazia tudo, parte com
+``leave_room`` e parte só desconectando.
+
+O extrator do YouTube é substituído por um falso determinístico: o teste
+mede o servidor, não a rede. Os limites de taxa são desligados (a
+rotatividade é rápida de propósito) e banco e mídia vão para um diretório
+temporário.
+
+Depois de cada ciclo, com a sala vazia, verifica que as estruturas por sala
+e por cliente voltaram a zero (``rooms``, ``user_room_map``, playlists em
+memória, topologia, diretório de salas, buckets de taxa, lotes de candidatos
+e salas do Socket.IO). A cada ``--interval`` segundos tira um snapshot do
+``tracemalloc`` e mostra os pontos do código que mais cresceram desde o
+primeiro snapshot (tirado depois de um ciclo de aquecimento).
+
+Falha (código de saída 1) se alguma estrutura não esvaziar ou se a memória
+rastreada crescer mais que ``--max-growth-kb`` até o fim.
+
+Uso:
+    python benchmarks/soak.py [--duration 3600] [--interval 60] [--rooms 5]
+                              [--max-growth-kb 512] [--top 10] [--seed 1]
+"""
+import os
+import gc
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INSTRUMENTS = ['Vocal', 'Guitarra', 'Baixo', 'Bateria', 'Piano/Teclado']
+
+
+class FakeYoutubeDL:
+    """Substituto do ``yt_dlp.YoutubeDL`` com respostas determinísticas."""
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, query, download=False):
+        video_id = f'v{abs(hash(query)) % 10 ** 8:08d}'
+        return {'entries': [{'id': video_id, 'title': f'Música {query}', 'duration': 180,
+                             'thumbnail': None, 'uploader': 'Soak',
+                             'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+                             'url': f'https://example.invalid/{video_id}.m4a'}]}
+
+
+class FakeYtDlp:
+    YoutubeDL = FakeYoutubeDL
+
+
+def load_app(project_dir):
+    os.environ['PROJECT_DIR'] = project_dir
+    from config import SERVER_CONFIG
+    SERVER_CONFIG['RATE_LIMITS'].clear()
+    import music_service
+    music_service._yt_dlp = lambda: FakeYtDlp
+    import flask_app
+    # O amostrador de threads guarda os últimos dumps (limitado) e formata pilhas,
+    # o que enche o linecache: só poluiria a comparação de snapshots
+    flask_app.profiling.thread_sampler.stop()
+    logging.getLogger().setLevel(logging.WARNING)
+    return flask_app
+
+
+class Churn:
+    """Ciclos de salas criadas, usadas e esvaziadas."""
+
+    def __init__(self, app_module, rooms, rng):
+        self.app_module = app_module
+        self.rooms = rooms
+        self.rng = rng
+        self.http = app_module.app.test_client()
+        self.cycles = 0
+        self.events = 0
+
+    def connect(self):
+        return self.app_module.socketio.test_client(self.app_module.app)
+
+    def disconnect(self, client, graceful):
+        """Sai do namespace (``graceful``) ou só derruba a conexão, como uma aba fechada."""
+        if graceful:
+            client.disconnect()
+        # O test client não passa pelo Engine.IO: fechar o transporte é com a gente
+        server = self.app_module.socketio.server
+        try:
+            server._handle_eio_disconnect(client.eio_sid, 'transport close')
+        except TypeError:  # python-socketio < 5.12: sem o motivo
+            server._handle_eio_disconnect(client.eio_sid)
+        # e ele guarda toda instância num dicionário de classe; o último cliente criado
+        # ainda fica preso no _send_packet do servidor, então solta os pacotes recebidos
+        type(client).clients.pop(client.eio_sid, None)
+        client.queue.clear()
+        client.acks = None
+
+    def emit(self, client, event, data):
+        self.events += 1
+        return client.emit(event, data, callback=True)
+
+    def cycle(self):
+        rng = self.rng
+        members = []  # [(cliente, sala, sid)]
+        for r in range(self.rooms):
+            owner = self.connect()
+            response = self.emit(owner, 'create_room', {'name': f'dono{r}', 'instrument': rng.choice(INSTRUMENTS)})
+            room_id = response['room']['id']
+            members.append((owner, room_id, response['room']['users'][0]['id']))
+            for i in range(rng.randint(1, 7)):
+                client = self.connect()
+                response = self.emit(client, 'join_room', {'roomId': room_id, 'name': f'm{r}.{i}',
+                                                           'instrument': rng.choice(INSTRUMENTS)})
+                sid = next(u['id'] for u in response['room']['users'] if u['name'] == f'm{r}.{i}')
+                members.append((client, room_id, sid))
+
+        by_room = {}
+        for member in members:
+            by_room.setdefault(member[1], []).append(member)
+        for room_id, room_members in by_room.items():
+            self.use_room(room_id, room_members)
+
+        self.emit(members[0][0], 'list_rooms', {'limit': 5})
+        rng.shuffle(members)
+        for client, room_id, _ in members:
+            graceful = rng.random() < 0.5
+            if graceful:
+                self.emit(client, 'leave_room', {'roomId': room_id})
+            self.disconnect(client, graceful)
+        self.cycles += 1
+
+    def use_room(self, room_id, members):
+        rng = self.rng
+        for client, _, sid in members:
+            self.emit(client, 'send_message', {'text': 'x' * rng.randint(1, 200)})
+            peer = rng.choice(members)[2]
+            if peer != sid:
+                self.emit(client, 'webrtc_signal', {'to': peer, 'roomId': room_id, 'type': 'offer',
+                                                    'signal': {'type': 'offer', 'sdp': 'v=0'}})
+                self.emit(client, 'webrtc_signal', {'to': peer, 'roomId': room_id, 'type': 'candidate',
+                                                    'signal': {'candidate': 'candidate:1 1 udp 1 10.0.0.1 9 typ host'}})
+                self.emit(client, 'network_report', {'roomId': room_id, 'uplinkKbps': rng.randint(500, 5000),
+                                                     'rtts': {peer: rng.randint(10, 200)}})
+            self.emit(client, 'update_user_position', {'roomId': room_id, 'x': rng.random(), 'y': rng.random()})
+
+        editor = members[0][0]
+        song = self.http.get(f'/api/music/search?q=soak{rng.randint(0, 50)}').get_json()
+        added = self.emit(editor, 'music_add_song', {'roomId': room_id, 'song': song})
+        song_uuid = added['ops'][0]['song']['uuid']
+        self.emit(editor, 'music_move_song', {'roomId': room_id, 'uuid': song_uuid, 'after': None})
+        self.emit(editor, 'music_play', {'roomId': room_id, 'uuid': song_uuid})
+        self.emit(editor, 'music_sync', {'roomId': room_id, 'epoch': None, 'version': 0})
+        if rng.random() < 0.5:
+            self.emit(editor, 'music_remove_song', {'roomId': room_id, 'uuid': song_uuid})
+        self.emit(editor, 'metronome_tempo_change', {'roomId': room_id, 'tempo': rng.randint(60, 200)})
+        for client, _, _ in members:
+            client.get_received()
+
+
+def leftovers(app_module):
+    """Estruturas que deveriam estar vazias com todas as salas encerradas: {nome: tamanho}."""
+    server = app_module.socketio.server
+    socketio_rooms = sum(len(rooms) for rooms in server.manager.rooms.values())
+    sizes = {
+        'rooms': len(app_module.rooms),
+        'user_room_map': len(app_module.user_room_map),
+        'room_directory': len(app_module.room_directory),
+        'topology': len(app_module.topology._rooms),
+        'music_service.playlists': len(app_module.music_service.playlists),
+        'rate_limiter': len(app_module.rate_limiter._buckets),
+        'candidate_batcher': len(app_module.candidate_batcher._batches),
+        'socketio.rooms': socketio_rooms,
+        'socketio.environ': len(server.environ),
+    }
+    return {name: size for name, size in sizes.items() if size}
+
+
+def take_snapshot():
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot()
+    return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                   tracemalloc.Filter(False, '*/linecache.py')])
+
+
+def report_growth(baseline, snapshot, top):
+    stats = snapshot.compare_to(baseline, 'lineno')
+    growth = sum(stat.size_diff for stat in stats)
+    print(f"  memória rastreada: {growth / 1024:+.1f} KB desde o início")
+    for stat in stats[:top]:
+        if stat.size_diff <= 0:
+            break
+        frame = stat.traceback[0]
+        print(f"    {stat.size_diff / 1024:+8.1f} KB {stat.count_diff:+6d} blocos  "
+              f"{frame.filename}:{frame.lineno}")
+    return growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duration', type=float, default=3600, help='Segundos de rotatividade')
+    parser.add_argument('--interval', type=float, default=60, help='Segundos entre snapshots')
+    parser.add_argument('--rooms', type=int, default=5, help='Salas por ciclo')
+    parser.add_argument('--max-growth-kb', type=float, default=512)
+    parser.add_argument('--top', type=int, default=10, help='Pontos do código mostrados por snapshot')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    project_dir = tempfile.mkdtemp(prefix='mesa-soak-')
+    failures = []
+    try:
+        app_module = load_app(project_dir)
+        churn = Churn(app_module, args.rooms, random.Random(args.seed))
+        tracemalloc.start(1)
+
+        # Aquecimento: caches, labels de métricas e imports preguiçosos entram na linha de base
+        for _ in range(3):
+            churn.cycle()
+        app_module.store.flush()
+        baseline = take_snapshot()
+
+        start = time.monotonic()
+        next_snapshot = start + args.interval
+        growth = 0
+        while True:
+            churn.cycle()
+            remaining = leftovers(app_module)
+            if remaining:
+                failures.append(f"ciclo {churn.cycles}: não esvaziou {remaining}")
+                break
+            now = time.monotonic()
+            done = now - start >= args.duration
+            if now >= next_snapshot or done:
+                app_module.store.flush()
+                snapshot = take_snapshot()
+                print(f"[{now - start:7.0f} s] {churn.cycles} ciclos, {churn.events} eventos")
+                growth = report_growth(baseline, snapshot, args.top)
+                next_snapshot = now + args.interval
+            if done:
+                break
+        if growth > args.max_growth_kb * 1024:
+            failures.append(f"memória cresceu {growth / 1024:.1f} KB (limite {args.max_growth_kb:.0f} KB)")
+    finally:
+        tracemalloc.stop()
+        shutil.rmtree(project_dir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"VAZAMENTO: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
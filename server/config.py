@@ -10,6 +10,34 @@ SERVER_CONFIG = {
     # Porta do servidor Node.js (usado internamente pelo proxy WSGI)
     'NODE_PORT': 3000,
     
+    # Processos Node.js atrás do proxy WSGI. Cada processo deve rodar com
+    # BACKEND_ID igual a host:porta da sua URL aqui (ex.: PORT=3001
+    # BACKEND_ID=localhost:3001) para que o sid do Socket.IO indique em qual
+    # processo está a sessão. Só a porta ainda funciona se ela não se repetir.
+    # Pode ser sobrescrito pela variável de ambiente NODE_BACKENDS (separada por vírgulas)
+    'NODE_BACKENDS': ['http://localhost:3000'],
+    
+    # Proxy WSGI -> Node.js (upstream.py). Timeouts em segundos; o de leitura vale
+    # para cada pacote recebido, não para a resposta inteira
+    'PROXY': {
+        'CONNECT_TIMEOUT': 3,
+        'DEFAULT_TIMEOUT': 15,
+        # Por prefixo (o mais longo vence): timeout de leitura, tentativas extras depois
+        # de erro de transporte e hedge (segunda cópia da requisição em outro backend
+        # depois de hedge_ms sem resposta). retries e hedge_ms só valem para GET/HEAD
+        'ROUTES': {
+            '/socket.io/': {'timeout': 35},  # Long-polling: o Node.js segura o GET até o pingInterval (25 s)
+            '/api/events': {'timeout': 5, 'retries': 1, 'hedge_ms': 250},
+            '/api/setlists': {'timeout': 5, 'retries': 1, 'hedge_ms': 250},
+            '/api/music/': {'timeout': 20, 'retries': 1},  # Busca no yt_dlp: lenta e cara, sem hedge
+            '/api/': {'timeout': 10, 'retries': 1},
+            '/webrtc/': {'timeout': 10}
+        },
+        'RETRY_RATIO': 0.1,  # Tentativas extras (retries + hedges) por requisição
+        'RETRY_MIN_PER_SECOND': 2,  # Reserva de tentativas extras com pouco tráfego
+        'HEDGE_WORKERS': 8  # Threads das requisições com hedge; pool cheio = sem hedge
+    },
+    
     # Configurações de WebRTC
     'WEBRTC': {
         'ICE_SERVERS': [
@@ -22,14 +50,95 @@ SERVER_CONFIG = {
             # Adicione aqui servidores TURN quando disponíveis
         ],
         'ENABLE_TRICKLE_ICE': True,
-        'ENABLE_DTLS': True
+        'ENABLE_DTLS': True,
+        # Candidatos ICE de um mesmo par agrupados num frame webrtc_signals
+        'CANDIDATE_BATCH_MS': 25,  # Janela de agrupamento
+        'CANDIDATE_BATCH_MAX': 32  # Lote entregue antes da janela se atingir esse tamanho
+    },
+
+    # Planejamento mesh/relay das salas (topology.py)
+    'TOPOLOGY': {
+        'STREAM_KBPS': 96,  # Bitrate de um stream de áudio (padrão do cliente)
+        'DEFAULT_UPLINK_KBPS': 2000,  # Uplink assumido até o cliente informar o seu
+        'UPLINK_HEADROOM': 0.75,  # Fração do uplink que o plano pode ocupar
+        'DEFAULT_RTT_MS': 100,  # RTT assumido entre pares ainda não medidos
+        'RTT_SMOOTHING': 0.3,  # Peso de cada medição nova na média móvel
+        'FORWARD_MS': 10,  # Atraso extra de cada encaminhamento por um relay
+        'MAX_RELAYS': 4,
+        'MAX_MESH_MEMBERS': 16,  # Acima disto a sala nunca vai para mesh
+        'MAX_SCORED_MEMBERS': 32,  # Acima disto os planos são comparados só pelo uso de uplink
+        'MESH_RETURN_MARGIN': 1.25,  # Folga exigida para voltar de relay para mesh
+        'REPORT_INTERVAL_MS': 10000  # Intervalo dos network_report dos clientes
+    },
+    
+    # Telemetria de qualidade do áudio (qos.py, evento qos_report)
+    'QOS': {
+        'BUFFER_SAMPLES': 4096,  # Amostras (link x relatório) por sala; as mais antigas são sobrescritas
+        'WINDOW_S': 60,  # Janela dos percentis e dos alertas
+        'MAX_LINKS_PER_REPORT': 32,
+        'MIN_SAMPLES': 5,  # Amostras do link na janela antes de poder alertar
+        'JITTER_ALERT_MS': 30,  # p90 do jitter acima disto: link degradado
+        'LOSS_ALERT': 0.05,  # p90 da perda de pacotes (fração) acima disto
+        'MIN_BITRATE_KBPS': 16,  # p10 do bitrate abaixo disto
+        'CLEAR_RATIO': 0.7,  # Histerese: recupera só abaixo de 70% do limite (acima de limite / 0,7 no bitrate)
+        'ALERT_INTERVAL_S': 2,  # Avaliação dos alertas no máximo uma vez a cada N s por sala
+        'REPORT_INTERVAL_MS': 5000  # Intervalo dos qos_report dos clientes
+    },
+    
+    # Falante dominante e top-k por sala (active_speaker.py, evento audio_level)
+    'ACTIVE_SPEAKER': {
+        'TOP_K': 4,  # Participantes ativos (bitrate cheio) ao mesmo tempo
+        'ENTER_LEVEL': 0.02,  # Nível RMS suavizado (0-1) para entrar no conjunto ativo
+        'EXIT_LEVEL': 0.01,  # Abaixo disto por RELEASE_S, sai do conjunto ativo
+        'RELEASE_S': 3,
+        'SWITCH_RATIO': 1.5,  # Quanto um desafiante precisa superar o mais fraco do top-k (ou o dominante)
+        'MIN_ACTIVE_S': 1,  # Tempo mínimo ativo (ou como dominante) antes de ser trocado
+        'ATTACK': 0.6,  # Peso de uma medição maior que o nível suavizado
+        'DECAY': 0.15,  # Peso de uma medição menor
+        'PAUSE_AFTER_S': 30,  # Silêncio para pausar o envio (0 desativa)
+        'INACTIVE_KBPS': 24,  # Bitrate de quem está fora do conjunto ativo
+        'REPORT_INTERVAL_MS': 500  # Intervalo dos audio_level dos clientes
     },
     
+    # Arquivos compartilhados nas salas (file_sharing.py): upload em partes, retomável
+    'FILES': {
+        'DIR': None,  # None = files/ na raiz do projeto
+        'MAX_FILE_SIZE': 50 * 1024 * 1024,  # 50 MB
+        'ROOM_QUOTA': 200 * 1024 * 1024,  # Arquivos distintos + uploads em andamento de uma sala
+        'CHUNK_SIZE': 1024 * 1024,  # Tamanho de parte sugerido ao cliente
+        'MAX_CHUNK_SIZE': 4 * 1024 * 1024,  # Maior parte aceita num PATCH
+        'UPLOAD_TTL': 3600,  # Upload parado por mais tempo é descartado
+        'PROGRESS_STEP': 0.1  # Fração do arquivo entre notificações upload_progress
+    },
+    
+    # Playlist das salas sincronizada por operações (playlist_log.py)
+    'MUSIC': {
+        'PLAYLIST_LOG_SIZE': 200  # Operações guardadas para clientes atrasados; além disso, snapshot
+    },
+
+    # Limite por cliente (sid) dos eventos Socket.IO repassados à sala (rate_limit.py).
+    # rate: eventos/s sustentados; burst: rajada permitida; policy: 'drop' descarta,
+    # 'merge' guarda só o último payload e o entrega quando houver token
+    'RATE_LIMITS': {
+        'send_message': {'rate': 5, 'burst': 10, 'policy': 'drop'},
+        'update_user_position': {'rate': 20, 'burst': 20, 'policy': 'merge'},
+        'webrtc_signal': {'rate': 50, 'burst': 200, 'policy': 'drop'},
+        'music_add_song': {'rate': 1, 'burst': 5, 'policy': 'drop'},
+        'music_move_song': {'rate': 5, 'burst': 10, 'policy': 'drop'},
+        'music_remove_song': {'rate': 5, 'burst': 10, 'policy': 'drop'},
+        # Um reorder vira vários moves: limite menor para não contornar o de music_move_song
+        'music_reorder_playlist': {'rate': 1, 'burst': 3, 'policy': 'drop'},
+        'metronome_tempo_change': {'rate': 10, 'burst': 10, 'policy': 'merge'},
+        'ping_request': {'rate': 10, 'burst': 20, 'policy': 'drop'},
+        'qos_report': {'rate': 1, 'burst': 3, 'policy': 'drop'},
+        'audio_level': {'rate': 4, 'burst': 8, 'policy': 'merge'}
+    },
+
     # Configurações de CORS para API e WebRTC
     'CORS': {
         'ALLOW_ORIGINS': ['*'],  # Em produção, restrinja isso para domínios específicos
-        'ALLOW_METHODS': ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
-        'ALLOW_HEADERS': ['Content-Type', 'Authorization', 'User-Agent'],
+        'ALLOW_METHODS': ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'],
+        'ALLOW_HEADERS': ['Content-Type', 'Authorization', 'User-Agent', 'Upload-Offset', 'Range'],
         'MAX_AGE': 86400  # 24 horas
     },
     
@@ -37,13 +146,70 @@ SERVER_CONFIG = {
     'LOGGING': {
         'LEVEL': 'INFO',  # 'DEBUG' para desenvolvimento, 'INFO' para produção
         'ROTATE_SIZE': 10 * 1024 * 1024,  # 10 MB
-        'BACKUP_COUNT': 5
+        'BACKUP_COUNT': 5,
+        'QUEUE_SIZE': 10000,  # Registros pendentes antes de descartar (nunca bloqueia)
+        'REQUEST_SAMPLE_RATE': 0.1  # Fração das linhas por requisição gravadas
+    },
+    
+    # Diagnóstico (profiling.py); endpoints /api/admin/* exigem MESA_ADMIN_TOKEN
+    'PROFILING': {
+        'SLOW_EVENT_MS': 50,  # Handlers Socket.IO acima disso são registrados
+        'SAMPLE_INTERVAL_MS': 5,  # Intervalo de amostragem do profiler
+        'MAX_PROFILE_SECONDS': 120,  # Duração máxima de uma coleta
+        'THREAD_DUMP_INTERVAL': 0,  # Segundos entre dumps periódicos de threads (0 = desativado)
+        'STUCK_THREAD_SECONDS': 30  # Mesma pilha por esse tempo gera aviso
+    },
+    
+    # Tracing (tracing.py): spans em JSON Lines, analisados com trace_report.py
+    'TRACING': {
+        'SAMPLE_RATE': 0.05,  # Fração das requisições/eventos sem traceparent que são gravados (0 desativa)
+        'DIR': None,  # None = data/traces na raiz do projeto (um arquivo por processo)
+        'MAX_BYTES': 20 * 1024 * 1024,  # Tamanho de cada arquivo; o anterior vira .1
+        'QUEUE_SIZE': 10000  # Spans pendentes antes de descartar (nunca bloqueia)
+    },
+    
+    # Deploy disparado pelo webhook do GitHub (deploy_queue.py)
+    'DEPLOY': {
+        'BRANCH': 'main',
+        'DEBOUNCE_SECONDS': 10,  # Pushes nesse intervalo viram um único deploy
+        'REQUIREMENTS': ['requirements.txt', 'server/requirements.txt'],  # pip só se o hash mudar
+        'WSGI_FILES': ['/var/www/kluferso_pythonanywhere_com_wsgi.py'],  # Tocados para recarregar
+        # Reload pela API do PythonAnywhere, usado quando PYTHONANYWHERE_API_TOKEN está definido
+        'RELOAD_API_URL': 'https://www.pythonanywhere.com/api/v0/user/kluferso/webapps/kluferso.pythonanywhere.com/reload/',
+        'RELOAD_API_TIMEOUT': 60,
+        'BACKUP_DIR': '/tmp',  # Cópia de server/*.py antes de atualizar (mesa_backup_<data>)
+        'BACKUPS_KEPT': 5,
+        'STATE_FILE': '/tmp/mesa_deploy_state.json',
+        'JOBS_FILE': '/tmp/mesa_deploy_jobs.json',
+        'LOCK_FILE': '/tmp/mesa_deploy.lock',
+        'HISTORY': 20,  # Jobs mantidos para o endpoint de status
+        'GIT_TIMEOUT': 120,
+        'PIP_TIMEOUT': 600
+    },
+    
+    # Banco SQLite do servidor Python (persistence.py): agenda, setlists e playlists
+    'PERSISTENCE': {
+        'DB_FILE': None,  # None = data/mesa.db na raiz do projeto
+        'BATCH_MS': 0,  # Espera extra por escritas antes do commit (0 = só as já enfileiradas)
+        'BATCH_MAX': 256,  # Escritas por transação
+        'BUSY_TIMEOUT': 5,  # Segundos esperando o lock do banco (outro processo gravando)
+        'PLAYLIST_RETENTION_DAYS': 30  # Playlists sem edição há mais tempo são apagadas ao abrir o banco
     },
     
     # Configurações para cache
     'CACHE': {
         'STATIC_MAX_AGE': 86400,  # 24 horas para arquivos estáticos
-        'API_MAX_AGE': 0  # Não cachear API
+        'API_MAX_AGE': 0,  # Não cachear API
+        'PRECOMPRESS_ON_START': True,  # Gera .gz/.br do build em segundo plano se faltarem
+        'MUSIC_SEARCH_TTL': 3600,  # Resultados de busca do yt_dlp
+        'MUSIC_STREAM_TTL': 1800,  # URLs de stream (o YouTube as expira em algumas horas)
+        'MUSIC_CACHE_SIZE': 512,  # Entradas por cache
+        # Micro-cache do proxy WSGI para APIs de leitura (response_cache.py)
+        'PROXY_CACHE_PATHS': ['/api/events', '/api/setlists'],
+        'PROXY_CACHE_TTL': 2,  # Segundos em que a resposta é servida sem consultar o Node.js
+        'PROXY_CACHE_STALE': 30,  # Segundos extras servindo a versão antiga enquanto revalida
+        'PROXY_CACHE_ENTRIES': 256,
+        'PROXY_CACHE_MAX_BODY': 1024 * 1024  # Respostas maiores não são guardadas
     }
 }
 
@@ -58,9 +224,17 @@ DIR_CONFIG = {
 
 # Configurações de mídia
 MEDIA_CONFIG = {
+    'MEDIA_DIR': None,  # None = media/ na raiz do projeto
     'MAX_UPLOAD_SIZE': 10 * 1024 * 1024,  # 10 MB
     'ALLOWED_TYPES': ['image/jpeg', 'image/png', 'image/gif', 'image/webp'],
-    'THUMBNAIL_SIZES': [(200, 200), (400, 400)]
+    'THUMBNAIL_SIZES': [(200, 200), (400, 400)],
+    'THUMBNAIL_WORKERS': 2,  # Processos gerando miniaturas (media_service.py)
+    'THUMBNAIL_TIMEOUT': 30,  # Segundos que um upload espera pelas miniaturas
+    # Miniaturas remotas (capas das músicas) baixadas e servidas localmente
+    'REMOTE_HOSTS': ['i.ytimg.com', 'i9.ytimg.com', 'img.youtube.com'],
+    'REMOTE_TIMEOUT': 5,
+    'REMOTE_FETCH_WORKERS': 4,
+    'REMOTE_INDEX_CACHE': 2048  # URLs remotas com o hash em memória (LRU; o índice completo fica em disco)
 }
 
 # Configurações de instrumentos suportados
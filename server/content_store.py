@@ -0,0 +1,79 @@
+"""
+Armazenamento de arquivos endereçado pelo conteúdo (SHA-256).
+
+Cada arquivo fica em ``<raiz>/objects/ab/cdef...``, onde o nome é o hash do
+próprio conteúdo: o mesmo arquivo enviado duas vezes ocupa espaço uma vez só
+e o endereço nunca muda de conteúdo, o que permite servi-lo como imutável.
+
+A escrita vai para um arquivo temporário no mesmo diretório e é publicada com
+``os.replace`` (atômico): um leitor nunca vê um objeto pela metade, e duas
+escritas simultâneas do mesmo conteúdo produzem o mesmo arquivo.
+"""
+import os
+import re
+import hashlib
+import tempfile
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+BLOCK_SIZE = 64 * 1024
+
+
+def is_digest(value):
+    return isinstance(value, str) and DIGEST_RE.match(value) is not None
+
+
+class ContentStore:
+    """Objetos imutáveis em disco indexados pelo SHA-256 do conteúdo."""
+
+    def __init__(self, root):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+
+    def path(self, digest):
+        if not is_digest(digest):
+            raise ValueError(f"Hash inválido: {digest}")
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def delete(self, digest):
+        """Remove o objeto (sem erro se já não existe)."""
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def put_stream(self, stream, max_size=None):
+        """Grava o conteúdo de um arquivo aberto, calculando o hash durante a cópia.
+
+        Retorna (hash, tamanho, novo); ``novo`` é False se o objeto já existia.
+        Levanta ValueError se passar de ``max_size`` bytes.
+        """
+        os.makedirs(self.objects, exist_ok=True)
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    block = stream.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    size += len(block)
+                    if max_size is not None and size > max_size:
+                        raise ValueError(f"Arquivo maior que {max_size} bytes")
+                    sha.update(block)
+                    f.write(block)
+            digest = sha.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                return digest, size, False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            return digest, size, True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
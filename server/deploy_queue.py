@@ -0,0 +1,318 @@
+"""
+Fila de deploy disparada pelos webhooks do GitHub.
+
+O webhook só enfileira e responde na hora com o id do job; um único worker
+por processo executa o deploy em segundo plano:
+
+- pushes que chegam enquanto um job espera (``DEBOUNCE_SECONDS``) ou roda
+  são agrupados num único job pendente, que pega o commit mais recente;
+- um lock de arquivo (fcntl) impede dois processos (webhook_handler e
+  flask_app, ou workers diferentes) de rodar git/pip ao mesmo tempo;
+- antes de atualizar, ``server/*.py`` é copiado para ``BACKUP_DIR``
+  (mantidas as ``BACKUPS_KEPT`` cópias mais recentes);
+- ``pip install`` só roda quando o hash de um requirements mudou desde o
+  último deploy bem-sucedido;
+- a aplicação só é recarregada quando o diff inclui arquivos .py ou
+  dependências novas: tocando os arquivos WSGI e, com
+  ``PYTHONANYWHERE_API_TOKEN`` definido, pela API do PythonAnywhere.
+
+O estado dos jobs é gravado em ``JOBS_FILE`` para que qualquer worker
+responda ao endpoint de status.
+"""
+import os
+import sys
+import json
+import time
+import glob
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows (desenvolvimento local): sem lock entre processos
+    fcntl = None
+
+from config import SERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class DeployError(Exception):
+    """Falha de um passo do deploy (mensagem já legível para o status do job)."""
+
+
+def file_hash(path):
+    """sha256 do arquivo, ou None se ele não existir."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+class DeployQueue:
+    """Fila de deploy com um único worker e agrupamento de pushes."""
+
+    def __init__(self, project_dir=None, config=None):
+        self.config = dict(SERVER_CONFIG['DEPLOY'], **(config or {}))
+        self.project_dir = project_dir or os.environ.get('PROJECT_DIR', '/home/kluferso/MesaDigital')
+        self.jobs = OrderedDict()  # {id: job}, mais antigo primeiro
+        self._pending = None
+        self._cond = threading.Condition()
+        self._worker = None
+
+    # ----- API pública -----
+
+    def submit(self, ref, commit=None, source='webhook'):
+        """Enfileira um deploy ou agrupa com o job pendente; retorna o job."""
+        with self._cond:
+            job = self._pending
+            if job is not None:
+                job['pushes'] += 1
+                job['commit'] = commit or job['commit']
+                logger.info(f"Push agrupado ao deploy pendente {job['id']} ({job['pushes']} pushes)")
+            else:
+                job = {
+                    'id': uuid.uuid4().hex[:12],
+                    'status': QUEUED,
+                    'ref': ref,
+                    'commit': commit,
+                    'source': source,
+                    'pushes': 1,
+                    'queued_at': time.time(),
+                    'started_at': None,
+                    'finished_at': None,
+                    'steps': [],
+                }
+                self._pending = job
+                self.jobs[job['id']] = job
+                while len(self.jobs) > self.config['HISTORY']:
+                    self.jobs.popitem(last=False)
+                logger.info(f"Deploy {job['id']} enfileirado ({source}, {ref})")
+            self._save()
+            self._ensure_worker()
+            self._cond.notify()
+            return dict(job)
+
+    def get(self, job_id):
+        """Job pelo id (deste processo ou gravado por outro)."""
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self._load().get(job_id)
+
+    def recent(self):
+        with self._cond:
+            jobs = {job_id: dict(job) for job_id, job in self.jobs.items()}
+        stored = self._load()
+        stored.update(jobs)
+        return sorted(stored.values(), key=lambda job: job['queued_at'], reverse=True)
+
+    # ----- Worker -----
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='mesa-deploy', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                job = self._pending
+            # Janela em que novos pushes ainda são agrupados neste job
+            time.sleep(self.config['DEBOUNCE_SECONDS'])
+            with self._cond:
+                self._pending = None
+                job['status'] = RUNNING
+                job['started_at'] = time.time()
+                self._save()
+            try:
+                with self._deploy_lock():
+                    self._deploy(job)
+                job['status'] = SUCCEEDED
+            except Exception as e:
+                job['status'] = FAILED
+                job['error'] = str(e)
+                logger.error(f"Deploy {job['id']} falhou: {str(e)}")
+            job['finished_at'] = time.time()
+            with self._cond:
+                self._save()
+            logger.info(f"Deploy {job['id']} terminou: {job['status']} "
+                        f"em {job['finished_at'] - job['started_at']:.1f}s")
+
+    def _deploy_lock(self):
+        return _FileLock(self.config['LOCK_FILE'])
+
+    def _step(self, job, name, detail=''):
+        job['steps'].append({'step': name, 'detail': detail[-500:], 'at': time.time()})
+        with self._cond:
+            self._save()
+
+    def _git(self, *args, check=True):
+        result = subprocess.run(['git'] + list(args), cwd=self.project_dir, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True,
+                                timeout=self.config['GIT_TIMEOUT'])
+        if check and result.returncode != 0:
+            raise DeployError(f"git {' '.join(args)}: {result.stderr.strip()}")
+        return result
+
+    def _deploy(self, job):
+        branch = self.config['BRANCH']
+        old = self._git('rev-parse', 'HEAD').stdout.strip()
+        self._git('fetch', 'origin', branch)
+        new = self._git('rev-parse', f'origin/{branch}').stdout.strip()
+        job['from'], job['to'] = old, new
+        if old == new:
+            self._step(job, 'up_to_date', new[:12])
+            return
+
+        self._backup(job)
+        if self._git('merge', '--ff-only', f'origin/{branch}', check=False).returncode != 0:
+            logger.warning(f"Deploy {job['id']}: merge fast-forward falhou, aplicando reset --hard")
+            self._git('reset', '--hard', f'origin/{branch}')
+        changed = self._git('diff', '--name-only', old, new).stdout.split()
+        job['changed_files'] = len(changed)
+        self._step(job, 'updated', f'{old[:12]}..{new[:12]} ({len(changed)} arquivos)')
+
+        dependencies_changed = self._install_requirements(job)
+
+        python_changed = [path for path in changed if path.endswith('.py')]
+        if python_changed or dependencies_changed:
+            self._reload(job)
+        else:
+            job['reloaded'] = False
+            self._step(job, 'reload_skipped', 'nenhum arquivo .py ou dependência alterado')
+
+    def _install_requirements(self, job):
+        """Roda pip apenas para os requirements cujo hash mudou; retorna se algum rodou."""
+        state = self._read_json(self.config['STATE_FILE']).get('requirements', {})
+        installed = False
+        for relpath in self.config['REQUIREMENTS']:
+            path = os.path.join(self.project_dir, relpath)
+            digest = file_hash(path)
+            if digest is None or state.get(relpath) == digest:
+                self._step(job, 'pip_skipped', relpath)
+                continue
+            result = subprocess.run([sys.executable, '-m', 'pip', 'install', '--user', '-r', path],
+                                    cwd=self.project_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True, timeout=self.config['PIP_TIMEOUT'])
+            if result.returncode != 0:
+                raise DeployError(f"pip install -r {relpath}: {result.stderr.strip()[-500:]}")
+            state[relpath] = digest
+            self._write_json(self.config['STATE_FILE'], {'requirements': state})
+            installed = True
+            self._step(job, 'pip_installed', relpath)
+        return installed
+
+    def _backup(self, job):
+        """Copia server/*.py antes de atualizar; uma falha aqui não impede o deploy."""
+        backup_dir = os.path.join(self.config['BACKUP_DIR'], f"mesa_backup_{time.strftime('%Y%m%d_%H%M%S')}")
+        try:
+            os.makedirs(os.path.join(backup_dir, 'server'), exist_ok=True)
+            for path in glob.glob(os.path.join(self.project_dir, 'server', '*.py')):
+                shutil.copy2(path, os.path.join(backup_dir, 'server'))
+        except OSError as e:
+            logger.warning(f"Deploy {job['id']}: backup falhou: {str(e)}")
+            self._step(job, 'backup_failed', str(e))
+            return
+        self._step(job, 'backup', backup_dir)
+        # O nome tem a data, então a ordem alfabética é a cronológica
+        old_backups = sorted(glob.glob(os.path.join(self.config['BACKUP_DIR'], 'mesa_backup_*')))
+        for path in old_backups[:-self.config['BACKUPS_KEPT']]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _reload(self, job):
+        touched = False
+        for wsgi_file in self.config['WSGI_FILES']:
+            if os.path.exists(wsgi_file):
+                os.utime(wsgi_file, None)
+                touched = True
+                self._step(job, 'reloaded', wsgi_file)
+        api_reloaded = self._reload_via_api(job)
+        job['reloaded'] = touched or api_reloaded
+        if not job['reloaded']:
+            logger.warning(f"Deploy {job['id']}: aplicação não recarregada")
+            self._step(job, 'reload_missing', 'nenhum arquivo WSGI encontrado e reload pela API indisponível')
+
+    def _reload_via_api(self, job):
+        """Reload pela API do PythonAnywhere (só com PYTHONANYWHERE_API_TOKEN); retorna se deu certo."""
+        api_token = os.environ.get('PYTHONANYWHERE_API_TOKEN', '')
+        if not api_token:
+            return False
+        import requests
+        try:
+            response = requests.post(self.config['RELOAD_API_URL'],
+                                     headers={'Authorization': f'Token {api_token}'},
+                                     timeout=self.config['RELOAD_API_TIMEOUT'])
+        except requests.exceptions.RequestException as e:
+            self._step(job, 'reload_api_failed', str(e))
+            return False
+        if response.status_code != 200:
+            self._step(job, 'reload_api_failed', f'{response.status_code} {response.text}')
+            return False
+        self._step(job, 'reloaded', 'API do PythonAnywhere')
+        return True
+
+    # ----- Persistência do estado -----
+
+    def _save(self):
+        """Grava os jobs recentes (chamar com self._cond adquirido)."""
+        jobs = [dict(job, steps=list(job['steps'])) for job in self.jobs.values()]
+        self._write_json(self.config['JOBS_FILE'], {'jobs': jobs})
+
+    def _load(self):
+        return {job['id']: job for job in self._read_json(self.config['JOBS_FILE']).get('jobs', [])}
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar {path}: {str(e)}")
+
+
+class _FileLock:
+    """Lock exclusivo entre processos via fcntl.flock (no-op sem fcntl)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+deploy_queue = DeployQueue()
@@ -0,0 +1,362 @@
+"""
+Arquivos compartilhados nas salas (partituras, áudios de referência).
+
+O upload é feito em partes, por HTTP, e pode ser retomado:
+
+1. ``POST /api/rooms/<sala>/uploads`` com nome, tamanho e, de preferência, o
+   SHA-256 do arquivo. Se o mesmo arquivo já está nesta sala, nada é
+   enviado. Senão, a resposta traz o ``uploadId``: mesmo que o conteúdo já
+   exista por outra sala, os bytes são enviados e conferidos (o hash sozinho
+   não prova que o cliente tem o arquivo), e só o disco é compartilhado.
+2. ``PATCH /api/uploads/<id>`` com a parte no corpo e o header
+   ``Upload-Offset`` (onde ela começa). Uma parte fora de ordem recebe 409
+   com o offset atual.
+3. ``GET /api/uploads/<id>`` informa o offset já gravado: depois de uma
+   queda, o cliente continua de onde parou.
+
+Os bytes recebidos vão para ``partial/<id>`` e, completo o arquivo, para o
+``ContentStore`` (endereçado pelo SHA-256): o mesmo arquivo em várias salas
+ocupa disco uma vez só. O hash informado no início é conferido no fim.
+
+Cada sala tem uma cota (``ROOM_QUOTA``) sobre a soma dos arquivos distintos
+dela e dos uploads em andamento (reservados pelo tamanho declarado). Quando
+a sala é encerrada, os uploads pendentes são apagados e os objetos que
+nenhuma outra sala usa são removidos do disco.
+
+O download (``/api/rooms/<sala>/files/<hash>?sid=<socket>``) e a lista de
+arquivos são só para quem está na sala. O download aceita ``Range``. Só é
+servido inline o que o conteúdo mostra ser PDF, imagem ou áudio; o resto vai
+como anexo ``application/octet-stream``.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+
+import metrics
+from config import SERVER_CONFIG
+from content_store import BLOCK_SIZE, ContentStore, is_digest
+from media_service import sniff_type
+
+logger = logging.getLogger(__name__)
+
+UPLOADS = metrics.counter('mesa_file_uploads_total', 'Arquivos compartilhados nas salas', ('result',))
+UPLOAD_BYTES = metrics.counter('mesa_file_upload_bytes_total', 'Bytes recebidos nas partes dos uploads')
+
+# Assinaturas de áudio aceitas para exibição inline (imagens vêm do media_service)
+AUDIO_SIGNATURES = (
+    (b'ID3', 'audio/mpeg'),
+    (b'\xff\xfb', 'audio/mpeg'),
+    (b'\xff\xf3', 'audio/mpeg'),
+    (b'OggS', 'audio/ogg'),
+    (b'fLaC', 'audio/flac'),
+)
+
+
+def sniff_file_type(head):
+    """Tipo MIME seguro para servir inline, pelos primeiros bytes; senão None."""
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'audio/wav'
+    if head[4:8] == b'ftyp' and head[8:11] in (b'M4A', b'mp4', b'iso'):
+        return 'audio/mp4'
+    for signature, content_type in AUDIO_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return sniff_type(head)
+
+
+def default_files_dir():
+    """``files/`` na raiz do projeto."""
+    project_dir = os.environ.get('PROJECT_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(project_dir, 'files')
+
+
+class FileSharingError(Exception):
+    """Pedido recusado; ``status`` é o código HTTP e ``details`` vai junto na resposta."""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+class Upload:
+    """Upload em andamento: bytes já gravados em ``path`` até ``offset``."""
+
+    __slots__ = ('id', 'room_id', 'sid', 'filename', 'size', 'sha256', 'path', 'offset',
+                 'updated_at', 'notified', 'busy')
+
+    def __init__(self, room_id, sid, filename, size, sha256, path):
+        self.id = uuid.uuid4().hex
+        self.room_id = room_id
+        self.sid = sid
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+        self.offset = 0
+        self.updated_at = time.monotonic()
+        self.notified = 0  # Offset da última notificação de progresso
+        self.busy = False  # Uma parte sendo gravada
+
+    def to_dict(self, chunk_size):
+        return {
+            'uploadId': self.id,
+            'roomId': self.room_id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'chunkSize': chunk_size,
+        }
+
+
+class FileSharing:
+    """Uploads retomáveis, arquivos e cotas por sala sobre um ``ContentStore``."""
+
+    def __init__(self, root=None, config=None):
+        self.config = dict(SERVER_CONFIG['FILES'], **(config or {}))
+        self.root = root or self.config['DIR'] or default_files_dir()
+        self.content = ContentStore(self.root)
+        self.partial_dir = os.path.join(self.root, 'partial')
+        self._rooms = {}  # {room_id: {hash: metadados}}
+        self._uploads = {}  # {upload_id: Upload}
+        self._lock = threading.Lock()
+        self._orphans_checked = False
+
+    # ----- Upload -----
+
+    def start(self, room_id, sid, filename, size, sha256=None):
+        """Abre um upload; retorna (metadados do arquivo, None) se ele já está na sala, senão (None, upload)."""
+        if not isinstance(filename, str) or not filename.strip():
+            raise FileSharingError('Nome do arquivo inválido')
+        filename = os.path.basename(filename.replace('\\', '/')).strip()[:255]
+        if isinstance(size, bool) or not isinstance(size, int) or size <= 0:
+            raise FileSharingError('Tamanho inválido')
+        if size > self.config['MAX_FILE_SIZE']:
+            raise FileSharingError(f"Arquivo maior que {self.config['MAX_FILE_SIZE']} bytes", 413)
+        if sha256 is not None:
+            sha256 = str(sha256).lower()
+            if not is_digest(sha256):
+                raise FileSharingError('SHA-256 inválido')
+
+        with self._lock:
+            self._sweep()
+            files = self._rooms.setdefault(room_id, {})
+            if sha256 is not None and sha256 in files:
+                UPLOADS.labels('duplicate').inc()
+                return dict(files[sha256]), None
+            self._check_quota(room_id, size)
+            os.makedirs(self.partial_dir, exist_ok=True)
+            upload = Upload(room_id, sid, filename, size, sha256, None)
+            upload.path = os.path.join(self.partial_dir, upload.id)
+            open(upload.path, 'wb').close()
+            self._uploads[upload.id] = upload
+            return None, upload.to_dict(self.config['CHUNK_SIZE'])
+
+    def status(self, upload_id):
+        with self._lock:
+            upload = self._get(upload_id)
+            return upload.to_dict(self.config['CHUNK_SIZE'])
+
+    def append(self, upload_id, offset, stream, length):
+        """Grava uma parte; retorna (progresso a notificar ou None, metadados do arquivo se completou)."""
+        with self._lock:
+            upload = self._get(upload_id)
+            if upload.busy:
+                raise FileSharingError('Outra parte deste upload está sendo gravada', 409, offset=upload.offset)
+            if offset != upload.offset:
+                raise FileSharingError('Offset fora de ordem', 409, offset=upload.offset)
+            if length is None or length <= 0 or length > self.config['MAX_CHUNK_SIZE']:
+                raise FileSharingError(f"Parte deve ter de 1 a {self.config['MAX_CHUNK_SIZE']} bytes")
+            if offset + length > upload.size:
+                raise FileSharingError('Parte passa do tamanho declarado', 413)
+            upload.busy = True
+
+        written = 0
+        try:
+            with open(upload.path, 'r+b') as f:
+                f.seek(offset)
+                while written < length:
+                    block = stream.read(min(BLOCK_SIZE, length - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    written += len(block)
+        finally:
+            # O que chegou fica valendo: numa queda, o cliente retoma do offset novo
+            with self._lock:
+                upload.offset += written
+                upload.updated_at = time.monotonic()
+                # Completo: continua ocupado até o _finish, para um DELETE não apagar o arquivo
+                upload.busy = upload.offset == upload.size
+            UPLOAD_BYTES.inc(written)
+
+        if written < length:
+            raise FileSharingError('Parte incompleta', 400, offset=upload.offset)
+        if upload.offset < upload.size:
+            return self._progress(upload), None
+        try:
+            return self._progress(upload), self._finish(upload)
+        finally:
+            with self._lock:
+                upload.busy = False
+
+    def _progress(self, upload):
+        """Progresso para notificar a sala, a cada ``PROGRESS_STEP`` do arquivo (e no fim)."""
+        step = max(1, int(upload.size * self.config['PROGRESS_STEP']))
+        if upload.offset < upload.size and upload.offset - upload.notified < step:
+            return None
+        upload.notified = upload.offset
+        return {
+            'uploadId': upload.id,
+            'roomId': upload.room_id,
+            'sharedBy': upload.sid,
+            'filename': upload.filename,
+            'size': upload.size,
+            'offset': upload.offset,
+        }
+
+    def _finish(self, upload):
+        """Move o arquivo completo para o ContentStore e o registra na sala."""
+        try:
+            with open(upload.path, 'rb') as f:
+                digest, size, created = self.content.put_stream(f, self.config['MAX_FILE_SIZE'])
+            with self._lock:
+                self._uploads.pop(upload.id, None)
+                if upload.sha256 is not None and digest != upload.sha256:
+                    if created and not self._referenced(digest):
+                        self.content.delete(digest)
+                    UPLOADS.labels('corrupt').inc()
+                    raise FileSharingError('Conteúdo não confere com o SHA-256 informado', 422)
+                if upload.room_id not in self._rooms:
+                    # Sala encerrada durante o upload
+                    if created and not self._referenced(digest):
+                        self.content.delete(digest)
+                    raise FileSharingError('Sala não encontrada', 404)
+                if not self.content.exists(digest):
+                    # O objeto era de uma sala encerrada agora há pouco: grava de novo
+                    with open(upload.path, 'rb') as f:
+                        self.content.put_stream(f)
+                UPLOADS.labels('stored' if created else 'deduplicated').inc()
+                return self._register(upload.room_id, upload.sid, upload.filename, digest, size)
+        finally:
+            # Mesmo se a cópia falhar: o arquivo parcial não existe mais
+            with self._lock:
+                self._uploads.pop(upload.id, None)
+            self._remove_partial(upload.path)
+
+    def cancel(self, upload_id):
+        with self._lock:
+            upload = self._get(upload_id)
+            if upload.busy:
+                raise FileSharingError('Upload com parte sendo gravada', 409, offset=upload.offset)
+            del self._uploads[upload_id]
+        self._remove_partial(upload.path)
+        UPLOADS.labels('cancelled').inc()
+
+    # ----- Arquivos da sala -----
+
+    def get(self, room_id, digest):
+        """Metadados do arquivo na sala, ou None."""
+        with self._lock:
+            meta = self._rooms.get(room_id, {}).get(digest)
+            return dict(meta) if meta is not None else None
+
+    def list_files(self, room_id):
+        with self._lock:
+            files = sorted(self._rooms.get(room_id, {}).values(), key=lambda meta: meta['timestamp'])
+            return {
+                'files': [dict(meta) for meta in files],
+                'used': self._used(room_id),
+                'quota': self.config['ROOM_QUOTA'],
+            }
+
+    def path(self, digest):
+        return self.content.path(digest)
+
+    def release_room(self, room_id):
+        """Descarta os uploads pendentes da sala e os objetos que só ela usava."""
+        with self._lock:
+            files = self._rooms.pop(room_id, {})
+            uploads = [upload for upload in self._uploads.values() if upload.room_id == room_id and not upload.busy]
+            for upload in uploads:
+                del self._uploads[upload.id]
+            for digest in files:
+                if not self._referenced(digest):
+                    self.content.delete(digest)
+        for upload in uploads:
+            self._remove_partial(upload.path)
+
+    # ----- Internos (com o lock) -----
+
+    def _get(self, upload_id):
+        upload = self._uploads.get(upload_id)
+        if upload is None:
+            raise FileSharingError('Upload não encontrado', 404)
+        return upload
+
+    def _register(self, room_id, sid, filename, digest, size):
+        meta = {
+            'id': digest,
+            'filename': filename,
+            'size': size,
+            'mimetype': self.content_type(digest),
+            'url': f'/api/rooms/{room_id}/files/{digest}',
+            'sharedBy': sid,
+            'timestamp': time.time(),
+        }
+        self._rooms.setdefault(room_id, {})[digest] = meta
+        return dict(meta)
+
+    def _used(self, room_id):
+        files = self._rooms.get(room_id, {})
+        return (sum(meta['size'] for meta in files.values())
+                + sum(upload.size for upload in self._uploads.values() if upload.room_id == room_id))
+
+    def _check_quota(self, room_id, size):
+        used = self._used(room_id)
+        if used + size > self.config['ROOM_QUOTA']:
+            UPLOADS.labels('over_quota').inc()
+            raise FileSharingError('Cota de arquivos da sala excedida', 413,
+                                   used=used, quota=self.config['ROOM_QUOTA'])
+
+    def _referenced(self, digest):
+        return any(digest in files for files in self._rooms.values())
+
+    def _sweep(self):
+        """Descarta uploads parados há mais de ``UPLOAD_TTL`` (e, uma vez, restos de execuções anteriores)."""
+        deadline = time.monotonic() - self.config['UPLOAD_TTL']
+        for upload in [upload for upload in self._uploads.values() if upload.updated_at < deadline and not upload.busy]:
+            del self._uploads[upload.id]
+            self._remove_partial(upload.path)
+            UPLOADS.labels('expired').inc()
+        if not self._orphans_checked:
+            self._orphans_checked = True
+            cutoff = time.time() - self.config['UPLOAD_TTL']
+            try:
+                entries = list(os.scandir(self.partial_dir))
+            except OSError:
+                entries = []
+            for entry in entries:
+                if entry.name not in self._uploads and entry.stat().st_mtime < cutoff:
+                    self._remove_partial(entry.path)
+
+    # ----- Arquivos em disco -----
+
+    def content_type(self, digest):
+        with open(self.content.path(digest), 'rb') as f:
+            return sniff_file_type(f.read(16)) or 'application/octet-stream'
+
+    @staticmethod
+    def _remove_partial(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# Instância global
+file_sharing = FileSharing()
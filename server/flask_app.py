@@ -1,5 +1,5 @@
-from flask import Flask, request, jsonify, send_from_directory, redirect
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask import Flask, Response, g, request, jsonify, redirect, send_file
+from flask_socketio import emit as socketio_emit, join_room, leave_room
 import os
 import logging
 import json
@@ -7,17 +7,29 @@ import time
 import uuid
 import hmac
 import hashlib
-import subprocess
-import sys
+import metrics
+import profiling
+from active_speaker import speaker_tracker
+from config import MEDIA_CONFIG, SERVER_CONFIG
+from instrumentation import InstrumentedSocketIO
+from deploy_queue import deploy_queue
+from file_sharing import FileSharingError, file_sharing
+from log_setup import REQUEST_LOGGER, setup_logging
+from media_service import MediaError, media_service
 from music_service import music_service
+from persistence import PersistenceError, store
+from profiling import require_admin
+from qos import qos_monitor
+from rate_limit import rate_limiter
+from room_directory import RoomDirectory
+from signal_batching import END_OF_CANDIDATES, CandidateBatcher, is_end_of_candidates
+from static_files import IMMUTABLE_MAX_AGE, StaticIndex
+from topology import TopologyPlanner
+from tracing import trace_event, tracer
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='/tmp/mesa_digital_app.log',
-    filemode='a'
-)
+# Configurar logging (sem efeito se o ponto de entrada, ex.: wsgi.py, já configurou)
+setup_logging('/tmp/mesa_digital_app.log')
+request_log = logging.getLogger(REQUEST_LOGGER)
 
 # Log de inicialização
 logging.info("Inicializando aplicação Flask do Mesa Digital")
@@ -33,9 +45,18 @@ else:
 project_dir = os.environ.get('PROJECT_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 logging.info(f"Diretório do projeto: {project_dir}")
 
-# Verificar pasta build
+# Pasta build; verificada na primeira requisição de arquivo, não na importação
 static_folder = os.path.join(project_dir, 'build')
-if not os.path.exists(static_folder):
+_build_checked = False
+
+def ensure_build_folder():
+    """Verificar a pasta build (e criar um index.html provisório em produção)."""
+    global _build_checked
+    if _build_checked:
+        return
+    _build_checked = True
+    if os.path.exists(static_folder):
+        return
     logging.warning(f"AVISO: Pasta build não encontrada em: {static_folder}")
     # Em produção, pode ser necessário criar a pasta build manualmente
     if is_production:
@@ -71,33 +92,105 @@ if not os.path.exists(static_folder):
 
 # Inicializar aplicação Flask
 try:
-    app = Flask(__name__, static_folder=static_folder, static_url_path='')
+    # A rota estática automática do Flask ('/<path:filename>') sombrearia o
+    # fallback da SPA; os arquivos do build são servidos por static_index
+    app = Flask(__name__, static_folder=None)
     app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'mesa_digital_secret_key')
     
     # Configurar Socket.IO com opções corretas para PythonAnywhere
-    socketio = SocketIO(
+    socketio = InstrumentedSocketIO(
         app, 
         cors_allowed_origins="*",
         async_mode='threading'  # Usar threading em vez de eventlet/gevent no PythonAnywhere
     )
+    # Token bucket por cliente (antes das métricas: eventos descartados não entram na latência)
+    socketio.handler_wrappers.append(rate_limiter.wrap)
+    # Span raiz por evento (traceparent opcional no payload), pai dos emits e do yt_dlp
+    socketio.handler_wrappers.append(trace_event)
+    # Contador e histograma de latência para cada @socketio.on
+    socketio.handler_wrappers.append(metrics.instrument_event)
+    # Registro dos eventos acima de PROFILING['SLOW_EVENT_MS']
+    socketio.handler_wrappers.append(profiling.time_event)
     
     # Armazenamento em memória para as salas (em produção, use um banco de dados)
     rooms = {}
     user_room_map = {}
     
+    # Índices das salas para list_rooms e /api/rooms
+    room_directory = RoomDirectory()
+    
+    # Topologia WebRTC (mesh ou relays) de cada sala
+    topology = TopologyPlanner()
+    
+    # Índice em memória dos arquivos do build (ETag, cache e 304)
+    static_index = StaticIndex(static_folder, lazy=True)
+    
+    # Estado ao vivo exposto em /api/metrics
+    metrics.gauge('mesa_rooms', 'Salas ativas', fn=lambda: len(rooms))
+    metrics.gauge('mesa_room_users', 'Usuários em salas', fn=lambda: len(user_room_map))
+    metrics.gauge('mesa_socketio_connections', 'Conexões Engine.IO abertas',
+                  fn=lambda: len(getattr(socketio.server.eio, 'sockets', ())))
+    metrics.gauge('mesa_qos_degraded_links', 'Links de áudio degradados em todas as salas',
+                  fn=qos_monitor.degraded_links)
+    
+    # Dumps periódicos das threads para achar handlers presos (yt_dlp, locks);
+    # não faz nada com THREAD_DUMP_INTERVAL = 0 (padrão)
+    profiling.thread_sampler.start()
+    
     logging.info("Flask e Socket.IO inicializados com sucesso")
 except Exception as e:
     logging.error(f"Erro ao inicializar Flask/SocketIO: {str(e)}")
     logging.exception(e)
     raise
 
+def emit(event, *args, **kwargs):
+    """emit do Flask-SocketIO registrando quantos clientes recebem o evento."""
+    room = kwargs.get('room') or kwargs.get('to')
+    recipients = len(rooms[room]['users']) if room in rooms else 1
+    metrics.SOCKET_FANOUT.labels(event).observe(recipients)
+    with tracer.span(f'emit {event}', recipients=recipients):
+        return socketio_emit(event, *args, **kwargs)
+
+def broadcast(event, data, room_id):
+    """emit para a sala fora de um evento Socket.IO (rotas HTTP)."""
+    recipients = len(rooms[room_id]['users']) if room_id in rooms else 0
+    metrics.SOCKET_FANOUT.labels(event).observe(recipients)
+    with tracer.span(f'emit {event}', recipients=recipients):
+        socketio.emit(event, data, to=room_id)
+
+@app.before_request
+def start_request_span():
+    """Span raiz de cada requisição HTTP, continuando o traceparent do proxy se houver."""
+    rule = request.url_rule.rule if request.url_rule else 'sem rota'
+    g.trace_span = tracer.root(f'http {request.method} {rule}', request.headers.get('traceparent'))
+    g.trace_span.__enter__()
+
+@app.after_request
+def tag_request_span(response):
+    span = g.get('trace_span')
+    if span is not None:
+        span.set('status', response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_span(error=None):
+    span = g.pop('trace_span', None)
+    if span is not None:
+        span.__exit__(type(error) if error else None, error, None)
+
 # ----- Rotas da API -----
 
+def serve_static(path):
+    """Servir um arquivo do build a partir do índice estático."""
+    ensure_build_folder()
+    status, headers, body = static_index.serve(request.environ, path)
+    return Response(body, status=status, headers=headers, direct_passthrough=True)
+
 @app.route('/')
 def serve_frontend():
     """Servir a aplicação React."""
-    logging.info("Requisição recebida para rota principal '/'")
-    return send_from_directory(app.static_folder, 'index.html')
+    request_log.info("Requisição recebida para rota principal '/'")
+    return serve_static('index.html')
 
 @app.route('/webhook/github', methods=['POST'])
 def github_webhook():
@@ -138,26 +231,21 @@ def github_webhook():
     if ref != 'refs/heads/main':
         return jsonify({"status": "ignored", "message": f"Push para {ref} ignorado"}), 200
     
-    # Iniciar processo de atualização em segundo plano
+    # Enfileirar o deploy; pushes em sequência viram um único job
     try:
-        # Executar o script em processo separado para não bloquear
-        update_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'update_from_github.py')
-        logging.info(f"Iniciando script de atualização: {update_script}")
-        
-        # Usar Python do ambiente atual
-        python_exec = sys.executable
-        subprocess.Popen([python_exec, update_script])
-        
+        job = deploy_queue.submit(ref, commit=payload.get('after'), source='flask_app')
         return jsonify({
-            "status": "success", 
-            "message": "Atualização iniciada em segundo plano"
-        }), 200
+            "status": "queued", 
+            "message": "Atualização enfileirada",
+            "job": job['id'],
+            "status_url": f"/api/deploy/jobs/{job['id']}"
+        }), 202
     except Exception as e:
-        logging.error(f"Erro ao iniciar atualização: {str(e)}")
+        logging.error(f"Erro ao enfileirar atualização: {str(e)}")
         logging.exception(e)
         return jsonify({
             "status": "error", 
-            "message": f"Erro ao iniciar atualização: {str(e)}"
+            "message": f"Erro ao enfileirar atualização: {str(e)}"
         }), 500
 
 @app.route('/git-webhook', methods=['POST'])
@@ -166,6 +254,21 @@ def github_webhook_compat():
     logging.info("Webhook recebido na rota de compatibilidade /git-webhook")
     return github_webhook()
 
+@app.route('/api/deploy/jobs', methods=['GET'])
+@require_admin
+def deploy_jobs():
+    """Deploys recentes disparados pelo webhook"""
+    return jsonify({"jobs": deploy_queue.recent()})
+
+@app.route('/api/deploy/jobs/<job_id>', methods=['GET'])
+@require_admin
+def deploy_job_status(job_id):
+    """Status de um deploy enfileirado pelo webhook"""
+    job = deploy_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job não encontrado"}), 404
+    return jsonify(job)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Endpoint para verificar se a aplicação está funcionando"""
@@ -176,15 +279,252 @@ def health_check():
         "environment": "production" if is_production else "development"
     })
 
+@app.route('/api/rooms', methods=['GET'])
+def list_rooms():
+    """Salas ativas; mesmos parâmetros do evento list_rooms (needs/has separados por vírgula)."""
+    try:
+        return jsonify(query_rooms(request.args))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/rooms/<room_id>/quality', methods=['GET'])
+def room_quality(room_id):
+    """Percentis de jitter, perda e bitrate da sala por participante e por link (janela QOS['WINDOW_S'])."""
+    if room_id not in rooms:
+        return jsonify({'error': 'Sala não encontrada'}), 404
+    quality = qos_monitor.quality(room_id)
+    if quality is None:
+        quality = {'roomId': room_id, 'windowS': qos_monitor.config['WINDOW_S'], 'samples': 0,
+                   'participants': {}, 'links': [], 'degradedLinks': 0}
+    return jsonify(quality)
+
+# ----- Agenda e setlists (mesma API do controllers/persistence.js) -----
+
+def json_body():
+    """Corpo JSON da requisição como dict, ou None se não for um objeto."""
+    body = request.get_json(silent=True)
+    return body if isinstance(body, dict) else None
+
+@app.errorhandler(PersistenceError)
+def persistence_error(e):
+    return jsonify({'error': 'Erro ao gravar dados'}), 500
+
+@app.route('/api/events', methods=['GET'])
+def get_events():
+    """Eventos da agenda; ``?from=`` (ISO) lista só os que começam a partir da data."""
+    return Response(store.events_json(request.args.get('from')), mimetype='application/json')
+
+@app.route('/api/events', methods=['POST'])
+def create_event():
+    body = json_body()
+    if body is None:
+        return jsonify({'error': 'JSON inválido'}), 400
+    try:
+        return jsonify(store.create_event(body))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/events/<event_id>', methods=['DELETE'])
+def delete_event(event_id):
+    store.delete_event(event_id)
+    return jsonify({'success': True})
+
+@app.route('/api/setlists', methods=['GET'])
+def get_setlists():
+    return Response(store.setlists_json(), mimetype='application/json')
+
+@app.route('/api/setlists', methods=['POST'])
+def save_setlist():
+    body = json_body()
+    if body is None:
+        return jsonify({'error': 'JSON inválido'}), 400
+    return jsonify(store.save_setlist(body))
+
+@app.route('/api/setlists/<setlist_id>', methods=['DELETE'])
+def delete_setlist(setlist_id):
+    store.delete_setlist(setlist_id)
+    return jsonify({'success': True})
+
+# ----- Mídia (media_service.py) -----
+
+@app.errorhandler(MediaError)
+def media_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+@app.route('/api/media', methods=['POST'])
+def upload_media():
+    """Upload de imagem (multipart ``file`` ou corpo cru); responde com o hash e as miniaturas."""
+    # Folga para os cabeçalhos do multipart; o limite exato é aplicado na cópia
+    if (request.content_length or 0) > MEDIA_CONFIG['MAX_UPLOAD_SIZE'] + 64 * 1024:
+        return jsonify({'error': 'Arquivo muito grande'}), 413
+    upload = request.files.get('file')
+    if upload is not None:
+        return jsonify(media_service.save_upload(upload.stream, upload.filename)), 201
+    if not request.content_length:
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+    return jsonify(media_service.save_upload(request.stream)), 201
+
+@app.route('/media/<digest>', methods=['GET'])
+@app.route('/media/<digest>/<size>', methods=['GET'])
+def serve_media(digest, size=None):
+    """Imagem (ou miniatura) pelo hash do conteúdo: imutável, cache de um ano."""
+    if size is None:
+        path, final = media_service.original_path(digest), True
+    else:
+        path, final = media_service.thumbnail_path(digest, size)
+    if path is None:
+        return jsonify({'error': 'Not found'}), 404
+    max_age = IMMUTABLE_MAX_AGE if final else SERVER_CONFIG['CACHE']['STATIC_MAX_AGE']
+    response = send_file(path, mimetype=media_service.content_type(path), conditional=True,
+                         etag=f"{digest}-{size or 'original'}", max_age=max_age)
+    # Sem miniatura (sem Pillow ou falha) o original não pode ficar preso no cache para sempre
+    response.headers['Cache-Control'] = f"public, max-age={max_age}" + (', immutable' if final else '')
+    return response
+
+@app.route('/api/media/remote', methods=['GET'])
+def remote_media():
+    """Miniatura remota (capa de música) baixada uma vez e redirecionada para /media."""
+    url = request.args.get('url')
+    if not media_service.allowed_remote(url):
+        return jsonify({'error': 'Host não permitido'}), 400
+    size = request.args.get('size') or media_service.size_names[0]
+    digest = media_service.fetch_remote(url)
+    if digest is None:
+        response = redirect(url)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    response = redirect(f'/media/{digest}/{size}')
+    response.headers['Cache-Control'] = f"public, max-age={SERVER_CONFIG['CACHE']['STATIC_MAX_AGE']}"
+    return response
+
+# ----- Arquivos compartilhados nas salas (upload em partes, retomável) -----
+
+@app.errorhandler(FileSharingError)
+def file_sharing_error(e):
+    return jsonify(dict(e.details, error=str(e))), e.status
+
+@app.route('/api/rooms/<room_id>/uploads', methods=['POST'])
+def start_upload(room_id):
+    """Abrir um upload (``sid``, ``filename``, ``size`` e, opcional, ``sha256``).
+
+    Se o arquivo já está na sala, nada é enviado (resposta com ``file``);
+    senão, a resposta traz ``uploadId`` e ``offset``.
+    """
+    body = json_body()
+    if body is None:
+        return jsonify({'error': 'Dados inválidos'}), 400
+    sid = body.get('sid')
+    if room_id not in rooms or user_room_map.get(sid) != room_id:
+        return jsonify({'error': 'Usuário não está na sala'}), 403
+    meta, upload = file_sharing.start(room_id, sid, body.get('filename'), body.get('size'), body.get('sha256'))
+    if meta is not None:
+        publish_shared_file(room_id, meta)
+        return jsonify({'file': meta}), 201
+    return jsonify(upload), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Offset já gravado, para retomar o upload."""
+    return jsonify(file_sharing.status(upload_id))
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+def upload_chunk(upload_id):
+    """Gravar uma parte a partir do header ``Upload-Offset``; 409 com o offset atual se fora de ordem."""
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Header Upload-Offset ausente ou inválido'}), 400
+    progress, meta = file_sharing.append(upload_id, offset, request.stream, request.content_length)
+    if progress is not None:
+        broadcast('upload_progress', progress, progress['roomId'])
+    if meta is not None:
+        publish_shared_file(progress['roomId'], meta)
+        return jsonify({'offset': meta['size'], 'file': meta})
+    status = file_sharing.status(upload_id)
+    return jsonify({'offset': status['offset']})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    file_sharing.cancel(upload_id)
+    return jsonify({'success': True})
+
+def publish_shared_file(room_id, meta):
+    """Avisar a sala de um arquivo novo (mesmo evento do servidor Node.js)."""
+    user = rooms.get(room_id, {}).get('users', {}).get(meta['sharedBy'], {})
+    broadcast('file_shared', dict(meta,
+                                  type='pdf' if meta['mimetype'] == 'application/pdf' else 'file',
+                                  sharedByName=user.get('name', 'Usuário')), room_id)
+
+@app.route('/api/rooms/<room_id>/files', methods=['GET'])
+def list_room_files(room_id):
+    """Arquivos da sala e uso da cota (só para quem está nela: ``?sid=``)."""
+    if room_id not in rooms or user_room_map.get(request.args.get('sid')) != room_id:
+        return jsonify({'error': 'Usuário não está na sala'}), 403
+    return jsonify(file_sharing.list_files(room_id))
+
+@app.route('/api/rooms/<room_id>/files/<digest>', methods=['GET'])
+def download_room_file(room_id, digest):
+    """Conteúdo de um arquivo da sala (``?sid=`` de quem está nela); aceita Range e requisições condicionais."""
+    if room_id not in rooms or user_room_map.get(request.args.get('sid')) != room_id:
+        return jsonify({'error': 'Usuário não está na sala'}), 403
+    meta = file_sharing.get(room_id, digest)
+    if meta is None:
+        return jsonify({'error': 'Not found'}), 404
+    inline = meta['mimetype'] != 'application/octet-stream'
+    response = send_file(file_sharing.path(digest), mimetype=meta['mimetype'], conditional=True,
+                         etag=digest, max_age=IMMUTABLE_MAX_AGE,
+                         as_attachment=not inline, download_name=meta['filename'])
+    # O endereço é da sala, mas o conteúdo nunca muda
+    response.headers['Cache-Control'] = f'private, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas no formato de exposição do Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/admin/profile/start', methods=['POST'])
+@require_admin
+def profile_start():
+    """Iniciar o profiler por amostragem por ?seconds=N"""
+    seconds = request.args.get('seconds', 10, type=float)
+    if not profiling.profiler.start(seconds):
+        return jsonify({"status": "error", "message": "Profiler já está em execução"}), 409
+    return jsonify({"status": "started", **profiling.profiler.status()})
+
+@app.route('/api/admin/profile/stop', methods=['POST'])
+@require_admin
+def profile_stop():
+    """Interromper a coleta em andamento"""
+    profiling.profiler.stop()
+    return jsonify({"status": "stopped", **profiling.profiler.status()})
+
+@app.route('/api/admin/profile', methods=['GET'])
+@require_admin
+def profile_download():
+    """Baixar o resultado como pilhas colapsadas (flamegraph.pl / speedscope)"""
+    if profiling.profiler.running:
+        return jsonify({"status": "running", **profiling.profiler.status()}), 409
+    if not profiling.profiler.samples:
+        return jsonify({"status": "error", "message": "Nenhuma coleta disponível"}), 404
+    filename = time.strftime('mesa-profile-%Y%m%d-%H%M%S.folded',
+                             time.localtime(profiling.profiler.started_at))
+    return Response(profiling.profiler.collapsed(), content_type='text/plain; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/admin/threads', methods=['GET'])
+@require_admin
+def thread_dumps():
+    """Dump atual das threads seguido dos dumps periódicos recentes"""
+    text = f"=== agora\n{profiling.thread_dump()}\n{profiling.thread_sampler.latest()}"
+    return Response(text, content_type='text/plain; charset=utf-8')
+
 @app.route('/<path:path>')
 def static_proxy(path):
     """Servir arquivos estáticos da aplicação React."""
-    file_path = os.path.join(app.static_folder, path)
-    if os.path.isfile(file_path):
-        return send_from_directory(app.static_folder, path)
-    else:
-        # Para aplicativos de página única, retornar index.html para todas as rotas não encontradas
-        return send_from_directory(app.static_folder, 'index.html')
+    # Para aplicativos de página única, rotas não encontradas no índice recebem index.html
+    return serve_static(path)
 
 # ----- Socket.IO Event Handlers -----
 
@@ -192,14 +532,18 @@ def static_proxy(path):
 def handle_connect():
     """Manipular conexão do cliente."""
     client_id = request.sid
-    logging.info(f"Novo cliente conectado: {client_id}")
+    request_log.info("Novo cliente conectado: %s", client_id)
     emit('connection_established', {'id': client_id})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Manipular desconexão do cliente."""
     client_id = request.sid
-    logging.info(f"Cliente desconectado: {client_id}")
+    request_log.info("Cliente desconectado: %s", client_id)
+    
+    # Candidatos ICE ainda não entregues de/para o cliente
+    candidate_batcher.discard(client_id)
+    rate_limiter.discard(client_id)
     
     # Remover usuário das salas
     if client_id in user_room_map:
@@ -207,20 +551,35 @@ def handle_disconnect():
         if room_id in rooms and client_id in rooms[room_id]['users']:
             user_info = rooms[room_id]['users'][client_id]
             del rooms[room_id]['users'][client_id]
+            room_directory.remove_user(room_id, user_info.get('instrument'))
             
             # Notificar outros na sala
             emit('user_left', {
                 'userId': client_id, 
                 'userName': user_info.get('name', 'Unknown')
             }, room=room_id)
+            publish_plan(topology.leave(room_id, client_id))
+            qos_monitor.leave(room_id, client_id)
+            publish_speaker_hints(room_id, speaker_tracker.leave(room_id, client_id))
             
             # Remover sala se estiver vazia
             if not rooms[room_id]['users']:
-                del rooms[room_id]
-                logging.info(f"Sala removida: {room_id}")
+                remove_room(room_id)
         
         del user_room_map[client_id]
 
+def remove_room(room_id):
+    """Descartar a sala vazia e tudo o que é mantido por sala."""
+    del rooms[room_id]
+    room_directory.remove_room(room_id)
+    # A playlist sai da memória e do banco
+    music_service.release_room(room_id)
+    qos_monitor.release_room(room_id)
+    speaker_tracker.release_room(room_id)
+    # Uploads pendentes e arquivos que nenhuma outra sala usa
+    file_sharing.release_room(room_id)
+    logging.info(f"Sala removida: {room_id}")
+
 @socketio.on('create_room')
 def handle_create_room(data):
     """Criar uma nova sala."""
@@ -245,6 +604,10 @@ def handle_create_room(data):
         }
     }
     
+    room_directory.add_room(room_id, rooms[room_id]['created_at'], name)
+    room_directory.add_user(room_id, instrument)
+    music_service.open_room(room_id)
+    
     # Associar usuário à sala
     user_room_map[client_id] = room_id
     
@@ -258,7 +621,8 @@ def handle_create_room(data):
         'success': True,
         'room': {
             'id': room_id,
-            'users': [rooms[room_id]['users'][client_id]]
+            'users': [rooms[room_id]['users'][client_id]],
+            'plan': topology.join(room_id, client_id)[client_id]
         }
     }
 
@@ -270,17 +634,33 @@ def handle_join_room(data):
     name = data.get('name', 'Anonymous')
     instrument = data.get('instrument', 'Unknown')
     
+    # Sala perdida num reinício do servidor: reabre com o mesmo id e a playlist salva
+    restored = False
+    if isinstance(room_id, str) and room_id and room_id not in rooms and music_service.can_restore(room_id):
+        rooms[room_id] = {'id': room_id, 'created_at': time.time(), 'users': {}}
+        room_directory.add_room(room_id, rooms[room_id]['created_at'], name)
+        music_service.open_room(room_id)
+        restored = True
+        logging.info(f"Sala reaberta depois de reinício: {room_id} por {name}")
+    
     # Verificar se a sala existe
     if not room_id or room_id not in rooms:
         return {'error': 'Sala não encontrada'}
     
+    # Reentrada do mesmo cliente substitui o registro anterior
+    previous = rooms[room_id]['users'].get(client_id)
+    if previous:
+        room_directory.remove_user(room_id, previous.get('instrument'))
+    
     # Adicionar usuário à sala
     rooms[room_id]['users'][client_id] = {
         'id': client_id,
         'name': name,
         'instrument': instrument,
-        'isAdmin': False
+        # Quem reabre a sala fica no lugar de quem a criou
+        'isAdmin': restored
     }
+    room_directory.add_user(room_id, instrument)
     
     # Associar usuário à sala
     user_room_map[client_id] = room_id
@@ -295,12 +675,20 @@ def handle_join_room(data):
     
     logging.info(f"Usuário {name} entrou na sala: {room_id}")
     
+    # O novo usuário recebe o plano na resposta; os demais, pelo evento
+    views = topology.join(room_id, client_id)
+    plan = views.pop(client_id)
+    publish_plan(views)
+    
     # Retornar informações da sala
     return {
         'success': True,
         'room': {
             'id': room_id,
-            'users': list(rooms[room_id]['users'].values())
+            'users': list(rooms[room_id]['users'].values()),
+            'plan': plan,
+            'speakers': speaker_tracker.hints(room_id),
+            'isAdmin': restored
         }
     }
 
@@ -321,6 +709,7 @@ def handle_leave_room(data):
     
     # Remover usuário da sala
     del rooms[room_id]['users'][client_id]
+    room_directory.remove_user(room_id, user_info.get('instrument'))
     
     # Remover associação
     if client_id in user_room_map:
@@ -334,14 +723,37 @@ def handle_leave_room(data):
         'userId': client_id,
         'userName': user_info.get('name', 'Unknown')
     }, room=room_id)
+    publish_plan(topology.leave(room_id, client_id))
+    qos_monitor.leave(room_id, client_id)
+    publish_speaker_hints(room_id, speaker_tracker.leave(room_id, client_id))
     
     # Remover sala se estiver vazia
     if not rooms[room_id]['users']:
-        del rooms[room_id]
-        logging.info(f"Sala removida: {room_id}")
+        remove_room(room_id)
     
     return {'success': True}
 
+def query_rooms(params):
+    """Consultar o diretório de salas com os filtros de ``params`` (dict)."""
+    return room_directory.query(
+        limit=params.get('limit') or 20,
+        cursor=params.get('cursor'),
+        sort=params.get('sort') or 'created',
+        order=params.get('order') or 'desc',
+        needs=params.get('needs') or (),
+        has=params.get('has') or (),
+        min_users=params.get('minUsers'),
+        max_users=params.get('maxUsers')
+    )
+
+@socketio.on('list_rooms')
+def handle_list_rooms(data=None):
+    """Listar salas ativas (paginado; filtros por instrumento e ocupação)."""
+    try:
+        return query_rooms(data if isinstance(data, dict) else {})
+    except (TypeError, ValueError) as e:
+        return {'error': str(e)}
+
 @socketio.on('send_message')
 def handle_send_message(data):
     """Enviar mensagem para todos na sala."""
@@ -365,35 +777,73 @@ def handle_send_message(data):
         'timestamp': time.time()
     }
     
+    # Arquivos vão por HTTP (/api/rooms/<sala>/uploads); a mensagem leva só a referência
+    if data.get('fileId') is not None:
+        file_meta = file_sharing.get(room_id, data.get('fileId'))
+        if file_meta is None:
+            return {'error': 'Arquivo não encontrado na sala'}
+        message.update(type='file', text=message['text'] or file_meta['filename'], file=file_meta)
+    
     # Enviar para todos na sala
     emit('chat_message', message, room=room_id)
     
     return {'success': True}
 
+def in_same_room(user_a, user_b, room_id):
+    """Verificar se os dois usuários estão na sala ``room_id``."""
+    return (user_a in user_room_map and user_b in user_room_map and
+            user_room_map[user_a] == room_id and user_room_map[user_b] == room_id)
+
+def deliver_candidates(from_user, to, signals):
+    """Entregar um lote de candidatos ICE (chamado pelo candidate_batcher)."""
+    # O destino pode ter saído da sala durante a janela de agrupamento
+    room_id = user_room_map.get(from_user)
+    if room_id is None or user_room_map.get(to) != room_id:
+        return
+    metrics.SOCKET_FANOUT.labels('webrtc_signals').observe(1)
+    with tracer.span('emit webrtc_signals', recipients=1, signals=len(signals)):
+        socketio.emit('webrtc_signals', {'from': from_user, 'signals': signals}, to=to)
+
+candidate_batcher = CandidateBatcher(deliver_candidates)
+
 @socketio.on('webrtc_signal')
 def handle_webrtc_signal(data):
-    """Repassar sinais WebRTC entre clientes."""
+    """Repassar sinais WebRTC entre clientes.
+    
+    Candidatos ICE são agrupados por par e entregues em ``webrtc_signals``;
+    ofertas e respostas seguem na hora, depois dos candidatos pendentes.
+    """
     to = data.get('to')
     from_user = request.sid
     signal = data.get('signal')
     signal_type = data.get('type')
     room_id = data.get('roomId')
+    end_of_candidates = is_end_of_candidates(signal_type, signal)
     
     # Verificar dados
-    if not to or not signal or not signal_type or not room_id:
+    if not to or not signal_type or not room_id or (not signal and not end_of_candidates):
         return {'error': 'Dados incompletos'}
     
+    if signal_type == 'candidate' or end_of_candidates:
+        # Um lote aberto para o par já teve a sala verificada no primeiro candidato
+        if not candidate_batcher.pending(from_user, to) and not in_same_room(from_user, to, room_id):
+            return {'error': 'Usuários não estão na mesma sala'}
+        if end_of_candidates:
+            candidate_batcher.add(from_user, to, {'type': END_OF_CANDIDATES, 'signal': None}, flush=True)
+        else:
+            candidate_batcher.add(from_user, to, {'type': signal_type, 'signal': signal})
+        return {'success': True}
+    
     # Verificar se ambos estão na mesma sala
-    if (to not in user_room_map or from_user not in user_room_map or
-            user_room_map[to] != room_id or user_room_map[from_user] != room_id):
+    if not in_same_room(from_user, to, room_id):
         return {'error': 'Usuários não estão na mesma sala'}
     
-    # Repassar sinal
-    emit('webrtc_signal', {
+    # Repassar sinal (oferta/resposta) imediatamente
+    candidate_batcher.send_now(from_user, to, lambda: emit('webrtc_signal', {
         'from': from_user,
         'signal': signal,
         'type': signal_type
-    }, room=to)
+    }, room=to))
     
     return {'success': True}
 
@@ -444,6 +894,78 @@ def handle_ping_response(data):
     
     return {'success': True}
 
+def publish_plan(views):
+    """Enviar a cada participante a sua parte nova do plano de conexões."""
+    for sid, view in views.items():
+        emit('connection_plan', view, room=sid)
+
+@socketio.on('network_report')
+def handle_network_report(data):
+    """Receber uplink e RTTs medidos pelo cliente para o plano de topologia."""
+    client_id = request.sid
+    room_id = data.get('roomId')
+    
+    if not room_id or user_room_map.get(client_id) != room_id:
+        return {'error': 'Usuário não está na sala'}
+    
+    rtts = data.get('rtts') or {}
+    if not isinstance(rtts, dict):
+        return {'error': 'Dados inválidos'}
+    
+    try:
+        views = topology.report(room_id, client_id,
+                               uplink_kbps=data.get('uplinkKbps'),
+                               rtts=rtts,
+                               stream_id=data.get('streamId'))
+    except (TypeError, ValueError):
+        return {'error': 'Dados inválidos'}
+    
+    publish_plan(views)
+    return {'success': True}
+
+@socketio.on('qos_report')
+def handle_qos_report(data):
+    """Receber jitter, perda e bitrate do áudio recebido de cada par (telemetria de qualidade)."""
+    client_id = request.sid
+    room_id = data.get('roomId')
+    
+    if not room_id or user_room_map.get(client_id) != room_id:
+        return {'error': 'Usuário não está na sala'}
+    
+    links = data.get('links')
+    if not isinstance(links, dict):
+        return {'error': 'Dados inválidos'}
+    
+    for alert in qos_monitor.report(room_id, client_id, links, members=rooms[room_id]['users']):
+        if alert['state'] == 'degraded':
+            logging.warning(f"Link de áudio degradado na sala {room_id}: {alert['from']} -> {alert['to']} "
+                            f"({', '.join(alert['reasons'])})")
+        else:
+            logging.info(f"Link de áudio recuperado na sala {room_id}: {alert['from']} -> {alert['to']}")
+        emit('qos_alert', alert, room=room_id)
+    return {'success': True}
+
+def publish_speaker_hints(room_id, hints):
+    """Enviar uma versão nova das dicas de falante ativo para a sala."""
+    if hints is not None:
+        emit('speaker_hints', hints, room=room_id)
+
+@socketio.on('audio_level')
+def handle_audio_level(data):
+    """Receber o nível do microfone do cliente (RMS de 0 a 1 numa janela curta)."""
+    client_id = request.sid
+    room_id = data.get('roomId')
+    
+    if not room_id or user_room_map.get(client_id) != room_id:
+        return {'error': 'Usuário não está na sala'}
+    
+    level = data.get('level')
+    if isinstance(level, bool) or not isinstance(level, (int, float)) or level != level:
+        return {'error': 'Dados inválidos'}
+    
+    publish_speaker_hints(room_id, speaker_tracker.report(room_id, client_id, level))
+    return {'success': True}
+
 @socketio.on('request_reconnect')
 def handle_reconnect_request(data):
     """Repassar pedidos de reconexão."""
@@ -485,41 +1007,53 @@ def stream_music(video_id):
 
 # ----- Music Socket Events -----
 
+def publish_playlist_ops(room_id):
+    """Callback que envia à sala só as operações aplicadas na playlist."""
+    def publish(epoch, ops):
+        emit('music_playlist_ops', {'roomId': room_id, 'epoch': epoch, 'ops': ops}, room=room_id)
+    return publish
+
+def in_room(room_id):
+    """O cliente da conexão atual está na sala ``room_id``."""
+    return bool(room_id) and user_room_map.get(request.sid) == room_id
+
+def playlist_edit(data, edit):
+    """Roda ``edit(room_id)`` e responde o ack com a versão nova."""
+    room_id = data.get('roomId') if isinstance(data, dict) else None
+    if not room_id:
+        return {'error': 'Invalid data'}
+    if not in_room(room_id):
+        return {'error': 'Usuário não está na sala'}
+    try:
+        ops = edit(room_id)
+    except (KeyError, TypeError, ValueError) as e:
+        return {'error': f'Invalid data: {str(e)}'}
+    return {'success': True, 'ops': ops}
+
 @socketio.on('music_add_song')
 def handle_music_add(data):
-    """Adicionar música à playlist da sala."""
-    room_id = data.get('roomId')
-    song_data = data.get('song')
-    
-    if not room_id or not song_data:
-        return {'error': 'Invalid data'}
-    
-    entry = music_service.add_to_playlist(room_id, song_data)
-    
-    # Broadcast playlist atualizada
-    emit('music_playlist_updated', {
-        'playlist': music_service.get_playlist(room_id),
-        'added_song': entry
-    }, room=room_id)
-    
-    return {'success': True}
+    """Adicionar música à playlist da sala (no fim, ou depois de ``after``)."""
+    position = {'after': data['after']} if isinstance(data, dict) and 'after' in data else {}
+    return playlist_edit(data, lambda room_id: music_service.add_to_playlist(
+        room_id, data['song'], publish_playlist_ops(room_id), **position))
 
 @socketio.on('music_remove_song')
 def handle_music_remove(data):
     """Remover música da playlist."""
-    room_id = data.get('roomId')
-    song_uuid = data.get('uuid')
-    
-    if not room_id or not song_uuid:
-        return {'error': 'Invalid data'}
-    
-    music_service.remove_from_playlist(room_id, song_uuid)
-    
-    emit('music_playlist_updated', {
-        'playlist': music_service.get_playlist(room_id)
-    }, room=room_id)
-    
-    return {'success': True}
+    return playlist_edit(data, lambda room_id: music_service.remove_from_playlist(
+        room_id, data['uuid'], publish_playlist_ops(room_id)))
+
+@socketio.on('music_move_song')
+def handle_music_move(data):
+    """Mover música para depois de ``after`` (null = início)."""
+    return playlist_edit(data, lambda room_id: music_service.move_song(
+        room_id, data['uuid'], data.get('after'), publish_playlist_ops(room_id)))
+
+@socketio.on('music_reorder_playlist')
+def handle_music_reorder(data):
+    """Reordenar a playlist inteira por uma lista de UUIDs (vira uma sequência de moves)."""
+    return playlist_edit(data, lambda room_id: music_service.reorder_playlist(
+        room_id, list(data['order']), publish_playlist_ops(room_id)))
 
 @socketio.on('music_play')
 def handle_music_play(data):
@@ -529,8 +1063,13 @@ def handle_music_play(data):
     
     if not room_id or not song_uuid:
         return {'error': 'Invalid data'}
+    if not in_room(room_id):
+        return {'error': 'Usuário não está na sala'}
     
-    # Aqui poderíamos marcar como 'playing' no serviço
+    try:
+        music_service.play_song(room_id, song_uuid, publish_playlist_ops(room_id))
+    except KeyError:
+        return {'error': 'Sala não encontrada'}
     
     emit('music_now_playing', {
         'uuid': song_uuid,
@@ -541,11 +1080,31 @@ def handle_music_play(data):
 
 @socketio.on('get_playlist')
 def handle_get_playlist(data):
-    """Obter playlist atual."""
+    """Obter playlist atual (com ``epoch`` e ``version`` para acompanhar os deltas)."""
     room_id = data.get('roomId')
-    if room_id:
-        return {'playlist': music_service.get_playlist(room_id)}
-    return {'error': 'Room ID required'}
+    if not room_id:
+        return {'error': 'Room ID required'}
+    if not in_room(room_id):
+        return {'error': 'Usuário não está na sala'}
+    try:
+        return music_service.playlist_state(room_id)
+    except KeyError:
+        return {'error': 'Sala não encontrada'}
+
+@socketio.on('music_sync')
+def handle_music_sync(data):
+    """Cliente atrasado: operações desde ``version`` ou, fora do log, a playlist inteira."""
+    room_id = data.get('roomId')
+    if not room_id:
+        return {'error': 'Room ID required'}
+    if not in_room(room_id):
+        return {'error': 'Usuário não está na sala'}
+    version = data.get('version')
+    try:
+        return music_service.sync_playlist(room_id, data.get('epoch'),
+                                           version if isinstance(version, int) else None)
+    except KeyError:
+        return {'error': 'Sala não encontrada'}
 
 @socketio.on('time_sync')
 def handle_time_sync(data):
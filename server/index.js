@@ -50,6 +50,13 @@ const io = require('socket.io')(http, {
   pingInterval: 5000
 });
 
+// Com vários processos atrás do proxy WSGI, o prefixo do sid indica ao proxy
+// qual processo guarda a sessão (ver BackendPool em server/upstream.py)
+if (process.env.BACKEND_ID) {
+  const crypto = require('crypto');
+  io.engine.generateId = () => `${process.env.BACKEND_ID}.${crypto.randomBytes(15).toString('base64url')}`;
+}
+
 // Middleware
 app.use(express.json());
 app.use(express.static(path.join(__dirname, '../build')));
@@ -1,9 +1,11 @@
 from flask import Flask, send_from_directory, request, Response
 from dotenv import load_dotenv
 import os
-import requests
 from flask_cors import CORS
 from flask_socketio import SocketIO
+import requests
+from upstream import (BackendPool, HealthMonitor, RoutePolicies, StreamedBody, affinity_keys,
+                      create_session, forward_headers, request_body)
 
 # Load environment variables
 load_dotenv()
@@ -13,30 +15,56 @@ app = Flask(__name__, static_folder='../build', static_url_path='/')
 CORS(app, resources={r"/*": {"origins": "*"}})
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Node.js server URL
+# Node.js server URLs (comma-separated NODE_BACKENDS to scale out on one host)
 NODE_SERVER = 'http://localhost:5000'
+NODE_BACKENDS = [url.strip() for url in os.environ.get('NODE_BACKENDS', NODE_SERVER).split(',') if url.strip()]
+
+# Pooled keep-alive connections and health-checked, room-affine backend selection
+backend_pool = BackendPool(NODE_BACKENDS)
+upstream_session = create_session()
+# Per-route (connect, read) timeouts from SERVER_CONFIG['PROXY'], same as the WSGI proxy
+route_policies = RoutePolicies()
+health_monitor = HealthMonitor(backend_pool.backends)
+health_monitor.start()
 
 # Proxy API requests to Node.js server
 @app.route('/api/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def proxy_api(path):
-    url = f'{NODE_SERVER}/api/{path}'
+    sid, room_id, pinned = affinity_keys(request.environ)
+    backend = backend_pool.select(sid=sid, room_id=room_id, pinned=pinned)
+    if backend is None:
+        return Response('Node.js server is not running', 502, content_type='text/plain')
+    url = f'{backend.url}/api/{path}'
+    body = request_body(request.stream, request.content_length)
+    policy = route_policies.match(request.method, f'/api/{path}', has_body=body is not None)
     
-    # Forward the request to the Node.js server
-    resp = requests.request(
-        method=request.method,
-        url=url,
-        headers={key: value for (key, value) in request.headers if key != 'Host'},
-        data=request.get_data(),
-        cookies=request.cookies,
-        allow_redirects=False
-    )
-
-    # Create Flask Response object
-    excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-    headers = [(name, value) for (name, value) in resp.raw.headers.items()
-               if name.lower() not in excluded_headers]
-
-    response = Response(resp.content, resp.status_code, headers)
+    # Forward the request to the Node.js server, streaming the body in chunks
+    backend.acquire()
+    try:
+        resp = upstream_session.request(
+            method=request.method,
+            url=url,
+            headers={key: value for (key, value) in forward_headers(request.headers.items())
+                     if key.lower() not in ('host', 'content-length')},
+            data=body,
+            allow_redirects=False,
+            stream=True,
+            timeout=policy.timeout
+        )
+    except requests.exceptions.Timeout:
+        backend.release()
+        backend.record_failure()
+        return Response('Gateway Timeout', 504, content_type='text/plain')
+    except Exception:
+        backend.release()
+        backend.record_failure()
+        raise
+    backend.record_success()
+
+    # Relay the raw (still encoded) upstream body chunk by chunk
+    headers = forward_headers(resp.raw.headers.items())
+    response = Response(StreamedBody(resp, on_close=backend.release), resp.status_code, headers,
+                        direct_passthrough=True)
     return response
 
 # Serve static files
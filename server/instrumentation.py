@@ -0,0 +1,63 @@
+"""
+Ponto único de instrumentação dos handlers Socket.IO.
+
+``InstrumentedSocketIO`` aplica a cada handler registrado com
+``@socketio.on`` os wrappers de ``handler_wrappers`` (métricas, etc.).
+Cada wrapper recebe ``(evento, handler)`` e devolve o handler envolvido;
+o primeiro da lista fica mais externo.
+"""
+import inspect
+
+from flask_socketio import SocketIO
+
+
+def _accepted_args(handler):
+    """Quantidade de argumentos posicionais aceitos por ``handler`` (None = ilimitado)."""
+    try:
+        parameters = inspect.signature(handler).parameters.values()
+    except (TypeError, ValueError):
+        return None
+    count = 0
+    for parameter in parameters:
+        if parameter.kind == parameter.VAR_POSITIONAL:
+            return None
+        if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD):
+            count += 1
+    return count
+
+
+def _trim_args(handler):
+    """Recorta os argumentos extras antes de chamar ``handler``.
+
+    O Flask-SocketIO chama o handler de connect com ``auth`` e repete a
+    chamada sem argumentos se receber TypeError; com o wrapper no meio essa
+    repetição contaria (e mediria) o evento duas vezes.
+    """
+    accepted = _accepted_args(handler)
+    if accepted is None:
+        return handler
+
+    def trimmed(*args):
+        return handler(*args[:accepted])
+
+    return trimmed
+
+
+class InstrumentedSocketIO(SocketIO):
+    """SocketIO que envolve cada handler com os wrappers de ``handler_wrappers``."""
+
+    def __init__(self, *args, **kwargs):
+        self.handler_wrappers = []
+        super().__init__(*args, **kwargs)
+
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+
+        def decorator(handler):
+            wrapped = _trim_args(handler)
+            for wrap in reversed(self.handler_wrappers):
+                wrapped = wrap(message, wrapped)
+            register(wrapped)
+            return handler
+
+        return decorator
@@ -0,0 +1,151 @@
+"""
+Pipeline de logging não bloqueante do MesaDigital.
+
+As threads que atendem requisições e eventos apenas enfileiram o registro
+(``QueueHandler``); uma única thread (``QueueListener``) formata e grava em
+disco, com rotação conforme ``SERVER_CONFIG['LOGGING']``. Linhas de alto
+volume (uma por requisição) vão para o logger ``mesa.requests`` e são
+amostradas; avisos e erros sempre passam. O formato é logfmt
+(``chave=valor``), fácil de filtrar com grep e de ingerir.
+"""
+import sys
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import SERVER_CONFIG
+
+# Logger das linhas por requisição (amostradas)
+REQUEST_LOGGER = 'mesa.requests'
+
+_listener = None
+_traceback_formatter = logging.Formatter()
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formata registros como logfmt, incluindo os campos de ``extra={'fields': {...}}``."""
+
+    default_time_format = '%Y-%m-%dT%H:%M:%S'
+    default_msec_format = '%s.%03d'
+
+    def format(self, record):
+        parts = [
+            f'ts={self.formatTime(record)}',
+            f'level={record.levelname}',
+            f'logger={record.name}',
+            f'msg={_quote(record.getMessage())}',
+        ]
+        fields = getattr(record, 'fields', None)
+        if fields:
+            parts.extend(f'{key}={_quote(value)}' for key, value in fields.items())
+        line = ' '.join(parts)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line = f'{line}\n{record.exc_text}'
+        return line
+
+
+def _quote(value):
+    value = str(value)
+    if not value or any(c in value for c in ' ="\n'):
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return value
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Enfileira sem nunca bloquear: com a fila cheia o registro é descartado."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve a mensagem e o traceback na thread de origem, mas deixa a
+        # formatação completa para a thread do listener. O registro não é
+        # copiado: este é o único handler do logger raiz.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """QueueListener cujo stop() espera espaço na fila em vez de falhar com ela cheia."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class SamplingFilter(logging.Filter):
+    """Deixa passar apenas uma fração ``rate`` dos registros abaixo de WARNING."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def setup_logging(filename=None, stream=False, level=None):
+    """Configura o logger raiz uma única vez por processo.
+
+    Chamadas seguintes não alteram nada, de modo que o primeiro ponto de
+    entrada (ex.: wsgi.py) decide o destino dos logs.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    config = SERVER_CONFIG['LOGGING']
+    formatter = StructuredFormatter()
+    handlers = []
+    if filename:
+        handlers.append(RotatingFileHandler(
+            filename,
+            maxBytes=config['ROTATE_SIZE'],
+            backupCount=config['BACKUP_COUNT'],
+            encoding='utf-8',
+            delay=True
+        ))
+    if stream or not handlers:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(config['QUEUE_SIZE'])
+    root = logging.getLogger()
+    # Remove handlers síncronos instalados por basicConfig em módulos importados antes
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level or config['LEVEL'])
+
+    logging.getLogger(REQUEST_LOGGER).addFilter(SamplingFilter(config['REQUEST_SAMPLE_RATE']))
+
+    _listener = DrainingQueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """Esvazia a fila, para a thread de escrita e fecha os arquivos."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
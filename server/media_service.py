@@ -0,0 +1,334 @@
+"""
+Upload de imagens e miniaturas do servidor Python.
+
+- Os arquivos vão para um ``ContentStore`` (nome = SHA-256 do conteúdo): o
+  mesmo arquivo enviado de novo não é regravado nem reprocessado.
+- As miniaturas de ``MEDIA_CONFIG['THUMBNAIL_SIZES']`` são geradas num pool de
+  processos (o redimensionamento é CPU puro e não pode segurar o GIL das
+  threads que atendem Socket.IO). Uploads simultâneos do mesmo arquivo
+  esperam a mesma tarefa.
+- As miniaturas das músicas (``search_song``) deixam de ser hot-linked: a
+  URL remota, se o host estiver em ``REMOTE_HOSTS``, é baixada e
+  redimensionada uma única vez pelo mesmo pipeline.
+
+Como o endereço muda junto com o conteúdo, ``/media/<hash>`` é servido com
+``Cache-Control: immutable`` de um ano.
+
+O Pillow é opcional: sem ele os uploads continuam funcionando e as
+miniaturas são o próprio original.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import quote, urlparse
+
+import requests
+
+import metrics
+from config import MEDIA_CONFIG
+from content_store import ContentStore, is_digest
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow é opcional: sem ele as miniaturas são o original
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SECONDS = metrics.histogram('mesa_media_thumbnail_seconds',
+                                      'Tempo para gerar as miniaturas de uma imagem', ('source',))
+MEDIA_OBJECTS = metrics.counter('mesa_media_objects_total', 'Imagens recebidas pelo pipeline de mídia',
+                                ('source', 'result'))
+
+# Pools de processos perdidos antes de gerar as miniaturas em threads
+MAX_BROKEN_POOLS = 3
+
+# Assinaturas dos tipos aceitos: o tipo vem do conteúdo, não do header do cliente
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+def sniff_type(head):
+    """Tipo MIME pelos primeiros bytes do arquivo, ou None."""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def size_name(size):
+    return f'{size[0]}x{size[1]}'
+
+
+def default_media_dir():
+    """``media/`` na raiz do projeto (``DIR_CONFIG['MEDIA_DIR']`` em produção)."""
+    project_dir = os.environ.get('PROJECT_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(project_dir, 'media')
+
+
+def render_thumbnails(source, sizes, outputs):
+    """Roda num processo do pool: grava cada tamanho de ``source`` em ``outputs``."""
+    with Image.open(source) as image:
+        if image.format == 'JPEG':
+            # Decodifica já reduzido pela escala do DCT (1/2 a 1/8): o grosso do ganho em fotos
+            image.draft('RGB', max(sizes))
+        image.load()
+        alpha = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if alpha else 'RGB')
+        for size, output in zip(sizes, outputs):
+            thumb = image.copy()
+            thumb.thumbnail(size)
+            tmp_path = f'{output}.tmp-{os.getpid()}'
+            if alpha:
+                thumb.save(tmp_path, 'PNG', optimize=True)
+            else:
+                thumb.save(tmp_path, 'JPEG', quality=85, optimize=True, progressive=True)
+            os.replace(tmp_path, output)
+
+
+class MediaError(Exception):
+    """Upload recusado; ``status`` é o código HTTP da resposta."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class MediaService:
+    def __init__(self, root=None, config=None):
+        self.config = dict(MEDIA_CONFIG, **(config or {}))
+        self.root = root or self.config['MEDIA_DIR'] or default_media_dir()
+        self.content = ContentStore(self.root)
+        self.sizes = [tuple(size) for size in self.config['THUMBNAIL_SIZES']]
+        self.size_names = [size_name(size) for size in self.sizes]
+        self._pool = None
+        self._broken_pools = 0
+        self._pending = {}  # {hash: Future das miniaturas}
+        self._remote = OrderedDict()  # {url remota: hash}, LRU de REMOTE_INDEX_CACHE entradas
+        self._remote_pending = {}  # {url remota: Future do download}
+        self._lock = threading.Lock()
+        self._fetcher = ThreadPoolExecutor(max_workers=self.config['REMOTE_FETCH_WORKERS'],
+                                           thread_name_prefix='mesa-media-fetch')
+        self._http = requests.Session()
+
+    # ----- Miniaturas -----
+
+    def _executor(self):
+        if self._pool is None and self._broken_pools >= MAX_BROKEN_POOLS:
+            logger.warning("Pool de processos quebrou repetidamente; miniaturas em threads")
+            self._pool = ThreadPoolExecutor(max_workers=self.config['THUMBNAIL_WORKERS'],
+                                            thread_name_prefix='mesa-thumbnails')
+        if self._pool is None:
+            try:
+                # spawn: um fork do servidor com threads poderia herdar locks presos
+                self._pool = ProcessPoolExecutor(max_workers=self.config['THUMBNAIL_WORKERS'],
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            except (OSError, NotImplementedError) as e:
+                # Sem multiprocessing (alguns ambientes hospedados): threads ainda tiram o
+                # trabalho da requisição, só sem paralelismo real
+                logger.warning(f"Pool de processos indisponível ({str(e)}); miniaturas em threads")
+                self._pool = ThreadPoolExecutor(max_workers=self.config['THUMBNAIL_WORKERS'],
+                                                thread_name_prefix='mesa-thumbnails')
+        return self._pool
+
+    def _pool_broken(self):
+        # Um processo morreu (ex.: imagem que estoura a memória): o pool inteiro é descartado
+        if isinstance(self._pool, ProcessPoolExecutor):
+            self._pool.shutdown(wait=False)
+            self._pool = None
+            self._broken_pools += 1
+
+    def thumbnail_file(self, digest, size):
+        return os.path.join(self.root, 'thumbs', digest, size)
+
+    def ensure_thumbnails(self, digest, source='upload'):
+        """Future das miniaturas de ``digest`` (já prontas ou sem Pillow: None)."""
+        if Image is None:
+            return None
+        outputs = [self.thumbnail_file(digest, name) for name in self.size_names]
+        if all(os.path.exists(output) for output in outputs):
+            return None
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None:
+                return future
+            os.makedirs(os.path.dirname(outputs[0]), exist_ok=True)
+            start = time.perf_counter()
+            try:
+                future = self._executor().submit(render_thumbnails, self.content.path(digest),
+                                                 self.sizes, outputs)
+            except BrokenProcessPool:
+                self._pool_broken()
+                future = self._executor().submit(render_thumbnails, self.content.path(digest),
+                                                 self.sizes, outputs)
+            self._pending[digest] = future
+        future.add_done_callback(lambda f: self._thumbnails_done(digest, source, start, f))
+        return future
+
+    def _thumbnails_done(self, digest, source, start, future):
+        with self._lock:
+            self._pending.pop(digest, None)
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                self._pool_broken()
+        if error is not None:
+            logger.error(f"Erro ao gerar miniaturas de {digest}: {str(error)}")
+        else:
+            THUMBNAIL_SECONDS.labels(source).observe(time.perf_counter() - start)
+
+    def _wait_thumbnails(self, digest, source):
+        future = self.ensure_thumbnails(digest, source)
+        if future is None:
+            return
+        try:
+            future.result(timeout=self.config['THUMBNAIL_TIMEOUT'])
+        except Exception as e:
+            # A resposta segue sem as miniaturas; /media/<hash>/<tamanho> cai no original
+            logger.warning(f"Miniaturas de {digest} não ficaram prontas: {str(e)}")
+
+    # ----- Upload -----
+
+    def save_upload(self, stream, filename=None):
+        """Grava o upload e gera as miniaturas; retorna os metadados da imagem."""
+        digest, content_type, size = self._store(stream, 'upload')
+        self._wait_thumbnails(digest, 'upload')
+        return dict(self.describe(digest), filename=filename, mimetype=content_type, size=size)
+
+    def _store(self, stream, source):
+        try:
+            digest, size, created = self.content.put_stream(stream, self.config['MAX_UPLOAD_SIZE'])
+        except ValueError as e:
+            raise MediaError(str(e), 413)
+        content_type = self.content_type(self.content.path(digest))
+        if content_type not in self.config['ALLOWED_TYPES']:
+            if created:
+                os.unlink(self.content.path(digest))
+            raise MediaError('Tipo de arquivo não permitido', 415)
+        MEDIA_OBJECTS.labels(source, 'stored' if created else 'duplicate').inc()
+        return digest, content_type, size
+
+    def describe(self, digest):
+        return {
+            'id': digest,
+            'url': f'/media/{digest}',
+            'thumbnails': {name: f'/media/{digest}/{name}' for name in self.size_names},
+        }
+
+    # ----- Arquivos servidos -----
+
+    @staticmethod
+    def content_type(path):
+        with open(path, 'rb') as f:
+            return sniff_type(f.read(16)) or 'application/octet-stream'
+
+    def original_path(self, digest):
+        if not is_digest(digest):
+            return None
+        path = self.content.path(digest)
+        return path if os.path.exists(path) else None
+
+    def thumbnail_path(self, digest, size):
+        """(caminho, definitivo) da miniatura; sem ela, o original com definitivo=False."""
+        original = self.original_path(digest)
+        if original is None or size not in self.size_names:
+            return None, False
+        path = self.thumbnail_file(digest, size)
+        if not os.path.exists(path):
+            self._wait_thumbnails(digest, 'upload')
+        if os.path.exists(path):
+            return path, True
+        return original, False
+
+    # ----- Miniaturas remotas (músicas) -----
+
+    def allowed_remote(self, url):
+        if not isinstance(url, str):
+            return False
+        parsed = urlparse(url)
+        return parsed.scheme == 'https' and parsed.hostname in self.config['REMOTE_HOSTS']
+
+    def remote_thumbnail_url(self, url):
+        """URL local para uma miniatura remota (baixada em segundo plano), ou a própria URL."""
+        if not self.allowed_remote(url):
+            return url
+        self.prefetch_remote(url)
+        return f"/api/media/remote?url={quote(url, safe='')}"
+
+    def prefetch_remote(self, url):
+        if self._remote_digest(url) is not None:
+            return None
+        with self._lock:
+            future = self._remote_pending.get(url)
+            if future is None:
+                future = self._remote_pending[url] = self._fetcher.submit(self._download, url)
+                future.add_done_callback(lambda f: self._remote_pending.pop(url, None))
+            return future
+
+    def fetch_remote(self, url):
+        """Hash da miniatura remota já baixada e redimensionada, ou None se falhar."""
+        digest = self._remote_digest(url)
+        if digest is not None:
+            return digest
+        future = self.prefetch_remote(url)
+        if future is None:
+            return self._remote_digest(url)
+        try:
+            return future.result(timeout=self.config['REMOTE_TIMEOUT'] + self.config['THUMBNAIL_TIMEOUT'])
+        except Exception as e:
+            logger.warning(f"Miniatura remota indisponível ({url}): {str(e)}")
+            return None
+
+    def _remote_index_file(self, url):
+        return os.path.join(self.root, 'remote', hashlib.sha256(url.encode()).hexdigest())
+
+    def _remote_digest(self, url):
+        with self._lock:
+            digest = self._remote.get(url)
+            if digest is not None:
+                self._remote.move_to_end(url)
+                return digest
+        try:
+            with open(self._remote_index_file(url)) as f:
+                digest = f.read().strip()
+        except OSError:
+            return None
+        self._remember_remote(url, digest)
+        return digest
+
+    def _remember_remote(self, url, digest):
+        with self._lock:
+            self._remote[url] = digest
+            self._remote.move_to_end(url)
+            while len(self._remote) > self.config['REMOTE_INDEX_CACHE']:
+                self._remote.popitem(last=False)
+
+    def _download(self, url):
+        with self._http.get(url, timeout=self.config['REMOTE_TIMEOUT'], stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            digest, _, _ = self._store(response.raw, 'remote')
+        self._wait_thumbnails(digest, 'remote')
+        index_file = self._remote_index_file(url)
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        tmp_path = f'{index_file}.tmp-{threading.get_ident()}'
+        with open(tmp_path, 'w') as f:
+            f.write(digest)
+        os.replace(tmp_path, index_file)
+        self._remember_remote(url, digest)
+        return digest
+
+
+# Instância global
+media_service = MediaService()
@@ -0,0 +1,241 @@
+"""
+Métricas do MesaDigital no formato de exposição do Prometheus.
+
+Implementação mínima e sem dependências de contadores, gauges e
+histogramas com labels. Os filhos de cada combinação de labels são
+resolvidos uma vez (``labels()``) e guardados por quem instrumenta, de
+modo que o caminho quente custa um lock e algumas somas: bem abaixo de
+alguns microssegundos por evento.
+
+Cada processo expõe as métricas que registrou via ``render()``
+(``/api/metrics`` no flask_app e no pythonanywhere_wsgi).
+"""
+import time
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latências em segundos (de 0,5 ms a 10 s)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Quantidade de destinatários de um emit
+FANOUT_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 32, 64, 128)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Retorna (criando se preciso) o filho para esta combinação de labels."""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, lock):
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self):
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge calculado na leitura por ``fn``.
+
+    ``fn`` retorna um número ou, para gauges com labels, um dict
+    {tupla de valores dos labels: número}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = self._header()
+        try:
+            values = self.fn() if self.fn is not None else 0
+        except Exception:
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, label_values)} {_format_value(value)}')
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets, lock):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = lock
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets, self._lock)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = self._header()
+        for values, child in list(self._children.items()):
+            with self._lock:
+                counts = list(child.counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas de um processo."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Registra a métrica; se já existir uma com o mesmo nome, devolve a existente."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), fn=None):
+    metric = REGISTRY.register(Gauge(name, documentation, labelnames, fn))
+    metric.fn = fn
+    return metric
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# ----- Métricas compartilhadas -----
+
+SOCKET_EVENTS = counter('mesa_socketio_events_total',
+                        'Eventos Socket.IO recebidos por evento e resultado', ('event', 'outcome'))
+SOCKET_LATENCY = histogram('mesa_socketio_handler_seconds',
+                           'Latência dos handlers Socket.IO', ('event',))
+SOCKET_FANOUT = histogram('mesa_socketio_fanout_size',
+                          'Destinatários por emit', ('event',), buckets=FANOUT_BUCKETS)
+
+
+def instrument_event(event, handler):
+    """Envolve um handler Socket.IO com contador e histograma de latência."""
+    ok = SOCKET_EVENTS.labels(event, 'ok')
+    error = SOCKET_EVENTS.labels(event, 'error')
+    latency = SOCKET_LATENCY.labels(event)
+    clock = time.perf_counter
+
+    def instrumented(*args):
+        start = clock()
+        try:
+            result = handler(*args)
+        except Exception:
+            error.inc()
+            raise
+        finally:
+            latency.observe(clock() - start)
+        ok.inc()
+        return result
+
+    return instrumented
@@ -1,15 +1,72 @@
-import yt_dlp
 import logging
+import time
 import uuid
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
+import metrics
+from config import SERVER_CONFIG
+from media_service import media_service
+from persistence import store
+from playlist_log import PlaylistLog
+from tracing import tracer
+
 # Configuração de Log
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+YTDLP_LATENCY = metrics.histogram('mesa_ytdlp_seconds', 'Latência das chamadas ao yt_dlp', ('operation',))
+CACHE_LOOKUPS = metrics.counter('mesa_music_cache_total', 'Consultas aos caches do MusicService',
+                                ('cache', 'result'))
+
+
+def _yt_dlp():
+    """Importa o yt_dlp no primeiro uso (~100 ms que não entram na inicialização do app)."""
+    import yt_dlp
+    return yt_dlp
+
+
+class TTLCache:
+    """Cache LRU com expiração por entrada, com contagem de acertos/falhas."""
+
+    def __init__(self, name, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {chave: (expira_em, valor)}
+        self._lock = threading.Lock()
+        self._hit = CACHE_LOOKUPS.labels(name, 'hit')
+        self._miss = CACHE_LOOKUPS.labels(name, 'miss')
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hit.inc()
+                return entry[1]
+            self._entries.pop(key, None)
+        self._miss.inc()
+        return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
 class MusicService:
-    def __init__(self):
-        self.playlists = {}  # {room_id: [songs]}
+    def __init__(self, store=store):
+        self.playlists = {}  # {room_id: PlaylistLog} das salas abertas (open_room)
+        self.store = store
+        self.log_size = SERVER_CONFIG['MUSIC']['PLAYLIST_LOG_SIZE']
+        self._lock = threading.RLock()
+        cache_config = SERVER_CONFIG['CACHE']
+        self.search_cache = TTLCache('search', cache_config['MUSIC_SEARCH_TTL'], cache_config['MUSIC_CACHE_SIZE'])
+        self.stream_cache = TTLCache('stream', cache_config['MUSIC_STREAM_TTL'], cache_config['MUSIC_CACHE_SIZE'])
         self.ydl_opts = {
             'format': 'bestaudio/best',
             'quiet': True,
@@ -18,39 +75,121 @@ class MusicService:
             'noplaylist': True,
         }
 
+    def _log(self, room_id):
+        log = self.playlists.get(room_id)
+        if log is None:
+            raise KeyError(f"Sala sem playlist: {room_id}")
+        return log
+
+    def open_room(self, room_id):
+        """Carrega a playlist de uma sala criada ou reaberta; só salas abertas têm playlist em memória."""
+        with self._lock:
+            if room_id not in self.playlists:
+                self.playlists[room_id] = PlaylistLog(self._load_playlist(room_id), self.log_size)
+                try:
+                    self.store.touch_playlist(room_id)
+                except Exception as e:
+                    logger.error(f"Erro ao registrar playlist da sala {room_id}: {str(e)}")
+
+    def can_restore(self, room_id):
+        """A sala existia antes de um reinício do servidor (a playlist dela continua no banco)."""
+        try:
+            return self.store.has_playlist(room_id)
+        except Exception as e:
+            logger.error(f"Erro ao consultar playlist da sala {room_id}: {str(e)}")
+            return False
+
+    def release_room(self, room_id):
+        """Descarta a playlist de uma sala encerrada, da memória e do banco."""
+        with self._lock:
+            self.playlists.pop(room_id, None)
+            try:
+                self.store.delete_playlist(room_id)
+            except Exception as e:
+                logger.error(f"Erro ao apagar playlist da sala {room_id}: {str(e)}")
+
     def get_playlist(self, room_id):
-        if room_id not in self.playlists:
-            self.playlists[room_id] = []
-        return self.playlists[room_id]
+        with self._lock:
+            return list(self._log(room_id).songs)
+
+    def playlist_state(self, room_id):
+        """Playlist inteira com ``epoch`` e ``version`` (estado inicial do cliente)."""
+        with self._lock:
+            return self._log(room_id).snapshot()
+
+    def sync_playlist(self, room_id, epoch, version):
+        """Operações que o cliente perdeu desde ``version``, ou a playlist inteira."""
+        with self._lock:
+            return self._log(room_id).since(epoch, version)
+
+    def apply_ops(self, room_id, ops, publish=None):
+        """Aplica ``ops`` em ordem e retorna as que mudaram a playlist.
+
+        ``publish(epoch, aplicadas)`` roda antes da próxima edição ser aceita,
+        então os deltas saem na ordem das versões.
+        """
+        with self._lock:
+            log = self._log(room_id)
+            applied = []
+            for op in ops:
+                record = log.apply(op)
+                if record is not None:
+                    applied.append(record)
+            if applied:
+                self._save_playlist(room_id)
+                if publish is not None:
+                    publish(log.epoch, applied)
+            return applied
+
+    def _load_playlist(self, room_id):
+        try:
+            return self.store.load_playlist(room_id)
+        except Exception as e:
+            logger.error(f"Erro ao carregar playlist da sala {room_id}: {str(e)}")
+            return []
+
+    def _save_playlist(self, room_id):
+        try:
+            self.store.save_playlist(room_id, self.playlists[room_id].songs)
+        except Exception as e:
+            logger.error(f"Erro ao salvar playlist da sala {room_id}: {str(e)}")
 
     def search_song(self, query):
         """Pesquisa uma música no YouTube e retorna metadados."""
+        key = query.strip().lower()
+        cached = self.search_cache.get(key)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+            with tracer.span('yt_dlp search', query=query), _yt_dlp().YoutubeDL(self.ydl_opts) as ydl:
                 info = ydl.extract_info(f"ytsearch1:{query}", download=False)
                 if 'entries' in info:
                     video = info['entries'][0]
                 else:
                     video = info
 
-                return {
+                result = {
                     'id': video['id'],
                     'title': video['title'],
                     'duration': video['duration'],
-                    'thumbnail': video.get('thumbnail'),
+                    # Servida pelo pipeline de mídia em vez de hot-link
+                    'thumbnail': media_service.remote_thumbnail_url(video.get('thumbnail')),
                     'uploader': video.get('uploader'),
                     'url': video.get('webpage_url')
                 }
+                self.search_cache.set(key, result)
+                return result
         except Exception as e:
             logger.error(f"Erro ao pesquisar música: {str(e)}")
             return None
+        finally:
+            YTDLP_LATENCY.labels('search').observe(time.perf_counter() - start)
 
-    def add_to_playlist(self, room_id, song_data):
-        """Adiciona uma música à playlist da sala."""
-        if room_id not in self.playlists:
-            self.playlists[room_id] = []
-        
-        song_entry = {
+    @staticmethod
+    def new_song(song_data):
+        """Entrada da playlist para um resultado de ``search_song``."""
+        return {
             'uuid': str(uuid.uuid4()),
             'id': song_data['id'],
             'title': song_data['title'],
@@ -61,46 +200,57 @@ class MusicService:
             'added_at': datetime.now().isoformat(),
             'status': 'pending'  # pending, playing, played
         }
-        self.playlists[room_id].append(song_entry)
-        return song_entry
 
-    def remove_from_playlist(self, room_id, song_uuid):
-        if room_id in self.playlists:
-            self.playlists[room_id] = [s for s in self.playlists[room_id] if s['uuid'] != song_uuid]
-            return True
-        return False
+    def add_to_playlist(self, room_id, song_data, publish=None, **position):
+        """Adiciona uma música no fim da playlist (ou depois de ``after=uuid``)."""
+        op = dict(position, type='add', song=self.new_song(song_data))
+        return self.apply_ops(room_id, [op], publish)
+
+    def remove_from_playlist(self, room_id, song_uuid, publish=None):
+        return self.apply_ops(room_id, [{'type': 'remove', 'uuid': song_uuid}], publish)
+
+    def move_song(self, room_id, song_uuid, after, publish=None):
+        """Move a música para depois de ``after`` (None = início)."""
+        return self.apply_ops(room_id, [{'type': 'move', 'uuid': song_uuid, 'after': after}], publish)
+
+    def play_song(self, room_id, song_uuid, publish=None):
+        """Marca a música como ``playing`` e a que tocava antes como ``played``."""
+        with self._lock:
+            ops = [{'type': 'status', 'uuid': s['uuid'], 'status': 'played'}
+                   for s in self._log(room_id).songs
+                   if s.get('status') == 'playing' and s['uuid'] != song_uuid]
+            ops.append({'type': 'status', 'uuid': song_uuid, 'status': 'playing'})
+            return self.apply_ops(room_id, ops, publish)
 
     def get_stream_url(self, video_id):
         """Obtém a URL de streaming direto do áudio."""
+        cached = self.stream_cache.get(video_id)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
         try:
             ydl_opts = {
                 'format': 'bestaudio/best',
                 'quiet': True
             }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with tracer.span('yt_dlp stream', video_id=video_id), _yt_dlp().YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(video_id, download=False)
+                self.stream_cache.set(video_id, info['url'])
                 return info['url']
         except Exception as e:
             logger.error(f"Erro ao obter URL de stream: {str(e)}")
             return None
+        finally:
+            YTDLP_LATENCY.labels('stream').observe(time.perf_counter() - start)
 
-    def reorder_playlist(self, room_id, new_order):
-        """Reordena a playlist baseada em uma lista de UUIDs."""
-        if room_id in self.playlists:
-            current_playlist = {s['uuid']: s for s in self.playlists[room_id]}
-            new_playlist = []
-            for uuid_ in new_order:
-                if uuid_ in current_playlist:
-                    new_playlist.append(current_playlist[uuid_])
-            
-            # Adicionar itens que não estavam na nova ordem (segurança)
-            for s in self.playlists[room_id]:
-                if s['uuid'] not in new_order:
-                    new_playlist.append(s)
-            
-            self.playlists[room_id] = new_playlist
-            return self.playlists[room_id]
-        return []
+    def reorder_playlist(self, room_id, new_order, publish=None):
+        """Reordena a playlist por uma lista de UUIDs (os ausentes ficam depois, na ordem atual)."""
+        ops = []
+        after = None
+        for song_uuid in new_order:
+            ops.append({'type': 'move', 'uuid': song_uuid, 'after': after})
+            after = song_uuid
+        return self.apply_ops(room_id, ops, publish)
 
 # Instância global
 music_service = MusicService()
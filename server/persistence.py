@@ -0,0 +1,324 @@
+"""
+Persistência do servidor Python em SQLite.
+
+Substitui, para o Flask, o ``controllers/persistence.js`` do Node.js, que relê
+e regrava ``events.json``/``setlists.json`` inteiros a cada requisição:
+
+- eventos da agenda e setlists com a mesma API (mesmos campos e ordem);
+- playlists das salas, que antes sumiam a cada reinício. Toda sala aberta
+  ganha uma linha em ``playlists``; uma sala perdida num reinício pode ser
+  reaberta com o mesmo id (``has_playlist``) e recupera a playlist. A
+  playlist é apagada quando a sala é encerrada, e as de salas nunca
+  reabertas saem ao abrir o banco, depois de ``PLAYLIST_RETENTION_DAYS``.
+
+O banco roda em modo WAL (leitores não bloqueiam o escritor) com
+``synchronous=NORMAL``. Cada thread tem a própria conexão de leitura; todas as
+escritas passam por uma única thread que agrupa o que chegar em
+``BATCH_MS`` numa transação (group commit), cada escrita no seu SAVEPOINT:
+uma escrita que falha é desfeita sozinha, sem levar o resto do lote. Quem precisa da escrita gravada
+antes de responder (REST) espera o commit do lote; as playlists não esperam
+e, dentro de um lote, só a versão mais recente de cada sala é gravada.
+
+Os documentos são guardados em JSON numa coluna ``data``; os campos usados
+em consultas (``start`` dos eventos, sala e posição das playlists) têm
+colunas e índices próprios. O SQL é constante e parametrizado, então cada
+conexão compila cada comando uma vez (cache de statements do sqlite3).
+
+A conexão só é aberta no primeiro uso, para não pesar na importação.
+"""
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from config import SERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    start TEXT,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (start);
+
+CREATE TABLE IF NOT EXISTS setlists (
+    id TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS playlist_songs (
+    room_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    uuid TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (room_id, uuid)
+);
+CREATE INDEX IF NOT EXISTS playlist_songs_position ON playlist_songs (room_id, position);
+
+CREATE TABLE IF NOT EXISTS playlists (
+    room_id TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL
+);
+"""
+
+UPSERT_EVENT = ("INSERT INTO events (id, start, created_at, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET start = excluded.start, "
+                "created_at = excluded.created_at, data = excluded.data")
+DELETE_EVENT = "DELETE FROM events WHERE id = ?"
+SELECT_EVENTS = "SELECT data FROM events ORDER BY rowid"
+SELECT_EVENTS_FROM = "SELECT data FROM events WHERE start >= ? ORDER BY start"
+
+# ON CONFLICT mantém o rowid: uma setlist atualizada não muda de posição (como no Node.js)
+UPSERT_SETLIST = ("INSERT INTO setlists (id, updated_at, data) VALUES (?, ?, ?) "
+                  "ON CONFLICT (id) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data")
+DELETE_SETLIST = "DELETE FROM setlists WHERE id = ?"
+SELECT_SETLISTS = "SELECT data FROM setlists ORDER BY rowid"
+
+DELETE_PLAYLIST = "DELETE FROM playlist_songs WHERE room_id = ?"
+INSERT_SONG = "INSERT INTO playlist_songs (room_id, position, uuid, data) VALUES (?, ?, ?, ?)"
+SELECT_PLAYLIST = "SELECT data FROM playlist_songs WHERE room_id = ? ORDER BY position"
+TOUCH_PLAYLIST = ("INSERT INTO playlists (room_id, updated_at) VALUES (?, ?) "
+                  "ON CONFLICT (room_id) DO UPDATE SET updated_at = excluded.updated_at")
+FORGET_PLAYLIST = "DELETE FROM playlists WHERE room_id = ?"
+SELECT_PLAYLIST_ROOM = "SELECT 1 FROM playlists WHERE room_id = ?"
+# Músicas sem registro em playlists (bancos anteriores à tabela) também saem
+SWEEP_SONGS = ("DELETE FROM playlist_songs WHERE room_id NOT IN "
+               "(SELECT room_id FROM playlists WHERE updated_at >= ?)")
+SWEEP_PLAYLISTS = "DELETE FROM playlists WHERE updated_at < ?"
+
+
+class PersistenceError(Exception):
+    """Falha ao gravar no banco (a escrita foi desfeita)."""
+
+
+def _now_iso(delta=None):
+    now = datetime.now(timezone.utc)
+    if delta is not None:
+        now -= delta
+    return now.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _new_id():
+    # Mesmo formato do Node.js (Date.now().toString())
+    return str(int(time.time() * 1000))
+
+
+def _json_array(rows):
+    return '[' + ','.join(data for data, in rows) + ']'
+
+
+def default_db_file():
+    """``data/mesa.db`` na raiz do projeto, ao lado dos JSON do Node.js."""
+    project_dir = os.environ.get('PROJECT_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(project_dir, 'data', 'mesa.db')
+
+
+class _Write:
+    """Escrita na fila: ``statements`` = [(sql, parâmetros)], ``key`` agrupa versões."""
+
+    __slots__ = ('statements', 'key', 'done', 'error')
+
+    def __init__(self, statements, key=None, wait=True):
+        self.statements = statements
+        self.key = key
+        self.done = threading.Event() if wait else None
+        self.error = None
+
+
+class Store:
+    """Eventos, setlists e playlists em SQLite com escritas agrupadas."""
+
+    def __init__(self, path=None, config=None):
+        self.config = dict(SERVER_CONFIG['PERSISTENCE'], **(config or {}))
+        self.path = path or self.config['DB_FILE'] or default_db_file()
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    # ----- Conexões -----
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.config['BUSY_TIMEOUT'],
+                                     isolation_level=None, check_same_thread=False,
+                                     cached_statements=64)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _ensure_ready(self):
+        if self._ready:
+            return
+        with self._init_lock:
+            if self._ready:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = self._connect()
+            connection.executescript(SCHEMA)
+            connection.close()
+            self._writer = threading.Thread(target=self._run, name='mesa-persistence', daemon=True)
+            self._writer.start()
+            self._ready = True
+        self._sweep_playlists()
+
+    def _reader(self):
+        self._ensure_ready()
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    # ----- Escritas agrupadas -----
+
+    def _submit(self, statements, key=None, wait=True):
+        self._ensure_ready()
+        write = _Write(statements, key, wait)
+        self._queue.put(write)
+        if wait:
+            write.done.wait()
+            if write.error is not None:
+                raise PersistenceError(str(write.error))
+        return write
+
+    def _run(self):
+        connection = self._connect()
+        window = self.config['BATCH_MS'] / 1000
+        batch_max = self.config['BATCH_MAX']
+        while True:
+            # O que chegou durante o commit anterior entra todo no próximo lote
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + window
+            while len(batch) < batch_max:
+                try:
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(connection, batch)
+
+    def _commit(self, connection, batch):
+        # Só a última versão de cada chave (ex.: playlist de uma sala) é gravada
+        latest = {write.key: i for i, write in enumerate(batch) if write.key is not None}
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for i, write in enumerate(batch):
+                if write.key is not None and latest[write.key] != i:
+                    continue
+                connection.execute('SAVEPOINT write')
+                try:
+                    for sql, params in write.statements:
+                        connection.execute(sql, params)
+                except sqlite3.Error as e:
+                    logger.error(f"Erro ao gravar escrita do lote: {str(e)}")
+                    connection.execute('ROLLBACK TO write')
+                    write.error = e
+                connection.execute('RELEASE write')
+            connection.execute('COMMIT')
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao gravar lote de {len(batch)} escritas: {str(e)}")
+            try:
+                connection.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            for write in batch:
+                write.error = e
+        for write in batch:
+            if write.done is not None:
+                write.done.set()
+
+    def flush(self):
+        """Espera as escritas já enfileiradas serem gravadas."""
+        self._submit([])
+
+    # ----- Eventos (agenda) -----
+
+    def list_events(self, start_from=None):
+        """Eventos na ordem de criação, ou a partir de ``start_from`` ordenados por início."""
+        return json.loads(self.events_json(start_from))
+
+    def events_json(self, start_from=None):
+        """``list_events`` já serializado: os documentos gravados vão direto para a resposta."""
+        if start_from:
+            rows = self._reader().execute(SELECT_EVENTS_FROM, (start_from,))
+        else:
+            rows = self._reader().execute(SELECT_EVENTS)
+        return _json_array(rows)
+
+    def create_event(self, body):
+        """Grava o evento; levanta ValueError se ``start`` não for texto (ISO) nem ausente."""
+        if body.get('start') is not None and not isinstance(body['start'], str):
+            raise ValueError('Campo start inválido')
+        event = dict({'id': _new_id()}, **body)
+        event['createdAt'] = _now_iso()
+        event['id'] = str(event['id'])
+        self._submit([(UPSERT_EVENT, (event['id'], event.get('start'), event['createdAt'],
+                                      json.dumps(event)))])
+        return event
+
+    def delete_event(self, event_id):
+        self._submit([(DELETE_EVENT, (event_id,))])
+
+    # ----- Setlists -----
+
+    def list_setlists(self):
+        return json.loads(self.setlists_json())
+
+    def setlists_json(self):
+        return _json_array(self._reader().execute(SELECT_SETLISTS))
+
+    def save_setlist(self, body):
+        setlist = dict(body)
+        setlist['id'] = str(body.get('id') or _new_id())
+        setlist['updatedAt'] = _now_iso()
+        self._submit([(UPSERT_SETLIST, (setlist['id'], setlist['updatedAt'], json.dumps(setlist)))])
+        return setlist
+
+    def delete_setlist(self, setlist_id):
+        self._submit([(DELETE_SETLIST, (setlist_id,))])
+
+    # ----- Playlists das salas -----
+
+    def load_playlist(self, room_id):
+        return [json.loads(data) for data, in self._reader().execute(SELECT_PLAYLIST, (room_id,))]
+
+    def save_playlist(self, room_id, songs):
+        """Grava a playlist inteira da sala em segundo plano (sem esperar o commit)."""
+        statements = [(DELETE_PLAYLIST, (room_id,)), (TOUCH_PLAYLIST, (room_id, _now_iso()))]
+        statements.extend((INSERT_SONG, (room_id, position, song['uuid'], json.dumps(song)))
+                          for position, song in enumerate(songs))
+        self._submit(statements, key=('playlist', room_id), wait=False)
+
+    def has_playlist(self, room_id):
+        """A sala foi aberta antes (e não encerrada), então a playlist dela está no banco."""
+        return self._reader().execute(SELECT_PLAYLIST_ROOM, (room_id,)).fetchone() is not None
+
+    def touch_playlist(self, room_id):
+        """Registra a sala aberta (para poder reabri-la depois de um reinício), sem esperar o commit."""
+        self._submit([(TOUCH_PLAYLIST, (room_id, _now_iso()))], key=('playlist', room_id), wait=False)
+
+    def delete_playlist(self, room_id):
+        """Apaga a playlist de uma sala encerrada (em segundo plano, substitui um save pendente)."""
+        self._submit([(DELETE_PLAYLIST, (room_id,)), (FORGET_PLAYLIST, (room_id,))],
+                     key=('playlist', room_id), wait=False)
+
+    def _sweep_playlists(self):
+        """Apaga as playlists sem edição há ``PLAYLIST_RETENTION_DAYS`` (salas perdidas num reinício)."""
+        cutoff = _now_iso(timedelta(days=self.config['PLAYLIST_RETENTION_DAYS']))
+        self._submit([(SWEEP_SONGS, (cutoff,)), (SWEEP_PLAYLISTS, (cutoff,))], wait=False)
+
+
+store = Store()
@@ -0,0 +1,127 @@
+"""
+Playlist versionada de uma sala, sincronizada por operações (deltas).
+
+Cada edição é uma operação sobre identificadores estáveis (``uuid`` das
+músicas), não sobre índices:
+
+- ``add``: {'song': {...}, 'after': uuid ou None}, sem ``after`` vai para o fim;
+- ``remove``: {'uuid'};
+- ``move``: {'uuid', 'after': uuid ou None (início)};
+- ``status``: {'uuid', 'status': 'pending' | 'playing' | 'played'}.
+
+O servidor aplica as operações numa ordem total (cada uma incrementa
+``version``) e a sala recebe só a operação aplicada. Duas edições
+simultâneas não se sobrescrevem: cada uma foi feita sobre uuids que continuam
+valendo. A resolução é determinística:
+
+- remover o que já saiu, mover ou mudar o status de uma música removida: no-op;
+- ``after`` apontando para uma música removida: vale a música que estava
+  antes dela quando foi removida (seguindo a cadeia de remoções);
+- dois ``move``/``status`` da mesma música: vence o último na ordem do servidor.
+
+A operação registrada já traz o ``after`` resolvido, então o cliente a aplica
+sem conhecer as remoções. As últimas ``max_ops`` ficam num log: um cliente
+atrasado recebe as que perdeu ou, fora da janela (ou de outra ``epoch``, ex.:
+depois de um reinício), a playlist inteira.
+"""
+import uuid
+from collections import OrderedDict, deque
+
+STATUSES = ('pending', 'playing', 'played')
+
+
+class PlaylistLog:
+    def __init__(self, songs=(), max_ops=200):
+        self.songs = list(songs)
+        self.version = 0
+        # Muda a cada carga: versões de antes de um reinício não são comparáveis
+        self.epoch = uuid.uuid4().hex[:8]
+        self.ops = deque(maxlen=max_ops)
+        self._removed = OrderedDict()  # {uuid removido: uuid anterior na remoção}
+        self._max_removed = max_ops
+
+    def _index(self, song_uuid):
+        for i, song in enumerate(self.songs):
+            if song['uuid'] == song_uuid:
+                return i
+        return None
+
+    def _anchor(self, after):
+        """Posição de inserção depois de ``after`` (resolvendo músicas removidas)."""
+        seen = set()
+        while after is not None:
+            i = self._index(after)
+            if i is not None:
+                return i + 1, after
+            if after in seen or after not in self._removed:
+                # Âncora desconhecida: vai para o fim, como um add sem posição
+                return len(self.songs), self.songs[-1]['uuid'] if self.songs else None
+            seen.add(after)
+            after = self._removed[after]
+        return 0, None
+
+    def apply(self, op):
+        """Aplica ``op``; retorna a operação registrada (com ``version``) ou None se for no-op.
+
+        Levanta ValueError para operações malformadas.
+        """
+        kind = op.get('type')
+        if kind == 'add':
+            song = op.get('song')
+            if not isinstance(song, dict) or not song.get('uuid'):
+                raise ValueError('Música inválida')
+            if self._index(song['uuid']) is not None:
+                return None
+            if op.get('after', '') == '':
+                position, after = len(self.songs), self.songs[-1]['uuid'] if self.songs else None
+            else:
+                position, after = self._anchor(op['after'])
+            self.songs.insert(position, song)
+            record = {'type': 'add', 'song': song, 'after': after}
+        elif kind == 'remove':
+            i = self._index(op.get('uuid'))
+            if i is None:
+                return None
+            song = self.songs.pop(i)
+            self._removed[song['uuid']] = self.songs[i - 1]['uuid'] if i > 0 else None
+            while len(self._removed) > self._max_removed:
+                self._removed.popitem(last=False)
+            record = {'type': 'remove', 'uuid': song['uuid']}
+        elif kind == 'move':
+            song_uuid = op.get('uuid')
+            i = self._index(song_uuid)
+            if i is None or op.get('after') == song_uuid:
+                return None
+            song = self.songs.pop(i)
+            position, after = self._anchor(op.get('after'))
+            self.songs.insert(position, song)
+            if position == i:
+                return None
+            record = {'type': 'move', 'uuid': song_uuid, 'after': after}
+        elif kind == 'status':
+            if op.get('status') not in STATUSES:
+                raise ValueError(f"Status inválido: {op.get('status')}")
+            i = self._index(op.get('uuid'))
+            if i is None or self.songs[i].get('status') == op['status']:
+                return None
+            self.songs[i] = dict(self.songs[i], status=op['status'])
+            record = {'type': 'status', 'uuid': op['uuid'], 'status': op['status']}
+        else:
+            raise ValueError(f"Operação desconhecida: {kind}")
+
+        self.version += 1
+        record['version'] = self.version
+        self.ops.append(record)
+        return record
+
+    def snapshot(self):
+        return {'epoch': self.epoch, 'version': self.version, 'playlist': list(self.songs)}
+
+    def since(self, epoch, version):
+        """Operações depois de ``version`` ou, se não estiverem mais no log, a playlist inteira."""
+        if epoch == self.epoch and version is not None and 0 <= version <= self.version:
+            missing = self.version - version
+            if missing <= len(self.ops):
+                ops = list(self.ops)[len(self.ops) - missing:] if missing else []
+                return {'epoch': self.epoch, 'version': self.version, 'ops': ops}
+        return self.snapshot()
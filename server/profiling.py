@@ -0,0 +1,283 @@
+"""
+Ferramentas de diagnóstico do MesaDigital em produção.
+
+- ``time_event``: wrapper dos handlers Socket.IO que registra eventos
+  acima de ``SLOW_EVENT_MS`` com o tamanho do payload recebido.
+- ``SamplingProfiler``: amostra as pilhas de todas as threads via
+  ``sys._current_frames()`` por N segundos e gera pilhas colapsadas
+  (formato de entrada do flamegraph.pl / speedscope).
+- ``ThreadDumpSampler``: tira dumps periódicos das threads e avisa quando
+  uma thread fica parada na mesma pilha (ex.: esperando o yt_dlp ou um lock).
+
+Nada disso roda por padrão além do ``time_event``: o profiler e os dumps são
+acionados pelos endpoints ``/api/admin/*`` protegidos por ``MESA_ADMIN_TOKEN``
+(``require_admin``, usado também pelo webhook_handler),
+e os dumps periódicos só rodam com ``THREAD_DUMP_INTERVAL`` maior que zero.
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import logging
+import functools
+import threading
+import traceback
+from collections import Counter, deque
+
+from flask import request, jsonify
+
+from config import SERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Token dos endpoints de administração; sem ele os endpoints ficam desativados
+ADMIN_TOKEN_ENV = 'MESA_ADMIN_TOKEN'
+
+
+def admin_token_valid(headers):
+    """Confere o token de ``Authorization: Bearer`` ou ``X-Admin-Token``.
+
+    Retorna None se nenhum token estiver configurado (endpoints desativados).
+    """
+    expected = os.environ.get(ADMIN_TOKEN_ENV, '')
+    if not expected:
+        return None
+    provided = headers.get('X-Admin-Token', '')
+    authorization = headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        provided = authorization[7:]
+    return hmac.compare_digest(provided.encode(), expected.encode())
+
+def require_admin(view):
+    """Exige o token de MESA_ADMIN_TOKEN; sem token configurado o endpoint não existe."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        valid = admin_token_valid(request.headers)
+        if valid is None:
+            return jsonify({"status": "error", "message": "Não encontrado"}), 404
+        if not valid:
+            logger.warning("Token de administração inválido")
+            return jsonify({"status": "error", "message": "Token inválido"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _payload_size(args):
+    try:
+        return len(json.dumps(args, default=str))
+    except (TypeError, ValueError):
+        return -1
+
+
+def time_event(event, handler):
+    """Envolve um handler Socket.IO e registra as chamadas lentas.
+
+    O tamanho do payload só é calculado quando o limite é ultrapassado.
+    """
+    threshold = SERVER_CONFIG['PROFILING']['SLOW_EVENT_MS'] / 1000
+    clock = time.perf_counter
+
+    def timed(*args):
+        start = clock()
+        try:
+            return handler(*args)
+        finally:
+            elapsed = clock() - start
+            if elapsed >= threshold:
+                logger.warning("Evento Socket.IO lento: %s", event, extra={'fields': {
+                    'event': event,
+                    'ms': round(elapsed * 1000, 1),
+                    'payload_bytes': _payload_size(args),
+                    'thread': threading.current_thread().name,
+                }})
+
+    return timed
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f'{module}:{code.co_name}:{frame.f_lineno}'
+
+
+def _collapse(frame):
+    """Pilha da raiz até ``frame`` como 'a;b;c'."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Profiler por amostragem de todas as threads do processo."""
+
+    def __init__(self, interval=None, max_duration=None):
+        config = SERVER_CONFIG['PROFILING']
+        self.interval = interval or config['SAMPLE_INTERVAL_MS'] / 1000
+        self.max_duration = max_duration or config['MAX_PROFILE_SECONDS']
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.finished_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds):
+        """Inicia uma coleta de ``seconds`` segundos; False se já houver uma em andamento."""
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self.finished_at = None
+            self._stop.clear()
+            duration = max(0.1, min(float(seconds), self.max_duration))
+            self._thread = threading.Thread(target=self._run, args=(duration,),
+                                            name='mesa-profiler', daemon=True)
+            self._thread.start()
+            logger.info(f"Profiler iniciado por {duration:.1f}s")
+            return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self, duration):
+        own_id = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + duration
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                self.stacks[f'{thread_name};{_collapse(frame)}'] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+        self.finished_at = time.time()
+        logger.info(f"Profiler finalizado: {self.samples} amostras, {len(self.stacks)} pilhas")
+
+    def status(self):
+        return {
+            'running': self.running,
+            'samples': self.samples,
+            'stacks': len(self.stacks),
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+    def collapsed(self):
+        """Resultado no formato de pilhas colapsadas ('pilha contagem' por linha)."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def thread_dump():
+    """Pilhas atuais de todas as threads em texto legível."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    parts = []
+    for thread_id, frame in sys._current_frames().items():
+        parts.append(f'--- {names.get(thread_id, thread_id)} ({thread_id})\n')
+        parts.append(''.join(traceback.format_stack(frame)))
+    return ''.join(parts)
+
+
+class ThreadDumpSampler:
+    """Dumps periódicos das threads com detecção de threads paradas.
+
+    Guarda os últimos ``history`` dumps e registra um aviso quando uma
+    thread permanece na mesma pilha por ``stuck_after`` segundos.
+    """
+
+    def __init__(self, interval=None, stuck_after=None, history=20):
+        config = SERVER_CONFIG['PROFILING']
+        self.interval = interval or config['THREAD_DUMP_INTERVAL']
+        self.stuck_after = stuck_after or config['STUCK_THREAD_SECONDS']
+        self.dumps = deque(maxlen=history)
+        self._since = {}  # {thread_id: (pilha, desde, já avisado)}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval:
+            self._thread = threading.Thread(target=self._run, name='mesa-thread-dumps', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Erro no dump de threads: {str(e)}")
+
+    def sample(self):
+        now = time.monotonic()
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        self.dumps.append((time.time(), thread_dump()))
+        since = {}
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+            stack = _collapse(frame)
+            previous = self._since.get(thread_id)
+            if previous is not None and previous[0] == stack:
+                started, warned = previous[1], previous[2]
+            else:
+                started, warned = now, False
+            if not warned and now - started >= self.stuck_after and _busy_in_app(frame):
+                logger.warning("Thread parada na mesma pilha", extra={'fields': {
+                    'thread': names.get(thread_id, thread_id),
+                    'seconds': round(now - started, 1),
+                    'frame': _frame_label(frame),
+                }})
+                warned = True
+            since[thread_id] = (stack, started, warned)
+        self._since = since
+
+    def latest(self):
+        return '\n'.join(f'=== {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))}\n{dump}'
+                         for ts, dump in self.dumps)
+
+
+# Funções da biblioteca em que threads ociosas esperam trabalho (filas, long-polling, accept)
+_IDLE_FUNCTIONS = {'wait', 'get', 'sleep', 'select', 'poll', 'accept', 'serve_forever',
+                   '_wait_for_tstate_lock'}
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _busy_in_app(frame):
+    """A thread está executando (ou bloqueada em I/O/lock) a partir de código do servidor?
+
+    Uma chamada ao yt_dlp presa em leitura de socket conta; um worker
+    esperando trabalho numa fila não.
+    """
+    code = frame.f_code
+    if code.co_name in _IDLE_FUNCTIONS and not code.co_filename.startswith(_APP_DIR):
+        return False
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_DIR) and not filename.endswith('profiling.py'):
+            return True
+        frame = frame.f_back
+    return False
+
+
+profiler = SamplingProfiler()
+thread_sampler = ThreadDumpSampler()
@@ -1,85 +1,210 @@
 import os
 import sys
+import time
 import logging
-import mimetypes
 import json
 import requests
-import socket
 from urllib.parse import urljoin, urlparse
 
-# Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,  # INFO para produção, DEBUG para desenvolvimento
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-
 # Configurações
-PROJECT_DIR = '/home/kluferso/MesaDigital'
+PROJECT_DIR = os.environ.get('PROJECT_DIR', '/home/kluferso/MesaDigital')
 BUILD_DIR = os.path.join(PROJECT_DIR, 'build')
-NODE_SERVER = 'http://localhost:3000'
-TIMEOUT = 15  # Aumentado para 15 segundos para WebRTC
+SERVER_DIR = os.path.join(PROJECT_DIR, 'server')
 
-def check_node_server():
-    """Verifica se o servidor Node.js está rodando"""
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)  # 2 segundos de timeout
-        result = sock.connect_ex(('localhost', 3000))
-        sock.close()
-        return result == 0
-    except:
-        return False
+# Módulos do servidor (config, static_files) ficam em server/, mesmo quando
+# este arquivo é copiado para /var/www
+for _path in (os.path.dirname(os.path.abspath(__file__)), SERVER_DIR):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+import metrics
+from config import SERVER_CONFIG
+from log_setup import REQUEST_LOGGER, setup_logging
+from response_cache import MicroCache
+from static_files import StaticIndex
+from tracing import current_span, tracer
+from upstream import (STICKY_COOKIE, BackendPool, HealthMonitor, Hedger, RetryBudget, RoutePolicies,
+                      StreamedBody, affinity_keys, create_session, forward_headers, request_body)
+
+# Configuração de logging: fila + thread de escrita, nível em SERVER_CONFIG['LOGGING']
+setup_logging(stream=True)
+request_log = logging.getLogger(REQUEST_LOGGER)
+
+# Spans deste processo saem como service=proxy (SERVER_CONFIG['TRACING'])
+tracer.configure(service='proxy')
+
+# Processos Node.js atrás do proxy
+NODE_BACKENDS = [url.strip() for url in os.environ.get(
+    'NODE_BACKENDS', ','.join(SERVER_CONFIG['NODE_BACKENDS'])).split(',') if url.strip()]
+
+# Índice dos arquivos do build, montado na primeira requisição estática
+static_index = StaticIndex(BUILD_DIR, lazy=True)
+
+# Micro-cache de GET /api/events e /api/setlists (SERVER_CONFIG['CACHE'])
+response_cache = MicroCache()
+WRITE_METHODS = frozenset(['POST', 'PUT', 'PATCH', 'DELETE'])
+
+# Sessão com pool keep-alive e saúde dos backends monitorada em segundo plano
+backend_pool = BackendPool(NODE_BACKENDS)
+upstream_session = create_session()
+health_monitor = HealthMonitor(backend_pool.backends)
+health_monitor.start()
+
+# Timeouts por rota e tentativas extras (retry/hedge) de GETs idempotentes (SERVER_CONFIG['PROXY'])
+route_policies = RoutePolicies()
+hedger = Hedger(RetryBudget(SERVER_CONFIG['PROXY']['RETRY_RATIO'], SERVER_CONFIG['PROXY']['RETRY_MIN_PER_SECOND']),
+                SERVER_CONFIG['PROXY']['HEDGE_WORKERS'])
+
+# Métricas do proxy (servidas localmente em /api/metrics)
+UPSTREAM_LATENCY = metrics.histogram('mesa_proxy_upstream_seconds',
+                                     'Tempo até os headers da resposta do Node.js', ('backend',))
+UPSTREAM_RESPONSES = metrics.counter('mesa_proxy_responses_total',
+                                     'Respostas do proxy por backend e status', ('backend', 'status'))
+metrics.gauge('mesa_proxy_in_flight', 'Requisições em andamento por backend', ('backend',),
+              fn=lambda: {(b.id,): b.in_flight for b in backend_pool.backends})
+metrics.gauge('mesa_proxy_backend_healthy', 'Backend saudável (1) ou não (0)', ('backend',),
+              fn=lambda: {(b.id,): int(b.healthy) for b in backend_pool.backends})
 
 # Função para servir arquivos estáticos
-def serve_static_file(path_info):
+def serve_static_file(path_info, environ):
     """Serve arquivos estáticos do diretório build"""
     try:
-        # Remove a barra inicial para criar um caminho relativo
-        relative_path = path_info.lstrip('/')
-        
-        # Primeiro, tenta encontrar o arquivo exato
-        file_path = os.path.join(BUILD_DIR, relative_path)
-        logging.debug(f"Tentando servir arquivo: {file_path}")
-        
-        # Se o arquivo não existe, tenta servir o index.html
-        if not os.path.exists(file_path) or os.path.isdir(file_path):
-            file_path = os.path.join(BUILD_DIR, 'index.html')
-            logging.debug(f"Arquivo não encontrado, tentando index.html: {file_path}")
-            
-            if not os.path.exists(file_path):
-                logging.error(f"index.html não encontrado em: {file_path}")
-                return '404 Not Found', [('Content-Type', 'text/plain')], [b'Not Found']
-        
-        # Determina o tipo MIME
-        content_type, _ = mimetypes.guess_type(file_path)
-        if not content_type:
-            content_type = 'application/octet-stream'
-        
-        # Lê o arquivo
-        with open(file_path, 'rb') as f:
-            content = f.read()
-            logging.info(f"Servindo arquivo: {file_path} ({content_type})")
-            return '200 OK', [('Content-Type', content_type)], [content]
-            
+        return static_index.serve(environ, path_info)
     except Exception as e:
-        logging.error(f"Erro ao servir arquivo {file_path}: {str(e)}", exc_info=True)
+        logging.error(f"Erro ao servir arquivo {path_info}: {str(e)}", exc_info=True)
         return '500 Internal Server Error', [('Content-Type', 'text/plain')], [b'Internal Server Error']
 
+def upstream_url(backend, path_info, query_string):
+    url = urljoin(backend.url, path_info)
+    if query_string:
+        url += '?' + query_string
+    return url
+
+def send_upstream(backend, method, path_info, query_string, headers, timeout, data=None, stream=False,
+                  parent=None, attempt=1):
+    """Uma tentativa no ``backend``, com contagem de requisições em andamento, métricas e circuit breaker.
+
+    Retorna a resposta com o backend ainda adquirido (quem a consome chama
+    ``backend.release()``); em erro libera o backend e levanta a exceção.
+    ``parent`` é o span da requisição (a tentativa pode rodar em outra
+    thread); o ``traceparent`` repassado ao Node.js aponta para a tentativa.
+    """
+    parent = parent or current_span()
+    span = tracer.span('upstream', parent=parent, backend=backend.id, attempt=attempt)
+    traceparent = span.traceparent() or parent.traceparent()
+    if traceparent:
+        headers = dict(headers, traceparent=traceparent)
+    backend.acquire()
+    start = time.perf_counter()
+    with span:
+        try:
+            response = upstream_session.request(method=method, url=upstream_url(backend, path_info, query_string),
+                                                headers=headers, data=data, timeout=timeout, stream=stream)
+        except requests.exceptions.RequestException as e:
+            backend.release()
+            backend.record_failure()
+            UPSTREAM_RESPONSES.labels(backend.id, 504 if isinstance(e, requests.exceptions.Timeout) else 502).inc()
+            raise
+        except Exception:
+            backend.release()
+            raise
+        span.set('status', response.status_code)
+    backend.record_success()
+    UPSTREAM_LATENCY.labels(backend.id).observe(time.perf_counter() - start)
+    UPSTREAM_RESPONSES.labels(backend.id, response.status_code).inc()
+    return response
+
+def discard_response(result):
+    """Descarta a resposta de uma tentativa que perdeu o hedge."""
+    backend, response = result
+    response.close()
+    backend.release()
+
+def fetch_buffered(path_info, query_string, headers):
+    """GET ao Node.js com o corpo inteiro em memória, para o micro-cache.
+
+    Um corpo truncado falha aqui, antes de qualquer byte ir para o cliente,
+    e pode ser repetido como qualquer erro de transporte.
+    """
+    headers = dict(headers)
+    # Corpo sem compressão e sem 304 do Node.js: a entrada serve a qualquer cliente
+    headers['accept-encoding'] = 'identity'
+    headers.pop('if-none-match', None)
+    headers.pop('if-modified-since', None)
+    policy = route_policies.match('GET', path_info)
+    parent = current_span()
+    tried = []
+
+    def attempt():
+        backend = backend_pool.select(exclude=tried)
+        if backend is None:
+            raise requests.exceptions.ConnectionError('Nenhum servidor Node.js disponível')
+        tried.append(backend)
+        # Sem stream: o corpo já foi lido e a conexão voltou ao pool
+        response = send_upstream(backend, 'GET', path_info, query_string, headers, policy.timeout,
+                                 parent=parent, attempt=len(tried))
+        backend.release()
+        status = f"{response.status_code} {response.reason}"
+        return status, forward_headers(response.raw.headers.items()), response.content
+
+    return hedger.call(policy, attempt)
+
+def with_android_cors(environ, response_headers):
+    """Acrescenta os CORS headers quando a requisição vem do Android (sem sobrescrever os do Node.js)."""
+    if 'Android' not in environ.get('HTTP_USER_AGENT', ''):
+        return response_headers
+    present = {name.lower() for name, _ in response_headers}
+    cors_headers = [
+        ('Access-Control-Allow-Origin', '*'),
+        ('Access-Control-Allow-Methods', 'GET, POST, PUT, PATCH, DELETE, OPTIONS'),
+        ('Access-Control-Allow-Headers', 'Content-Type, Authorization, Upload-Offset, Range')
+    ]
+    return response_headers + [h for h in cors_headers if h[0].lower() not in present]
+
+def cached_request(environ, start_response, resource, path_info, query_string, headers):
+    """Atende um GET cacheável: entrada fresca, entrada velha + revalidação, ou busca no Node.js."""
+    # Toda resposta daqui (HIT, STALE, MISS, BYPASS, 304 e erros) leva os CORS do Android
+    def respond(status, response_headers):
+        return start_response(status, with_android_cors(environ, response_headers))
+    
+    key = response_cache.key(path_info, query_string)
+    entry, fresh = response_cache.get(key)
+    if entry is not None:
+        if not fresh:
+            response_cache.revalidate(key, resource, lambda: fetch_buffered(path_info, query_string, headers))
+        current_span().set('cache', 'HIT' if fresh else 'STALE')
+        status, response_headers, body = response_cache.respond(entry, environ, 'HIT' if fresh else 'STALE')
+        respond(status, response_headers)
+        return body
+    
+    current_span().set('cache', 'MISS')
+    generation = response_cache.generation(resource)
+    try:
+        status, response_headers, body = fetch_buffered(path_info, query_string, headers)
+    except requests.exceptions.Timeout:
+        logging.error(f"Timeout ao buscar {key} no Node.js")
+        respond('504 Gateway Timeout', [('Content-Type', 'text/plain')])
+        return [b'Gateway Timeout']
+    except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+        # ChunkedEncodingError: o Node.js encerrou no meio do corpo
+        logging.error(f"Erro de conexão ao buscar {key}: {str(e)}")
+        respond('502 Bad Gateway', [('Content-Type', 'text/plain')])
+        return [b'Could not connect to Node.js server']
+    
+    entry = response_cache.store(key, resource, generation, status, response_headers, body)
+    if entry is None:
+        # Resposta não cacheável (erro, no-store, grande demais): repassa como veio
+        response_headers = [(k, v) for k, v in response_headers if k.lower() != 'content-length']
+        respond(status, response_headers + [('Content-Length', str(len(body))), ('X-Cache', 'BYPASS')])
+        return [body]
+    status, response_headers, body = response_cache.respond(entry, environ, 'MISS')
+    respond(status, response_headers)
+    return body
+
 # Função para encaminhar requisições para o Node.js
 def proxy_request(environ, start_response):
     """Encaminha requisições para o servidor Node.js"""
     try:
-        # Verifica se o servidor Node.js está rodando
-        if not check_node_server():
-            logging.error("Servidor Node.js não está rodando na porta 3000")
-            status = '502 Bad Gateway'
-            headers = [('Content-Type', 'text/plain')]
-            start_response(status, headers)
-            return [b'Node.js server is not running']
-        
         # Obtém informações da requisição
         path_info = environ.get('PATH_INFO', '')
         query_string = environ.get('QUERY_STRING', '')
@@ -87,17 +212,12 @@ def proxy_request(environ, start_response):
         content_length = environ.get('CONTENT_LENGTH', '')
         content_type = environ.get('CONTENT_TYPE', '')
         
-        # Constrói a URL do Node.js
-        url = urljoin(NODE_SERVER, path_info)
-        if query_string:
-            url += '?' + query_string
-        
-        # Prepara os headers
-        headers = {
-            key[5:].replace('_', '-').lower(): value
+        # Prepara os headers (sem os hop-by-hop, que valem só para esta conexão)
+        headers = dict(forward_headers([
+            (key[5:].replace('_', '-').lower(), value)
             for key, value in environ.items()
             if key.startswith('HTTP_')
-        }
+        ]))
         
         if content_type:
             headers['content-type'] = content_type
@@ -106,31 +226,68 @@ def proxy_request(environ, start_response):
         if environ.get('HTTP_ORIGIN'):
             headers['origin'] = environ.get('HTTP_ORIGIN')
         
-        # Lê o corpo da requisição
-        body = None
-        if content_length and content_length != '0':
-            body = environ['wsgi.input'].read(int(content_length))
+        # APIs de leitura com micro-cache; escritas invalidam o recurso
+        resource = response_cache.resource_for(path_info)
+        if resource and method == 'GET':
+            return cached_request(environ, start_response, resource, path_info, query_string, headers)
+        if resource and method in WRITE_METHODS:
+            response_cache.invalidate(resource)
+        
+        # Escolhe o backend: sessão Socket.IO existente, sala ou menor carga.
+        # Falha rápido enquanto o monitor/circuit breaker indicam todos fora do ar
+        sid, room_id, pinned = affinity_keys(environ)
+        backend = backend_pool.select(sid=sid, room_id=room_id, pinned=pinned)
+        if backend is None:
+            logging.error(f"Nenhum servidor Node.js disponível em {NODE_BACKENDS}")
+            status = '502 Bad Gateway'
+            headers = [('Content-Type', 'text/plain')]
+            start_response(status, headers)
+            return [b'Node.js server is not running']
+        
+        # Constrói a URL do Node.js
+        url = upstream_url(backend, path_info, query_string)
+        
+        # O corpo é repassado em blocos conforme o Node.js consome, sem buffer completo
+        body = request_body(environ['wsgi.input'], content_length,
+                            environ.get('wsgi.input_terminated', False))
         
         # Log da requisição
-        logging.debug(f"Encaminhando {method} {url}")
+        logging.debug(f"Encaminhando {method} {url} ({content_length or 0} bytes)")
         logging.debug(f"Headers: {json.dumps(headers)}")
-        if body and logging.getLogger().level == logging.DEBUG:
-            try:
-                body_text = body.decode('utf-8')
-                logging.debug(f"Body: {body_text}")
-            except:
-                logging.debug("Body: [conteúdo binário]")
+        
+        # Timeout da rota; GETs idempotentes podem ser repetidos ou ganhar hedge em outro backend
+        policy = route_policies.match(method, path_info, has_body=body is not None)
+        parent = current_span()
+        tried = []
+        
+        def attempt():
+            target = backend_pool.select(sid=sid, room_id=room_id, pinned=pinned, exclude=tried) if tried else backend
+            if target is None:
+                raise requests.exceptions.ConnectionError('Nenhum servidor Node.js disponível')
+            tried.append(target)
+            return target, send_upstream(target, method, path_info, query_string, headers, policy.timeout,
+                                         data=body, stream=True, parent=parent, attempt=len(tried))
         
         # Faz a requisição para o Node.js
         try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=headers,
-                data=body,
-                timeout=TIMEOUT,
-                stream=True
-            )
+            backend, response = hedger.call(policy, attempt, discard=discard_response)
+        except requests.exceptions.Timeout:
+            logging.error(f"Timeout ao conectar com {url}")
+            status = '504 Gateway Timeout'
+            headers = [('Content-Type', 'text/plain')]
+            start_response(status, headers)
+            return [b'Gateway Timeout']
+        except requests.exceptions.ConnectionError as e:
+            logging.error(f"Erro de conexão com {url}: {str(e)}")
+            status = '502 Bad Gateway'
+            headers = [('Content-Type', 'text/plain')]
+            start_response(status, headers)
+            return [b'Could not connect to Node.js server']
+        
+        try:
+            if resource and method in WRITE_METHODS:
+                # Leituras iniciadas durante a escrita não chegam ao cache
+                response_cache.invalidate(resource)
             
             # Log da resposta
             logging.debug(f"Resposta do Node.js: {response.status_code}")
@@ -138,37 +295,27 @@ def proxy_request(environ, start_response):
             
             # Prepara a resposta
             status = f"{response.status_code} {response.reason}"
-            response_headers = [
-                (key, value)
-                for key, value in response.headers.items()
-            ]
+            # raw.headers preserva headers repetidos (ex.: vários Set-Cookie)
+            response_headers = forward_headers(response.raw.headers.items())
             
             # Adiciona CORS headers se vierem do Android
-            if environ.get('HTTP_USER_AGENT') and 'Android' in environ.get('HTTP_USER_AGENT'):
-                cors_headers = [
-                    ('Access-Control-Allow-Origin', '*'),
-                    ('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS'),
-                    ('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-                ]
-                response_headers.extend([h for h in cors_headers if h[0] not in dict(response_headers)])
+            response_headers = with_android_cors(environ, response_headers)
+            
+            # Handshake do Socket.IO: fixa a nova sessão neste backend
+            on_first_chunk = None
+            if path_info.startswith('/socket.io/') and not sid and response.status_code == 200:
+                on_first_chunk = backend_pool.capture_handshake(backend)
+                response_headers.append(
+                    ('Set-Cookie', f'{STICKY_COOKIE}={backend.id}; Path=/socket.io/; HttpOnly; SameSite=Lax'))
             
             # Inicia a resposta
             start_response(status, response_headers)
-            return response.iter_content(chunk_size=4096)
+            return StreamedBody(response, on_close=backend.release, on_first_chunk=on_first_chunk)
             
-        except requests.exceptions.Timeout:
-            logging.error(f"Timeout ao conectar com {url}")
-            status = '504 Gateway Timeout'
-            headers = [('Content-Type', 'text/plain')]
-            start_response(status, headers)
-            return [b'Gateway Timeout']
-            
-        except requests.exceptions.ConnectionError as e:
-            logging.error(f"Erro de conexão com {url}: {str(e)}")
-            status = '502 Bad Gateway'
-            headers = [('Content-Type', 'text/plain')]
-            start_response(status, headers)
-            return [b'Could not connect to Node.js server']
+        except Exception:
+            response.close()
+            backend.release()
+            raise
             
     except Exception as e:
         logging.error(f"Erro ao processar requisição: {str(e)}", exc_info=True)
@@ -178,13 +325,29 @@ def proxy_request(environ, start_response):
         return [b'Internal Server Error']
 
 def application(environ, start_response):
-    """Função principal da aplicação WSGI"""
+    """Função principal da aplicação WSGI (abre o span raiz da requisição)"""
+    method = environ.get('REQUEST_METHOD', '')
+    path_info = environ.get('PATH_INFO', '')
+    route = route_policies.match(method, path_info).prefix or 'estático'
+    span = tracer.root(f'proxy {method} {route}', environ.get('HTTP_TRACEPARENT'), path=path_info)
+    if span.sampled:
+        def traced_start_response(status, headers, exc_info=None):
+            span.set('status', int(status[:3]))
+            return start_response(status, headers, exc_info)
+    else:
+        traced_start_response = start_response
+    # O span termina quando os headers saem; o streaming do corpo fica fora
+    with span:
+        return route_request(environ, traced_start_response)
+
+def route_request(environ, start_response):
+    """Atende a requisição: preflight, métricas, proxy para o Node.js ou arquivo estático"""
     try:
         path_info = environ.get('PATH_INFO', '')
         method = environ.get('REQUEST_METHOD', '')
         
-        # Log da requisição
-        logging.info(f"Requisição recebida: {method} {path_info}")
+        # Log da requisição (amostrado; formatação adiada para depois da amostragem)
+        request_log.info("Requisição recebida: %s %s", method, path_info)
         
         # Tratamento de CORS preflight requests
         if method == 'OPTIONS':
@@ -192,19 +355,24 @@ def application(environ, start_response):
             headers = [
                 ('Content-Type', 'text/plain'),
                 ('Access-Control-Allow-Origin', '*'),
-                ('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS'),
-                ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
+                ('Access-Control-Allow-Methods', 'GET, POST, PUT, PATCH, DELETE, OPTIONS'),
+                ('Access-Control-Allow-Headers', 'Content-Type, Authorization, Upload-Offset, Range'),
                 ('Access-Control-Max-Age', '86400')  # 24 horas
             ]
             start_response(status, headers)
             return [b'']
         
+        # Métricas do próprio proxy (não são encaminhadas)
+        if path_info == '/api/metrics':
+            start_response('200 OK', [('Content-Type', metrics.CONTENT_TYPE), ('Cache-Control', 'no-store')])
+            return [metrics.render().encode('utf-8')]
+        
         # Se for uma requisição para o Socket.IO, WebRTC ou API, encaminha para o Node.js
         if path_info.startswith('/socket.io/') or path_info.startswith('/api/') or path_info.startswith('/webrtc/'):
             return proxy_request(environ, start_response)
         
         # Para todas as outras requisições, tenta servir arquivos estáticos
-        status, headers, content = serve_static_file(path_info)
+        status, headers, content = serve_static_file(path_info, environ)
         start_response(status, headers)
         return content
         
@@ -0,0 +1,317 @@
+"""
+Telemetria de qualidade (QoS) do áudio das salas.
+
+Cada cliente envia periodicamente, no evento ``qos_report``, o jitter, a
+perda de pacotes e o bitrate do áudio que recebe de cada par. Uma amostra
+descreve um link ``origem -> destino`` (quem envia o áudio -> quem mede).
+
+As amostras de uma sala vão para um buffer circular de tamanho fixo
+(``BUFFER_SAMPLES``), uma coluna NumPy por campo: a memória de uma sala não
+cresce com a duração do ensaio e a gravação de um relatório é uma atribuição
+vetorizada. Os participantes ganham um índice pequeno na sala (reaproveitado
+quando saem, depois de apagadas as amostras deles).
+
+Os percentis da janela recente (``WINDOW_S``) saem sem laço em Python por
+grupo: as amostras são ordenadas por (grupo, valor) com ``np.lexsort`` e o
+percentil de todos os grupos é uma indexação só (rank mais próximo). Os
+grupos são cada link, cada participante como origem (como a sala o ouve) e
+cada participante como destino (como ele ouve a sala).
+
+Um link fica degradado quando tem ao menos ``MIN_SAMPLES`` na janela e o
+p90 do jitter ou da perda passa do limite, ou o p10 do bitrate fica abaixo
+do mínimo; só volta ao normal quando todos ficam a ``CLEAR_RATIO`` do limite
+(histerese, para não alternar a cada relatório). As mudanças de estado são
+devolvidas a quem registrou o relatório, que avisa a sala (``qos_alert``).
+
+O NumPy só é importado quando a primeira sala envia um relatório (~120 ms
+que não entram na inicialização do app).
+"""
+import math
+import time
+import threading
+
+import metrics
+from config import SERVER_CONFIG
+
+np = None  # numpy, importado por _numpy() no primeiro uso
+
+QUANTILES = (0.1, 0.5, 0.9, 0.99)
+QUANTILE_NAMES = ('p10', 'p50', 'p90', 'p99')
+# Campo do payload -> coluna do buffer
+FIELDS = (('jitterMs', 'jitter'), ('packetLoss', 'loss'), ('bitrateKbps', 'kbps'))
+
+# Motivos de alerta, na ordem das colunas de FIELDS
+REASONS = ('jitter', 'loss', 'bitrate')
+DEGRADED = 'degraded'
+RECOVERED = 'recovered'
+
+SAMPLES = metrics.counter('mesa_qos_samples_total', 'Amostras de QoS por link recebidas', ('result',))
+ALERTS = metrics.counter('mesa_qos_alerts_total', 'Mudanças de estado dos links (degradado/recuperado)', ('state',))
+AGGREGATION = metrics.histogram('mesa_qos_aggregation_seconds', 'Cálculo dos percentis de uma sala', ('kind',))
+
+
+def _numpy():
+    """Importa o numpy no primeiro uso, como o yt_dlp no music_service."""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def grouped_percentiles(groups, values, quantiles=QUANTILES):
+    """(grupos, contagens, percentis[grupo, quantil]) de ``values`` agrupados por ``groups``."""
+    _numpy()
+    order = np.lexsort((values, groups))
+    keys, starts, counts = np.unique(groups[order], return_index=True, return_counts=True)
+    # Rank mais próximo: ceil(q * n) - 1, dentro do trecho ordenado de cada grupo
+    ranks = np.maximum(np.ceil(np.outer(counts, quantiles)).astype(np.int64) - 1, 0)
+    return keys, counts, values[order][starts[:, None] + ranks]
+
+
+def _number(value, upper=None):
+    """Valor medido como float (NaN se ausente ou inválido)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return math.nan
+    value = float(value)
+    if not math.isfinite(value) or value < 0:
+        return math.nan
+    return min(value, upper) if upper is not None else value
+
+
+class RoomQoS:
+    """Buffer circular de amostras de uma sala e o estado dos alertas dos links."""
+
+    def __init__(self, capacity):
+        _numpy()
+        self.capacity = capacity
+        self.time = np.full(capacity, -np.inf)  # -inf: posição vazia ou apagada
+        self.source = np.zeros(capacity, dtype=np.int16)
+        self.target = np.zeros(capacity, dtype=np.int16)
+        self.columns = {column: np.full(capacity, np.nan, dtype=np.float32) for _, column in FIELDS}
+        self.head = 0
+        self.slots = {}  # {sid: índice}
+        self.sids = {}  # {índice: sid}
+        self.degraded = {}  # {(origem, destino): motivos}
+        self.evaluated_at = 0.0
+
+    def slot(self, sid):
+        index = self.slots.get(sid)
+        if index is None:
+            index = next(i for i in range(len(self.slots) + 1) if i not in self.sids)
+            self.slots[sid] = index
+            self.sids[index] = sid
+        return index
+
+    def append(self, now, sources, target, rows):
+        """Grava as linhas (uma por link) a partir de ``head``, sobrescrevendo as mais antigas."""
+        positions = (self.head + np.arange(len(sources))) % self.capacity
+        self.time[positions] = now
+        self.source[positions] = sources
+        self.target[positions] = target
+        for column, values in zip(self.columns.values(), rows.T):
+            column[positions] = values
+        self.head = int(positions[-1] + 1) % self.capacity
+
+    def forget(self, sid):
+        """Apaga as amostras de/para ``sid`` e libera o índice dele."""
+        index = self.slots.pop(sid, None)
+        if index is None:
+            return
+        del self.sids[index]
+        self.time[(self.source == index) | (self.target == index)] = -np.inf
+        for key in [key for key in self.degraded if index in key]:
+            del self.degraded[key]
+
+    def link_groups(self):
+        """Chave de grupo de cada linha para o link (origem, destino)."""
+        return self.source.astype(np.int32) * 65536 + self.target
+
+    def window(self, now, window_s):
+        """Máscara das amostras dentro da janela."""
+        return self.time >= now - window_s
+
+    def stats(self, mask, groups):
+        """(grupos, contagens, {coluna: percentis[grupo, quantil]}) das amostras em ``mask``."""
+        groups = groups[mask]
+        keys, counts = np.unique(groups, return_counts=True)
+        result = {}
+        for _, name in FIELDS:
+            values = self.columns[name][mask]
+            table = np.full((len(keys), len(QUANTILES)), np.nan)
+            measured = ~np.isnan(values)
+            if measured.any():
+                found, _, percentiles = grouped_percentiles(groups[measured], values[measured])
+                table[np.searchsorted(keys, found)] = percentiles
+            result[name] = table
+        return keys, counts, result
+
+
+def _link(key):
+    """(origem, destino) de uma chave de ``RoomQoS.link_groups``."""
+    return int(key) >> 16, int(key) & 0xFFFF
+
+
+def _summary(percentiles, row):
+    """{campo: {p10, p50, ...}} de uma linha das tabelas de percentis (campos sem medição ficam de fora)."""
+    summary = {}
+    for field, column in FIELDS:
+        values = percentiles[column][row]
+        if not np.isnan(values[0]):
+            summary[field] = {name: round(float(value), 4) for name, value in zip(QUANTILE_NAMES, values)}
+    return summary
+
+
+class QoSMonitor:
+    """Amostras de QoS por sala, percentis por participante e por link, e alertas."""
+
+    def __init__(self, config=None):
+        self.config = dict(SERVER_CONFIG['QOS'], **(config or {}))
+        self._rooms = {}  # {room_id: RoomQoS}
+        self._lock = threading.Lock()
+
+    def report(self, room_id, sid, links, members=None, now=None):
+        """Grava as medições de ``sid`` ({par: {jitterMs, packetLoss, bitrateKbps}}).
+
+        ``members``, se informado, limita os pares aceitos. Retorna as
+        mudanças de estado dos links da sala ([{from, to, state, ...}]).
+        """
+        now = time.monotonic() if now is None else now
+        peers = []
+        rows = []
+        for peer, sample in list(links.items())[:self.config['MAX_LINKS_PER_REPORT']]:
+            if peer == sid or not isinstance(sample, dict) or (members is not None and peer not in members):
+                continue
+            row = (_number(sample.get('jitterMs')), _number(sample.get('packetLoss'), 1.0),
+                   _number(sample.get('bitrateKbps')))
+            if all(math.isnan(value) for value in row):
+                continue
+            peers.append(peer)
+            rows.append(row)
+        rejected = len(links) - len(rows)
+        if rejected:
+            SAMPLES.labels('rejected').inc(rejected)
+        if not rows:
+            return []
+        SAMPLES.labels('accepted').inc(len(rows))
+
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = RoomQoS(self.config['BUFFER_SAMPLES'])
+            sources = np.array([room.slot(peer) for peer in peers], dtype=np.int16)
+            room.append(now, sources, room.slot(sid), np.array(rows, dtype=np.float32))
+            if now - room.evaluated_at < self.config['ALERT_INTERVAL_S']:
+                return []
+            room.evaluated_at = now
+            return self._evaluate(room_id, room, now)
+
+    def _evaluate(self, room_id, room, now):
+        """Atualiza o estado dos links da sala; retorna as mudanças."""
+        config = self.config
+        mask = room.window(now, config['WINDOW_S'])
+        if not mask.any():
+            return []
+        start = time.perf_counter()
+        keys, counts, percentiles = room.stats(mask, room.link_groups())
+        AGGREGATION.labels('alerts').observe(time.perf_counter() - start)
+        p90 = QUANTILE_NAMES.index('p90')
+        p10 = QUANTILE_NAMES.index('p10')
+        jitter = percentiles['jitter'][:, p90]
+        loss = percentiles['loss'][:, p90]
+        kbps = percentiles['kbps'][:, p10]
+        clear = config['CLEAR_RATIO']
+        enough = counts >= config['MIN_SAMPLES']
+        # Comparações com NaN (campo não medido) são falsas: não alertam nem impedem a recuperação
+        with np.errstate(invalid='ignore'):
+            bad = np.stack((jitter > config['JITTER_ALERT_MS'], loss > config['LOSS_ALERT'],
+                            kbps < config['MIN_BITRATE_KBPS']), axis=1) & enough[:, None]
+            still_bad = np.stack((jitter > config['JITTER_ALERT_MS'] * clear, loss > config['LOSS_ALERT'] * clear,
+                                  kbps < config['MIN_BITRATE_KBPS'] / clear), axis=1)
+
+        changes = []
+        current = {_link(key): i for i, key in enumerate(keys)}
+        for link, i in current.items():
+            if bad[i].any() and link not in room.degraded:
+                room.degraded[link] = tuple(reason for reason, flag in zip(REASONS, bad[i]) if flag)
+                changes.append(self._change(room_id, room, link, DEGRADED, jitter[i], loss[i], kbps[i]))
+        for link in list(room.degraded):
+            i = current.get(link)
+            # Sem amostras na janela (par parou de reportar) também encerra o alerta
+            if i is None or not still_bad[i].any():
+                reasons_then = room.degraded.pop(link)
+                values = (jitter[i], loss[i], kbps[i]) if i is not None else (math.nan,) * 3
+                changes.append(self._change(room_id, room, link, RECOVERED, *values, reasons=reasons_then))
+        return changes
+
+    def _change(self, room_id, room, link, state, jitter, loss, kbps, reasons=None):
+        ALERTS.labels(state).inc()
+        change = {
+            'roomId': room_id,
+            'from': room.sids[link[0]],
+            'to': room.sids[link[1]],
+            'state': state,
+            'reasons': list(reasons if reasons is not None else room.degraded[link]),
+        }
+        for key, value in (('jitterMsP90', jitter), ('packetLossP90', loss), ('bitrateKbpsP10', kbps)):
+            if not math.isnan(value):
+                change[key] = round(float(value), 4)
+        return change
+
+    def quality(self, room_id, now=None):
+        """Percentis da janela por participante (como origem e como destino) e por link; None se sem dados."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                return None
+            mask = room.window(now, self.config['WINDOW_S'])
+            start = time.perf_counter()
+            link_keys, link_counts, link_stats = room.stats(mask, room.link_groups())
+            sent_keys, sent_counts, sent_stats = room.stats(mask, room.source)
+            recv_keys, recv_counts, recv_stats = room.stats(mask, room.target)
+            AGGREGATION.labels('quality').observe(time.perf_counter() - start)
+            sids = dict(room.sids)
+            degraded = dict(room.degraded)
+
+        participants = {sid: {} for sid in sids.values()}
+        for direction, keys, counts, stats in (('sending', sent_keys, sent_counts, sent_stats),
+                                               ('receiving', recv_keys, recv_counts, recv_stats)):
+            for row, key in enumerate(keys):
+                participants[sids[int(key)]][direction] = dict(_summary(stats, row), samples=int(counts[row]))
+        links = []
+        for row, key in enumerate(link_keys):
+            link = _link(key)
+            entry = {'from': sids[link[0]], 'to': sids[link[1]], 'samples': int(link_counts[row])}
+            entry.update(_summary(link_stats, row))
+            if link in degraded:
+                entry['degraded'] = list(degraded[link])
+            links.append(entry)
+        return {
+            'roomId': room_id,
+            'windowS': self.config['WINDOW_S'],
+            'samples': int(mask.sum()),
+            'participants': participants,
+            'links': links,
+            'degradedLinks': len(degraded),
+        }
+
+    def degraded_links(self):
+        """Links degradados em todas as salas."""
+        return sum(len(room.degraded) for room in list(self._rooms.values()))
+
+    def leave(self, room_id, sid):
+        """Apaga as amostras de um participante que saiu da sala."""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is not None:
+                room.forget(sid)
+
+    def release_room(self, room_id):
+        """Libera os buffers de uma sala encerrada."""
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+
+# Instância global
+qos_monitor = QoSMonitor()
@@ -0,0 +1,153 @@
+"""
+Limite de taxa por cliente para eventos Socket.IO.
+
+Eventos como ``send_message``, ``update_user_position`` e ``webrtc_signal``
+são repassados para a sala inteira: uma aba com defeito mandando centenas por
+segundo multiplica esse custo pelo número de participantes. ``RateLimiter``
+mantém um token bucket por (sid, evento), configurado em
+``SERVER_CONFIG['RATE_LIMITS']`` (taxa, rajada e política):
+
+- ``drop``: o evento acima do limite é descartado e o ack informa
+  ``retryAfter``;
+- ``merge``: só o último payload acima do limite é guardado e entregue assim
+  que houver um token (posições, andamento: só o valor mais recente importa).
+
+Eventos fora da configuração não são envolvidos. No caminho quente a
+verificação é um acesso a dicionário e algumas contas, sem lock: duas
+chamadas simultâneas do mesmo sid podem, no máximo, passar um evento a mais.
+"""
+import time
+import logging
+import threading
+
+from flask import current_app, request
+
+import metrics
+from config import SERVER_CONFIG
+
+DROP = 'drop'
+MERGE = 'merge'
+
+LIMITED = metrics.counter('mesa_socketio_rate_limited_total',
+                          'Eventos Socket.IO acima do limite por cliente', ('event', 'action'))
+
+
+def _deferred_call(handler, args):
+    """Chamada de ``handler`` para depois, no mesmo contexto (sid, namespace) do evento atual."""
+    app = current_app._get_current_object()
+    environ = request.environ
+    sid = request.sid
+    namespace = request.namespace
+    event = getattr(request, 'event', None)
+
+    def call():
+        with app.request_context(environ):
+            request.sid = sid
+            request.namespace = namespace
+            request.event = event
+            handler(*args)
+
+    return call
+
+
+class RateLimiter:
+    """Token buckets por (sid, evento) aplicados como wrapper dos handlers."""
+
+    def __init__(self, limits=None):
+        self.limits = SERVER_CONFIG['RATE_LIMITS'] if limits is None else limits
+        self._buckets = {}  # {sid: {evento: [tokens, instante]}}
+        self._pending = {}  # {(sid, evento): (prazo, chamada)}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def wrap(self, event, handler):
+        """Wrapper para ``InstrumentedSocketIO.handler_wrappers``."""
+        limit = self.limits.get(event)
+        if not limit:
+            return handler
+        rate = float(limit['rate'])
+        burst = float(limit['burst'])
+        merge = limit.get('policy', DROP) == MERGE
+        buckets = self._buckets
+        pending = self._pending
+        clock = time.monotonic
+        over_limit = LIMITED.labels(event, 'merged' if merge else 'dropped')
+
+        def limited(*args):
+            sid = request.sid
+            now = clock()
+            sid_buckets = buckets.get(sid)
+            if sid_buckets is None:
+                sid_buckets = buckets[sid] = {}
+            bucket = sid_buckets.get(event)
+            if bucket is None:
+                sid_buckets[event] = [burst - 1, now]
+                return handler(*args)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                if pending and (sid, event) in pending:
+                    # O payload guardado ficou velho: este é mais recente
+                    self._cancel((sid, event))
+                return handler(*args)
+            bucket[0] = tokens
+            wait = (1 - tokens) / rate
+            over_limit.inc()
+            if merge:
+                self._defer((sid, event), now + wait, _deferred_call(handler, args))
+                return {'success': True, 'merged': True}
+            return {'error': 'Limite de eventos excedido', 'retryAfter': round(wait, 3)}
+
+        return limited
+
+    def discard(self, sid):
+        """Remove os buckets e payloads pendentes de ``sid`` (desconexão)."""
+        self._buckets.pop(sid, None)
+        with self._cond:
+            for key in [key for key in self._pending if key[0] == sid]:
+                del self._pending[key]
+
+    def _defer(self, key, deadline, call):
+        with self._cond:
+            previous = self._pending.get(key)
+            # Substitui o payload pendente, mantendo o prazo já calculado
+            self._pending[key] = (previous[0] if previous else deadline, call)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='mesa-rate-limit', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _cancel(self, key):
+        with self._cond:
+            self._pending.pop(key, None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [key for key, (deadline, _) in self._pending.items() if deadline <= now]
+                if not due:
+                    self._cond.wait(min(deadline for deadline, _ in self._pending.values()) - now)
+                    continue
+                calls = []
+                for key in due:
+                    calls.append((key, self._pending.pop(key)[1]))
+                    bucket = self._buckets.get(key[0], {}).get(key[1])
+                    if bucket is not None:
+                        # A entrega atrasada consome o token pelo qual esperou
+                        limit = self.limits[key[1]]
+                        bucket[0] = min(float(limit['burst']),
+                                        bucket[0] + (now - bucket[1]) * float(limit['rate'])) - 1
+                        bucket[1] = now
+            for key, call in calls:
+                LIMITED.labels(key[1], 'flushed').inc()
+                try:
+                    call()
+                except Exception:
+                    logging.exception(f"Erro ao entregar evento {key[1]} agrupado de {key[0]}")
+
+
+rate_limiter = RateLimiter()
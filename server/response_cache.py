@@ -0,0 +1,157 @@
+"""
+Micro-cache de respostas das APIs de leitura atrás do proxy WSGI.
+
+``GET /api/events`` e ``GET /api/setlists`` fazem o Node.js reler e
+reinterpretar um arquivo JSON a cada chamada. O proxy guarda a resposta por
+poucos segundos (chave: caminho + query) e:
+
+- responde 304 a ``If-None-Match`` com o ETag da entrada;
+- depois do TTL, continua servindo a entrada antiga por até ``stale``
+  segundos enquanto uma thread busca a versão nova (stale-while-revalidate);
+- descarta todas as entradas do recurso quando um POST/PUT/PATCH/DELETE para
+  o mesmo recurso passa pelo proxy. Um contador de geração por recurso impede
+  que uma leitura iniciada antes da escrita grave no cache uma resposta velha.
+
+A invalidação é local ao processo: com vários workers WSGI, os outros só
+enxergam a escrita quando o TTL (curto) expira.
+"""
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import metrics
+from config import SERVER_CONFIG
+
+CACHE_EVENTS = metrics.counter('mesa_proxy_cache_total', 'Consultas ao micro-cache do proxy', ('result',))
+
+# Headers da resposta do Node.js que não são guardados
+_UNCACHED_HEADERS = frozenset(['set-cookie', 'content-length', 'etag', 'date', 'age', 'x-cache'])
+
+
+class CachedResponse:
+    __slots__ = ('status', 'headers', 'body', 'etag', 'stored_at', 'resource')
+
+    def __init__(self, status, headers, body, resource):
+        self.status = status
+        self.headers = [(k, v) for k, v in headers if k.lower() not in _UNCACHED_HEADERS]
+        self.body = body
+        upstream_etag = dict((k.lower(), v) for k, v in headers).get('etag')
+        self.etag = upstream_etag or '"%s"' % hashlib.md5(body).hexdigest()
+        self.stored_at = time.monotonic()
+        self.resource = resource
+
+
+class MicroCache:
+    """Cache LRU de respostas GET com TTL curto, revalidação em segundo plano e invalidação por escrita."""
+
+    def __init__(self, paths=None, ttl=None, stale=None, max_entries=None, max_body=None):
+        config = SERVER_CONFIG['CACHE']
+        self.paths = tuple(paths if paths is not None else config['PROXY_CACHE_PATHS'])
+        self.ttl = config['PROXY_CACHE_TTL'] if ttl is None else ttl
+        self.stale = config['PROXY_CACHE_STALE'] if stale is None else stale
+        self.max_entries = max_entries or config['PROXY_CACHE_ENTRIES']
+        self.max_body = max_body or config['PROXY_CACHE_MAX_BODY']
+        self._entries = OrderedDict()  # {chave: CachedResponse}
+        self._generations = {}  # {recurso: contador de escritas}
+        self._revalidating = set()
+        self._lock = threading.Lock()
+        self._hit = CACHE_EVENTS.labels('hit')
+        self._stale = CACHE_EVENTS.labels('stale')
+        self._miss = CACHE_EVENTS.labels('miss')
+
+    def resource_for(self, path):
+        """Recurso cacheável ('/api/events') que contém ``path``, ou None."""
+        for prefix in self.paths:
+            if path == prefix or path.startswith(prefix + '/'):
+                return prefix
+        return None
+
+    @staticmethod
+    def key(path, query_string):
+        return f'{path}?{query_string}' if query_string else path
+
+    def generation(self, resource):
+        return self._generations.get(resource, 0)
+
+    def get(self, key):
+        """Retorna (entrada, fresca) ou (None, False) se não houver entrada utilizável."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._miss.inc()
+                return None, False
+            age = now - entry.stored_at
+            if age > self.ttl + self.stale:
+                del self._entries[key]
+                self._miss.inc()
+                return None, False
+            self._entries.move_to_end(key)
+        if age <= self.ttl:
+            self._hit.inc()
+            return entry, True
+        self._stale.inc()
+        return entry, False
+
+    def store(self, key, resource, generation, status, headers, body):
+        """Guarda a resposta se for cacheável e nenhuma escrita ocorreu desde ``generation``."""
+        if not status.startswith('200') or len(body) > self.max_body:
+            return None
+        cache_control = dict((k.lower(), v) for k, v in headers).get('cache-control', '')
+        if 'no-store' in cache_control or 'private' in cache_control:
+            return None
+        entry = CachedResponse(status, headers, body, resource)
+        with self._lock:
+            if self._generations.get(resource, 0) != generation:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, resource):
+        """Descarta as entradas de ``resource`` (chamado em POST/PUT/PATCH/DELETE)."""
+        with self._lock:
+            self._generations[resource] = self._generations.get(resource, 0) + 1
+            for key in [k for k, entry in self._entries.items() if entry.resource == resource]:
+                del self._entries[key]
+
+    def revalidate(self, key, resource, fetch):
+        """Busca a versão nova de ``key`` em segundo plano (uma busca por chave).
+
+        ``fetch()`` retorna (status, headers, corpo em bytes).
+        """
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def run():
+            try:
+                generation = self.generation(resource)
+                self.store(key, resource, generation, *fetch())
+            except Exception as e:
+                logging.warning(f"Falha ao revalidar {key} no cache do proxy: {str(e)}")
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(target=run, name='mesa-cache-revalidate', daemon=True).start()
+
+    @staticmethod
+    def respond(entry, environ, state):
+        """Resposta WSGI (status, headers, corpo) da entrada, ou 304 se o ETag do cliente bater."""
+        age = str(int(time.monotonic() - entry.stored_at))
+        headers = [('ETag', entry.etag), ('Age', age), ('X-Cache', state)]
+        if not any(k.lower() == 'cache-control' for k, _ in entry.headers):
+            # O navegador revalida a cada uso, o que aqui custa um 304 sem ida ao Node.js
+            headers.append(('Cache-Control', 'no-cache'))
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH', '')
+        if if_none_match and (if_none_match.strip() == '*' or
+                              entry.etag in [tag.strip() for tag in if_none_match.split(',')]):
+            return '304 Not Modified', headers, [b'']
+        headers = entry.headers + headers + [('Content-Length', str(len(entry.body)))]
+        return entry.status, headers, [entry.body]
@@ -0,0 +1,242 @@
+"""
+Diretório das salas ativas com índices secundários e paginação por cursor.
+
+``list_rooms`` (Socket.IO) e ``GET /api/rooms`` consultam este diretório em
+vez de percorrer ``rooms``. Os índices são atualizados a cada entrada e saída:
+
+- listas ordenadas (bisect) por criação e por ocupação;
+- por instrumento de ``config.INSTRUMENTS``: salas que o têm e salas em que
+  ele falta ("salas precisando de baterista").
+
+Uma consulta com filtros de instrumento parte do menor conjunto candidato;
+sem filtros seletivos, percorre o índice da ordenação a partir do cursor.
+O cursor é opaco para o cliente: a chave de ordenação do último item da
+página, em base64.
+"""
+import json
+import base64
+import threading
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+
+from config import INSTRUMENTS
+
+SORTS = ('created', 'occupancy')
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Ids enviados pelo cliente web (EnhancedLoginScreen) que não são o nome do instrumento
+_ALIASES = {
+    'voz': 'Vocal',
+    'piano': 'Piano/Teclado',
+    'teclado': 'Piano/Teclado',
+    'violao': 'Violão',
+}
+
+
+def _fold(value):
+    """Minúsculas e sem acentos, para comparar 'Violão', 'violao' e 'VIOLÃO'."""
+    decomposed = unicodedata.normalize('NFKD', value.strip().lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+_CANONICAL = dict({_fold(name): name for name in INSTRUMENTS}, **_ALIASES)
+
+
+def instrument_name(value):
+    """Nome canônico do instrumento em ``INSTRUMENTS`` (pelo nome ou id do cliente), ou None."""
+    if not isinstance(value, str):
+        return None
+    return _CANONICAL.get(_fold(value))
+
+
+def _encode_cursor(sort, order, key):
+    raw = json.dumps([sort, order, list(key)], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, sort, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_order, key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+    if cursor_sort != sort or cursor_order != order:
+        raise ValueError('Cursor de outra ordenação')
+    return tuple(key)
+
+
+class _Entry:
+    __slots__ = ('room_id', 'created_at', 'owner', 'users', 'instruments')
+
+    def __init__(self, room_id, created_at, owner):
+        self.room_id = room_id
+        self.created_at = created_at
+        self.owner = owner
+        self.users = 0
+        self.instruments = {}  # {instrumento: músicos}
+
+    def key(self, sort):
+        if sort == 'occupancy':
+            return (self.users, self.created_at, self.room_id)
+        return (self.created_at, self.room_id)
+
+    def to_dict(self):
+        created = datetime.fromtimestamp(self.created_at, timezone.utc)
+        return {
+            'id': self.room_id,
+            'usersCount': self.users,
+            'createdAt': created.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            'owner': self.owner,
+            'instruments': dict(self.instruments),
+        }
+
+
+class RoomDirectory:
+    """Índices das salas ativas, mantidos incrementalmente."""
+
+    def __init__(self):
+        self._entries = {}  # {room_id: _Entry}
+        self._index = {sort: [] for sort in SORTS}  # {ordenação: [chave ordenada]}
+        self._with = {name: set() for name in INSTRUMENTS}  # {instrumento: salas que o têm}
+        self._without = {name: set() for name in INSTRUMENTS}  # {instrumento: salas sem ele}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ----- Atualização (entradas e saídas) -----
+
+    def add_room(self, room_id, created_at, owner):
+        with self._lock:
+            if room_id in self._entries:
+                return
+            entry = self._entries[room_id] = _Entry(room_id, created_at, owner)
+            for sort in SORTS:
+                insort(self._index[sort], entry.key(sort))
+            for rooms in self._without.values():
+                rooms.add(room_id)
+
+    def remove_room(self, room_id):
+        with self._lock:
+            entry = self._entries.pop(room_id, None)
+            if entry is None:
+                return
+            for sort in SORTS:
+                self._remove_key(sort, entry.key(sort))
+            for name in INSTRUMENTS:
+                self._with[name].discard(room_id)
+                self._without[name].discard(room_id)
+
+    def add_user(self, room_id, instrument):
+        self._change_user(room_id, instrument_name(instrument), 1)
+
+    def remove_user(self, room_id, instrument):
+        self._change_user(room_id, instrument_name(instrument), -1)
+
+    def _change_user(self, room_id, instrument, delta):
+        with self._lock:
+            entry = self._entries.get(room_id)
+            if entry is None:
+                return
+            self._remove_key('occupancy', entry.key('occupancy'))
+            entry.users = max(0, entry.users + delta)
+            insort(self._index['occupancy'], entry.key('occupancy'))
+            if instrument is None:
+                return
+            count = entry.instruments.get(instrument, 0) + delta
+            if count > 0:
+                entry.instruments[instrument] = count
+                self._with[instrument].add(room_id)
+                self._without[instrument].discard(room_id)
+            else:
+                entry.instruments.pop(instrument, None)
+                self._with[instrument].discard(room_id)
+                self._without[instrument].add(room_id)
+
+    def _remove_key(self, sort, key):
+        index = self._index[sort]
+        position = bisect_left(index, key)
+        if position < len(index) and index[position] == key:
+            del index[position]
+
+    # ----- Consulta -----
+
+    def query(self, limit=DEFAULT_LIMIT, cursor=None, sort='created', order='desc',
+              needs=(), has=(), min_users=None, max_users=None):
+        """Uma página de salas: {'rooms': [...], 'nextCursor': str ou None}.
+
+        ``needs``/``has``: instrumentos ausentes/presentes na sala;
+        ``min_users``/``max_users``: faixa de ocupação. Levanta ValueError
+        para parâmetros inválidos.
+        """
+        if sort not in SORTS:
+            raise ValueError(f"Ordenação inválida: {sort}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Ordem inválida: {order}")
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        needs = self._instruments(needs)
+        has = self._instruments(has)
+        min_users = int(min_users) if min_users not in (None, '') else None
+        max_users = int(max_users) if max_users not in (None, '') else None
+        after = _decode_cursor(cursor, sort, order) if cursor else None
+
+        with self._lock:
+            keys = self._index[sort]
+            candidates = None
+            for name in has:
+                candidates = self._narrow(candidates, self._with[name])
+            for name in needs:
+                candidates = self._narrow(candidates, self._without[name])
+            if candidates is not None and len(candidates) * 4 < len(keys):
+                # Poucos candidatos: ordenar só eles sai mais barato que percorrer o índice
+                keys = sorted(self._entries[room_id].key(sort) for room_id in candidates)
+
+            lo, hi = 0, len(keys)
+            if sort == 'occupancy':
+                if min_users is not None:
+                    lo = bisect_left(keys, (min_users,))
+                if max_users is not None:
+                    hi = bisect_left(keys, (max_users + 1,))
+            if after is not None:
+                if order == 'desc':
+                    hi = min(hi, bisect_left(keys, after))
+                else:
+                    lo = max(lo, bisect_right(keys, after))
+
+            positions = range(hi - 1, lo - 1, -1) if order == 'desc' else range(lo, hi)
+            page = []
+            more = False
+            for position in positions:
+                key = keys[position]
+                entry = self._entries[key[-1]]
+                if candidates is not None and entry.room_id not in candidates:
+                    continue
+                if min_users is not None and entry.users < min_users:
+                    continue
+                if max_users is not None and entry.users > max_users:
+                    continue
+                if len(page) == limit:
+                    more = True
+                    break
+                page.append(entry)
+
+            next_cursor = _encode_cursor(sort, order, page[-1].key(sort)) if more else None
+            return {'rooms': [entry.to_dict() for entry in page], 'nextCursor': next_cursor}
+
+    @staticmethod
+    def _instruments(values):
+        if isinstance(values, str):
+            values = [value for value in values.split(',') if value.strip()]
+        names = []
+        for value in values or ():
+            name = instrument_name(value)
+            if name is None:
+                raise ValueError(f"Instrumento desconhecido: {value}")
+            names.append(name)
+        return names
+
+    @staticmethod
+    def _narrow(candidates, rooms):
+        return set(rooms) if candidates is None else candidates & rooms
@@ -0,0 +1,103 @@
+"""
+Agrupamento dos candidatos ICE repassados por ``webrtc_signal``.
+
+Com trickle ICE cada candidato chega como um evento próprio; numa sala em
+malha de 6-8 músicos isso são centenas de eventos no momento da entrada.
+O ``CandidateBatcher`` junta os candidatos de cada par (origem, destino)
+por uma janela curta (``CANDIDATE_BATCH_MS``) e os entrega num único frame
+``webrtc_signals``. A validação de sala é feita uma vez por lote, no
+primeiro candidato.
+
+A ordem por par é preservada: ofertas/respostas passam por ``send_now``, que
+primeiro entrega os candidatos pendentes do par; o fim dos candidatos
+(``end-of-candidates``) entra no lote e o entrega na hora.
+"""
+import time
+import logging
+import threading
+
+import metrics
+from config import SERVER_CONFIG
+
+BATCH_SIZE = metrics.histogram('mesa_ice_batch_size', 'Sinais por frame webrtc_signals',
+                               buckets=metrics.FANOUT_BUCKETS)
+END_OF_CANDIDATES = 'end-of-candidates'
+
+
+def is_end_of_candidates(signal_type, signal):
+    """Fim da coleta: tipo explícito ou candidato vazio (RTCIceCandidate com candidate == '')."""
+    if signal_type == END_OF_CANDIDATES:
+        return True
+    return signal_type == 'candidate' and isinstance(signal, dict) and signal.get('candidate') == ''
+
+
+class CandidateBatcher:
+    """Lotes de candidatos ICE por par (origem, destino) com uma thread de flush."""
+
+    def __init__(self, deliver, window=None, max_batch=None):
+        config = SERVER_CONFIG['WEBRTC']
+        # deliver(origem, destino, sinais) envia o frame; chamado com o lock adquirido
+        self.deliver = deliver
+        self.window = (config['CANDIDATE_BATCH_MS'] if window is None else window) / 1000
+        self.max_batch = max_batch or config['CANDIDATE_BATCH_MAX']
+        self._batches = {}  # {(origem, destino): (prazo, [sinais])}
+        self._lock = threading.Condition(threading.RLock())
+        self._thread = None
+
+    def pending(self, from_sid, to_sid):
+        return (from_sid, to_sid) in self._batches
+
+    def add(self, from_sid, to_sid, signal, flush=False):
+        """Acrescenta um sinal ao lote do par; ``flush`` entrega o lote imediatamente."""
+        key = (from_sid, to_sid)
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = (time.monotonic() + self.window, [])
+                self._batches[key] = batch
+                self._ensure_thread()
+                self._lock.notify()
+            batch[1].append(signal)
+            if flush or len(batch[1]) >= self.max_batch:
+                self._flush(key)
+
+    def send_now(self, from_sid, to_sid, send):
+        """Entrega os candidatos pendentes do par e então chama ``send()`` (oferta/resposta)."""
+        with self._lock:
+            self._flush((from_sid, to_sid))
+            return send()
+
+    def discard(self, sid):
+        """Descarta os lotes de/para ``sid`` (desconexão)."""
+        with self._lock:
+            for key in [key for key in self._batches if sid in key]:
+                del self._batches[key]
+
+    def _flush(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is not None and batch[1]:
+            BATCH_SIZE.observe(len(batch[1]))
+            self.deliver(key[0], key[1], batch[1])
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='mesa-ice-batcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with self._lock:
+            while True:
+                if not self._batches:
+                    self._lock.wait()
+                    continue
+                now = time.monotonic()
+                due = [key for key, (deadline, _) in self._batches.items() if deadline <= now]
+                for key in due:
+                    try:
+                        self._flush(key)
+                    except Exception:
+                        # Um destino com problema não pode parar a thread dos demais
+                        logging.exception(f"Erro ao entregar candidatos ICE de {key[0]} para {key[1]}")
+                if self._batches:
+                    next_deadline = min(deadline for deadline, _ in self._batches.values())
+                    self._lock.wait(max(0.0, next_deadline - time.monotonic()))
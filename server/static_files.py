@@ -0,0 +1,411 @@
+"""
+Camada de arquivos estáticos do MesaDigital.
+
+Mantém em memória um índice com os metadados do build do React (tamanho,
+mtime, ETag e tipo MIME), montado uma única vez (na inicialização ou, com
+``lazy=True``, na primeira requisição), para que
+cada requisição não precise tocar o disco só para descobrir o que servir.
+Responde requisições condicionais (If-None-Match / If-Modified-Since) com
+304, marca assets com hash no nome como imutáveis e entrega o conteúdo via
+``wsgi.file_wrapper`` (sendfile) quando o servidor WSGI oferece.
+
+Assets compressíveis ganham irmãos pré-comprimidos (``.br`` e ``.gz``),
+gerados no deploy (``python static_files.py precompress build``) ou em
+segundo plano na inicialização, e a codificação é negociada pelo
+``Accept-Encoding`` da requisição. Sem irmão em disco, o gzip é feito sob
+demanda e guardado num cache limitado em memória.
+"""
+import os
+import re
+import sys
+import gzip
+import time
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from config import SERVER_CONFIG
+
+try:
+    import brotli
+except ImportError:  # Brotli é opcional: sem ele só geramos/servimos gzip
+    brotli = None
+
+# Assets gerados pelo build do CRA carregam o hash do conteúdo no nome
+# (ex.: main.3f2a1b9c.js, 787.a1b2c3d4.chunk.css, logo.5d5d9eef.svg)
+HASHED_ASSET_RE = re.compile(r'\.[0-9a-f]{8,}(\.chunk)?\.[A-Za-z0-9]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+BLOCK_SIZE = 64 * 1024
+# Intervalo mínimo entre verificações de que o build foi refeito no disco
+REFRESH_INTERVAL = 5.0
+INDEX_FILE = 'index.html'
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'application/manifest+json', 'application/xml', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 1024
+# Ordem de preferência do servidor entre as codificações aceitas pelo cliente
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Compressão sob demanda quando o build não tem irmãos pré-comprimidos
+DYNAMIC_MAX_FILE_SIZE = 4 * 1024 * 1024
+DYNAMIC_CACHE_BYTES = 16 * 1024 * 1024
+
+
+class StaticFile:
+    """Metadados de um arquivo do build."""
+
+    __slots__ = ('path', 'relpath', 'size', 'mtime', 'mtime_ns', 'etag',
+                 'last_modified', 'content_type', 'cache_control',
+                 'compressible', 'variants')
+
+    def __init__(self, path, relpath, stat, cache_control):
+        self.path = path
+        self.relpath = relpath
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.mtime_ns = stat.st_mtime_ns
+        self.etag = '"%x-%x"' % (stat.st_size, stat.st_mtime_ns)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        content_type, _ = mimetypes.guess_type(path)
+        if content_type and (content_type.startswith('text/') or content_type in (
+                'application/javascript', 'application/json', 'image/svg+xml')):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type or 'application/octet-stream'
+        self.cache_control = cache_control
+        self.compressible = is_compressible(path, self.size)
+        # {codificação: StaticFile do irmão pré-comprimido}
+        self.variants = {}
+
+
+def is_compressible(path, size):
+    """Indica se vale a pena comprimir o arquivo."""
+    if size < MIN_COMPRESS_SIZE:
+        return False
+    content_type, encoding = mimetypes.guess_type(path)
+    return encoding is None and bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def parse_accept_encoding(header):
+    """Retorna o conjunto de codificações aceitas (q > 0) pelo cliente."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            accepted.add(coding)
+    if '*' in accepted:
+        accepted.update(encoding for encoding, _ in ENCODINGS)
+    return accepted
+
+
+class StaticIndex:
+    """Índice em memória dos arquivos servidos a partir de ``root``."""
+
+    def __init__(self, root, max_age=None, precompress_on_start=None, lazy=False):
+        self.root = root
+        self.max_age = SERVER_CONFIG['CACHE']['STATIC_MAX_AGE'] if max_age is None else max_age
+        self.files = {}
+        self._root_mtime = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+        self._dynamic = OrderedDict()  # {(relpath, etag): bytes gzip}
+        self._dynamic_bytes = 0
+        self._dynamic_lock = threading.Lock()
+        if precompress_on_start is None:
+            precompress_on_start = SERVER_CONFIG['CACHE']['PRECOMPRESS_ON_START']
+        self._precompress_pending = precompress_on_start
+        # Com lazy=True o diretório só é percorrido na primeira consulta
+        # (_refresh_if_stale vê a raiz "mudada"), fora da inicialização do app
+        if not lazy:
+            self.build()
+
+    def _precompress_in_background(self):
+        try:
+            stats = precompress(self.root)
+            if stats['written']:
+                self.build()
+        except Exception as e:
+            logging.error(f"Erro ao pré-comprimir arquivos estáticos: {str(e)}", exc_info=True)
+
+    def build(self):
+        """(Re)constrói o índice percorrendo o diretório do build."""
+        files = {}
+        try:
+            self._root_mtime = os.stat(self.root).st_mtime_ns
+        except OSError:
+            self._root_mtime = None
+            logging.warning(f"Diretório de arquivos estáticos não encontrado: {self.root}")
+        else:
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    relpath = os.path.relpath(path, self.root).replace(os.sep, '/')
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files[relpath] = StaticFile(path, relpath, stat, self._cache_control(relpath))
+            # Associa os irmãos pré-comprimidos que estão em dia com o original.
+            # Irmãos não são servidos pelo próprio nome (sairiam com o tipo do
+            # original e sem Content-Encoding): só via ``variants``
+            siblings = []
+            for encoding, suffix in ENCODINGS:
+                for relpath, entry in files.items():
+                    if not relpath.endswith(suffix):
+                        continue
+                    original = files.get(relpath[:-len(suffix)])
+                    if original is None:
+                        continue
+                    siblings.append(relpath)
+                    if original.compressible and entry.mtime_ns >= original.mtime_ns:
+                        original.variants[encoding] = entry
+            for relpath in siblings:
+                del files[relpath]
+        self.files = files
+        self._checked_at = time.monotonic()
+        logging.info(f"Índice de arquivos estáticos montado: {len(files)} arquivos em {self.root}")
+        if self._precompress_pending and files:
+            self._precompress_pending = False
+            threading.Thread(target=self._precompress_in_background,
+                             name='static-precompress', daemon=True).start()
+
+    def _cache_control(self, relpath):
+        if relpath == INDEX_FILE:
+            # O shell da SPA precisa ser revalidado para enxergar novos deploys
+            return 'no-cache'
+        if HASHED_ASSET_RE.search(relpath):
+            return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        return f'public, max-age={self.max_age}'
+
+    def _refresh_if_stale(self):
+        """Reconstrói o índice se o build foi refeito (no máximo a cada REFRESH_INTERVAL)."""
+        now = time.monotonic()
+        if now - self._checked_at < REFRESH_INTERVAL:
+            return
+        with self._lock:
+            if now - self._checked_at < REFRESH_INTERVAL:
+                return
+            self._checked_at = now
+            try:
+                root_mtime = os.stat(self.root).st_mtime_ns
+            except OSError:
+                root_mtime = None
+            if root_mtime != self._root_mtime:
+                self.build()
+
+    def lookup(self, path):
+        """Retorna os metadados de ``path`` ou None se não fizer parte do build."""
+        self._refresh_if_stale()
+        return self.files.get(path.lstrip('/'))
+
+    def resolve(self, path):
+        """Resolve ``path`` aplicando o fallback da SPA para index.html."""
+        return self.lookup(path) or self.files.get(INDEX_FILE)
+
+    def negotiate(self, entry, environ):
+        """Escolhe a codificação da resposta.
+
+        Retorna (codificação, corpo) onde corpo é o StaticFile a enviar ou,
+        na compressão sob demanda, os bytes já comprimidos.
+        """
+        if not entry.compressible:
+            return None, entry
+        accepted = parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if not accepted:
+            return None, entry
+        for encoding, _ in ENCODINGS:
+            if encoding in accepted and encoding in entry.variants:
+                return encoding, entry.variants[encoding]
+        if 'gzip' in accepted and entry.size <= DYNAMIC_MAX_FILE_SIZE:
+            data = self._dynamic_gzip(entry)
+            if data is not None:
+                return 'gzip', data
+        return None, entry
+
+    def _dynamic_gzip(self, entry):
+        """Comprime ``entry`` sob demanda, reaproveitando o cache LRU."""
+        key = (entry.relpath, entry.etag)
+        with self._dynamic_lock:
+            data = self._dynamic.get(key)
+            if data is not None:
+                self._dynamic.move_to_end(key)
+                return data
+        try:
+            with open(entry.path, 'rb') as f:
+                data = gzip.compress(f.read(), compresslevel=6, mtime=0)
+        except OSError:
+            return None
+        with self._dynamic_lock:
+            if key not in self._dynamic:
+                self._dynamic[key] = data
+                self._dynamic_bytes += len(data)
+                while self._dynamic_bytes > DYNAMIC_CACHE_BYTES and len(self._dynamic) > 1:
+                    _, evicted = self._dynamic.popitem(last=False)
+                    self._dynamic_bytes -= len(evicted)
+        return data
+
+    def is_not_modified(self, etag, entry, environ):
+        """Avalia os cabeçalhos condicionais da requisição."""
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            if if_none_match.strip() == '*':
+                return True
+            candidates = [tag.strip() for tag in if_none_match.split(',')]
+            return any(tag.replace('W/', '', 1) == etag for tag in candidates)
+
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            try:
+                return entry.mtime <= int(parsedate_to_datetime(if_modified_since).timestamp())
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def serve(self, environ, path):
+        """Monta a resposta para ``path``. Retorna (status, headers, body)."""
+        entry = self.resolve(path)
+        if entry is None:
+            return '404 Not Found', [('Content-Type', 'text/plain')], [b'Not Found']
+
+        encoding, body = self.negotiate(entry, environ)
+        # Cada representação tem sua própria ETag
+        etag = entry.etag if encoding is None else f'{entry.etag[:-1]}-{encoding}"'
+        headers = [
+            ('ETag', etag),
+            ('Last-Modified', entry.last_modified),
+            ('Cache-Control', entry.cache_control),
+        ]
+        if entry.compressible:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if self.is_not_modified(etag, entry, environ):
+            return '304 Not Modified', headers, []
+
+        headers.append(('Content-Type', entry.content_type))
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        if isinstance(body, bytes):
+            headers.append(('Content-Length', str(len(body))))
+            if environ.get('REQUEST_METHOD') == 'HEAD':
+                return '200 OK', headers, []
+            return '200 OK', headers, [body]
+
+        headers.append(('Content-Length', str(body.size)))
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return '200 OK', headers, []
+
+        try:
+            f = open(body.path, 'rb')
+        except OSError:
+            # O arquivo sumiu desde a montagem do índice: força a reconstrução
+            self._root_mtime = None
+            self._checked_at = 0.0
+            logging.warning(f"Arquivo estático indisponível: {body.path}")
+            return '404 Not Found', [('Content-Type', 'text/plain')], [b'Not Found']
+
+        logging.debug(f"Servindo arquivo: {body.path} ({entry.content_type}, {encoding or 'identity'})")
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return '200 OK', headers, file_wrapper(f, BLOCK_SIZE)
+        return '200 OK', headers, FileIterator(f)
+
+
+class FileIterator:
+    """Lê o arquivo em blocos quando o servidor não oferece wsgi.file_wrapper."""
+
+    def __init__(self, f, block_size=BLOCK_SIZE):
+        self.f = f
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        block = self.f.read(self.block_size)
+        if not block:
+            raise StopIteration
+        return block
+
+    def close(self):
+        self.f.close()
+
+
+def _write_sibling(path, data, mtime_ns):
+    """Grava o irmão comprimido de forma atômica com o mesmo mtime do original."""
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+    os.replace(tmp_path, path)
+
+
+def precompress(root, min_size=MIN_COMPRESS_SIZE):
+    """Gera irmãos ``.gz`` (e ``.br``, se houver brotli) dos assets de ``root``.
+
+    Irmãos em dia com o original são mantidos; irmãos que não ficariam menores
+    que o original são descartados. Retorna estatísticas de bytes economizados.
+    """
+    stats = {'files': 0, 'written': 0, 'original_bytes': 0, 'gzip_bytes': 0, 'br_bytes': 0}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename.endswith(('.gz', '.br')) or filename.rpartition('.')[2].startswith('tmp'):
+                continue
+            stat = os.stat(path)
+            if stat.st_size < min_size or not is_compressible(path, stat.st_size):
+                continue
+            stats['files'] += 1
+            stats['original_bytes'] += stat.st_size
+            data = None
+            for encoding, suffix in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                sibling = path + suffix
+                try:
+                    sibling_stat = os.stat(sibling)
+                except OSError:
+                    sibling_stat = None
+                if sibling_stat is not None and sibling_stat.st_mtime_ns >= stat.st_mtime_ns:
+                    stats[f'{encoding}_bytes'] += sibling_stat.st_size
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                if encoding == 'br':
+                    compressed = brotli.compress(data, quality=11)
+                else:
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) >= len(data):
+                    if sibling_stat is not None:
+                        os.remove(sibling)
+                    stats[f'{encoding}_bytes'] += len(data)
+                    continue
+                _write_sibling(sibling, compressed, stat.st_mtime_ns)
+                stats['written'] += 1
+                stats[f'{encoding}_bytes'] += len(compressed)
+    logging.info(f"Pré-compressão de {root}: {stats}")
+    return stats
+
+
+if __name__ == '__main__':
+    # Uso no deploy, logo após o build do React:
+    #   python server/static_files.py precompress build
+    if len(sys.argv) < 2 or sys.argv[1] != 'precompress':
+        print("Uso: python static_files.py precompress [diretório do build]")
+        sys.exit(1)
+    build_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(
+        os.environ.get('PROJECT_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'build')
+    result = precompress(build_dir)
+    original = result['original_bytes'] or 1
+    print(f"{result['files']} arquivos compressíveis, {result['written']} irmãos gerados")
+    print(f"original: {result['original_bytes']} bytes")
+    print(f"gzip:     {result['gzip_bytes']} bytes ({100 - 100 * result['gzip_bytes'] / original:.1f}% menor)")
+    if brotli is not None:
+        print(f"brotli:   {result['br_bytes']} bytes ({100 - 100 * result['br_bytes'] / original:.1f}% menor)")
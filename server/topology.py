@@ -0,0 +1,394 @@
+"""
+Planejamento da topologia WebRTC de cada sala.
+
+Em malha completa cada participante envia o próprio áudio para todos os
+outros, então a banda de subida necessária cresce com o tamanho da sala, o
+que não cabe num Android em 4G. O ``TopologyPlanner`` usa o uplink informado
+pelos clientes e os RTTs medidos entre pares (evento ``network_report``) para
+escolher entre:
+
+- ``mesh``: todos conectados a todos (menor latência);
+- ``relay``: participantes bem conectados viram relays, ligados entre si em
+  malha; os demais (folhas) se conectam a um único relay, que encaminha o
+  áudio da sala para eles e o deles para a sala.
+
+Custo em streams de subida, para n participantes:
+
+- mesh: n - 1 por participante;
+- folha: 1;
+- relay com L folhas entre R relays: L * (n - 1) + (R - 1) * (1 + L).
+
+O plano é recalculado de forma incremental em entradas e saídas (uma folha
+nova vai para o relay mais próximo com folga; as folhas de um relay que saiu
+são redistribuídas) e só é refeito do zero quando isso não cabe. RTTs novos
+não mudam um plano que continua viável, para não derrubar conexões à toa.
+Salas acima de ``MAX_MESH_MEMBERS`` nunca vão para mesh, e acima de
+``MAX_SCORED_MEMBERS`` os planos são comparados só pelo uso de uplink (a
+latência par a par custa O(n²) por opção).
+
+Cada mudança gera uma versão nova. Cada participante recebe em
+``connection_plan`` só a sua parte do plano (as próprias conexões e, com
+relays, o id do stream de cada participante) e só quando ela mudou.
+"""
+import math
+import threading
+from statistics import median
+
+import metrics
+from config import SERVER_CONFIG
+
+MESH = 'mesh'
+RELAY = 'relay'
+
+REPLANS = metrics.counter('mesa_topology_plans_total', 'Planos de topologia gerados', ('kind',))
+
+
+def relay_load(members, relays, leaves):
+    """Streams enviados por um relay com ``leaves`` folhas."""
+    return leaves * (members - 1) + (relays - 1) * (1 + leaves)
+
+
+class RoomState:
+    """Medições e plano atual de uma sala."""
+
+    def __init__(self, config):
+        self.config = config
+        self.members = []  # Ordem de entrada
+        self.uplink = {}  # {sid: kbps informado}
+        self.rtt = {}  # {(sid, sid) ordenado: ms (média móvel)}
+        self.stream_ids = {}  # {sid: id do MediaStream local}
+        self.plan = None
+        self.version = 0
+        self.sent = {}  # {sid: parte do plano enviada por último}
+        self.sent_version = 0
+
+    def capacity(self, sid):
+        """Streams de subida que o participante aguenta."""
+        uplink = self.uplink.get(sid, self.config['DEFAULT_UPLINK_KBPS'])
+        return int(uplink * self.config['UPLINK_HEADROOM'] // self.config['STREAM_KBPS'])
+
+    def rtt_between(self, a, b):
+        return self.rtt.get(_pair(a, b), self.config['DEFAULT_RTT_MS'])
+
+    def record_rtt(self, a, b, rtt_ms):
+        key = _pair(a, b)
+        previous = self.rtt.get(key)
+        alpha = self.config['RTT_SMOOTHING']
+        self.rtt[key] = rtt_ms if previous is None else previous + alpha * (rtt_ms - previous)
+
+    def mesh_feasible(self, margin=1.0):
+        if len(self.members) > self.config['MAX_MESH_MEMBERS']:
+            return False
+        need = (len(self.members) - 1) * margin
+        return all(self.capacity(sid) >= need for sid in self.members)
+
+
+class Plan:
+    """Topologia de uma sala: modo, relays, relay de cada folha e conexões."""
+
+    __slots__ = ('mode', 'relays', 'parent', 'links')
+
+    def __init__(self, mode, relays, parent, links):
+        self.mode = mode
+        self.relays = relays
+        self.parent = parent  # {folha: relay}
+        self.links = links  # {(sid, sid) ordenado: sid que inicia a conexão}
+
+    def same_shape(self, other):
+        return (other is not None and self.mode == other.mode and
+                self.relays == other.relays and self.links == other.links)
+
+    def role(self, sid):
+        if self.mode == MESH:
+            return MESH
+        return RELAY if sid in self.relays else 'leaf'
+
+    def to_dict(self, room_id, version, state):
+        return {
+            'roomId': room_id,
+            'version': version,
+            'mode': self.mode,
+            'relays': list(self.relays),
+            'links': [[initiator, a if initiator == b else b] for (a, b), initiator in self.links.items()],
+            'peers': {sid: {'role': self.role(sid),
+                            'relay': self.parent.get(sid),
+                            'streamId': state.stream_ids.get(sid)}
+                      for sid in state.members},
+        }
+
+    def views(self, state):
+        """{sid: parte do plano que interessa a sid}, sem sala nem versão.
+
+        Em mesh o áudio chega direto de quem o enviou, então basta a lista de
+        conexões; com relays todos precisam do id do stream de cada
+        participante para identificar o áudio encaminhado.
+        """
+        links = {sid: [] for sid in state.members}
+        for (a, b), initiator in self.links.items():
+            link = [initiator, a if initiator == b else b]
+            links[a].append(link)
+            links[b].append(link)
+        peers = {}
+        if self.mode == RELAY:
+            peers = {sid: {'streamId': stream_id} for sid, stream_id in state.stream_ids.items()}
+        return {sid: {'mode': self.mode,
+                      'role': self.role(sid),
+                      'relay': self.parent.get(sid),
+                      'relays': list(self.relays),
+                      'links': links[sid],
+                      'peers': peers}
+                for sid in state.members}
+
+
+def _pair(a, b):
+    return (a, b) if a < b else (b, a)
+
+
+def _links(state, pairs, previous):
+    """Conexões do plano; uma conexão já existente mantém quem a iniciou.
+
+    Conexões novas são iniciadas pelo participante que entrou por último,
+    como no fluxo de entrada na sala.
+    """
+    order = {sid: i for i, sid in enumerate(state.members)}
+    old = previous.links if previous is not None else {}
+    links = {}
+    for a, b in pairs:
+        key = _pair(a, b)
+        links[key] = old.get(key) or max(key, key=order.__getitem__)
+    return links
+
+
+def mesh_plan(state, previous=None):
+    members = state.members
+    pairs = [(a, b) for i, a in enumerate(members) for b in members[i + 1:]]
+    return Plan(MESH, [], {}, _links(state, pairs, previous))
+
+
+def relay_plan(state, relays, previous=None):
+    """Plano com os ``relays`` dados; folhas vão para o relay mais próximo com folga.
+
+    Folhas que já tinham um relay desta lista continuam com ele. Se nenhum
+    relay tiver folga, a folha vai para o menos carregado (plano inviável,
+    usado só quando nenhum outro cabe).
+    """
+    relays = list(relays)
+    n = len(state.members)
+    counts = {relay: 0 for relay in relays}
+    parent = {}
+    kept = previous.parent if previous is not None else {}
+    leaves = [sid for sid in state.members if sid not in counts]
+    for leaf in leaves:
+        relay = kept.get(leaf)
+        if relay in counts:
+            parent[leaf] = relay
+            counts[relay] += 1
+    for leaf in leaves:
+        if leaf in parent:
+            continue
+        fits = [relay for relay in relays
+                if relay_load(n, len(relays), counts[relay] + 1) <= state.capacity(relay)]
+        if fits:
+            relay = min(fits, key=lambda r: state.rtt_between(leaf, r))
+        else:
+            relay = min(relays, key=lambda r: relay_load(n, len(relays), counts[r]) / max(state.capacity(r), 1))
+        parent[leaf] = relay
+        counts[relay] += 1
+    pairs = [(a, b) for i, a in enumerate(relays) for b in relays[i + 1:]]
+    pairs.extend(parent.items())
+    return Plan(RELAY, relays, parent, _links(state, pairs, previous))
+
+
+def uplink_streams(state, plan):
+    """{sid: streams enviados} pelo plano."""
+    n = len(state.members)
+    if plan.mode == MESH:
+        return {sid: n - 1 for sid in state.members}
+    counts = {relay: 0 for relay in plan.relays}
+    for relay in plan.parent.values():
+        counts[relay] += 1
+    return {sid: relay_load(n, len(plan.relays), counts[sid]) if sid in counts else 1
+            for sid in state.members}
+
+
+def path_latency(state, plan, a, b):
+    """Latência estimada (ms, só ida) do áudio de ``a`` até ``b``."""
+    if plan.mode == MESH:
+        return state.rtt_between(a, b) / 2
+    path = [a]
+    for hop in (plan.parent.get(a, a), plan.parent.get(b, b), b):
+        if hop != path[-1]:
+            path.append(hop)
+    one_way = sum(state.rtt_between(x, y) for x, y in zip(path, path[1:])) / 2
+    return one_way + (len(path) - 2) * state.config['FORWARD_MS']
+
+
+def max_utilization(state, plan):
+    """Maior fração da capacidade de subida usada pelo plano (viável se <= 1)."""
+    streams = uplink_streams(state, plan)
+    return max((streams[sid] / max(state.capacity(sid), 1) for sid in state.members), default=0.0)
+
+
+def score_plan(state, plan):
+    """Métricas de um plano: viabilidade, uso de uplink, latência e conexões."""
+    utilization = max_utilization(state, plan)
+    latencies = sorted(path_latency(state, plan, a, b)
+                       for a in state.members for b in state.members if a != b)
+    return {
+        'feasible': utilization <= 1.0,
+        'max_utilization': utilization,
+        'mean_latency_ms': sum(latencies) / len(latencies) if latencies else 0.0,
+        'max_latency_ms': latencies[-1] if latencies else 0.0,
+        'links': len(plan.links),
+    }
+
+
+def full_plan(state, previous=None):
+    """Melhor plano do zero: mesh se couber, senão o conjunto de relays de menor latência."""
+    if len(state.members) <= 2 or state.mesh_feasible():
+        return mesh_plan(state, previous)
+    members = state.members
+    median_rtt = {sid: median([state.rtt_between(sid, other) for other in members if other != sid])
+                  for sid in members}
+    candidates = sorted(members, key=lambda sid: (-state.capacity(sid), median_rtt[sid]))
+    options = [mesh_plan(state, previous)] if len(members) <= state.config['MAX_MESH_MEMBERS'] else []
+    for count in range(1, min(len(members) - 1, state.config['MAX_RELAYS']) + 1):
+        options.append(relay_plan(state, candidates[:count], previous))
+    if len(members) > state.config['MAX_SCORED_MEMBERS']:
+        # Sala grande: o plano viável com menos relays; se nenhum couber, o que menos estoura o uplink
+        return min(options, key=lambda plan: (max(max_utilization(state, plan), 1.0), len(plan.relays)))
+    scored = [(score_plan(state, plan), plan) for plan in options]
+    feasible = [(score['mean_latency_ms'], i) for i, (score, _) in enumerate(scored) if score['feasible']]
+    if feasible:
+        return scored[min(feasible)[1]][1]
+    # Nada cabe: o plano que menos estoura o uplink mais apertado
+    return min(scored, key=lambda item: item[0]['max_utilization'])[1]
+
+
+def incremental_plan(state, previous, joined=None, left=None):
+    """Ajusta ``previous`` a uma entrada/saída; None se for preciso replanejar do zero."""
+    if previous is None:
+        return None
+    if previous.mode == MESH:
+        if left is not None or state.mesh_feasible():
+            return mesh_plan(state, previous)
+        return None
+    relays = [relay for relay in previous.relays if relay != left]
+    if not relays:
+        return None
+    if left is not None and state.mesh_feasible(state.config['MESH_RETURN_MARGIN']):
+        return mesh_plan(state, previous)
+    plan = relay_plan(state, relays, previous)
+    return plan if max_utilization(state, plan) <= 1.0 else None
+
+
+class TopologyPlanner:
+    """Planos de topologia por sala, atualizados em entradas, saídas e medições."""
+
+    def __init__(self, config=None):
+        self.config = dict(SERVER_CONFIG['TOPOLOGY'], **(config or {}))
+        self._rooms = {}  # {room_id: RoomState}
+        self._lock = threading.Lock()
+
+    def join(self, room_id, sid):
+        """Registra a entrada; retorna {sid: plano} com a parte de quem entrou e as que mudaram."""
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is None:
+                state = self._rooms[room_id] = RoomState(self.config)
+            if sid not in state.members:
+                state.members.append(sid)
+            self._update(room_id, state, incremental_plan(state, state.plan, joined=sid))
+            return self._views(room_id, state, always=sid)
+
+    def leave(self, room_id, sid):
+        """Registra a saída; retorna {sid: plano} com as partes que mudaram (vazio se nenhuma)."""
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is None or sid not in state.members:
+                return None
+            state.members.remove(sid)
+            state.uplink.pop(sid, None)
+            state.stream_ids.pop(sid, None)
+            state.sent.pop(sid, None)
+            for key in [key for key in state.rtt if sid in key]:
+                del state.rtt[key]
+            if not state.members:
+                del self._rooms[room_id]
+                return {}
+            self._update(room_id, state, incremental_plan(state, state.plan, left=sid))
+            return self._views(room_id, state)
+
+    def report(self, room_id, sid, uplink_kbps=None, rtts=None, stream_id=None):
+        """Atualiza as medições de ``sid``; retorna {sid: plano} com as partes que mudaram."""
+        # Validar tudo antes de tocar no estado: um NaN ou infinito guardado
+        # aqui quebraria o cálculo de capacidade em todo join seguinte
+        uplink = None
+        if uplink_kbps:
+            uplink = float(uplink_kbps)
+            if not math.isfinite(uplink) or uplink <= 0:
+                raise ValueError(f"Uplink inválido: {uplink_kbps}")
+        samples = {}
+        for peer, rtt_ms in (rtts or {}).items():
+            if rtt_ms is None:
+                continue
+            rtt = float(rtt_ms)
+            if not math.isfinite(rtt) or rtt < 0:
+                raise ValueError(f"RTT inválido: {rtt_ms}")
+            samples[peer] = rtt
+
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is None or sid not in state.members:
+                return {}
+            if uplink is not None:
+                state.uplink[sid] = uplink
+            for peer, rtt in samples.items():
+                if peer in state.members and peer != sid:
+                    state.record_rtt(sid, peer, rtt)
+            if stream_id is not None:
+                state.stream_ids[sid] = stream_id
+
+            plan = state.plan
+            if max_utilization(state, plan) > 1.0:
+                self._update(room_id, state, None)
+            elif plan.mode == RELAY and state.mesh_feasible(self.config['MESH_RETURN_MARGIN']):
+                self._update(room_id, state, mesh_plan(state, plan))
+            # Um streamId novo muda a parte de todos com relays (identificam o áudio encaminhado)
+            return self._views(room_id, state)
+
+    def plan(self, room_id):
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is None or state.plan is None:
+                return None
+            return state.plan.to_dict(room_id, state.version, state)
+
+    def _update(self, room_id, state, plan):
+        """Instala ``plan`` (ou um plano do zero se None); retorna se algo mudou."""
+        kind = 'incremental'
+        if plan is None:
+            plan = full_plan(state, state.plan)
+            kind = 'full'
+        if plan.same_shape(state.plan):
+            return False
+        state.plan = plan
+        state.version += 1
+        REPLANS.labels(kind).inc()
+        return True
+
+    def _views(self, room_id, state, always=None):
+        """Partes do plano que mudaram desde o último envio (mais a de ``always``)."""
+        views = state.plan.views(state)
+        changed = [sid for sid, view in views.items() if state.sent.get(sid) != view]
+        if changed and state.version == state.sent_version:
+            # O formato do plano não mudou, mas o que alguém recebe sim
+            state.version += 1
+        state.sent_version = state.version
+        if always is not None and always not in changed:
+            changed.append(always)
+        result = {}
+        for sid in changed:
+            state.sent[sid] = views[sid]
+            result[sid] = dict(views[sid], roomId=room_id, version=state.version)
+        return result
@@ -0,0 +1,173 @@
+"""
+Relatório dos spans gravados pelo tracing.py.
+
+Lê os arquivos JSON Lines (padrão: ``data/traces/`` na raiz do projeto,
+incluindo os ``.1`` rotacionados), junta os spans por trace e reconstrói a
+árvore de cada um. O caminho crítico de um span é a cadeia de filhos que
+determinou o seu fim: partindo do fim do span, o filho que termina por
+último antes desse ponto entra no caminho e o ponto recua até o início
+dele; o tempo que nenhum filho cobre é tempo próprio do span. Filhos que
+terminam depois do ponto (a tentativa que perdeu o hedge, um emit que
+seguiu em outra thread) não atrasaram o pai e ficam fora do caminho.
+
+Mostra:
+
+- onde foi o tempo: para cada nome de span, o tempo próprio somado nos
+  caminhos críticos de todos os traces (e a fração do total);
+- duração (p50, p99, máximo) de cada tipo de raiz;
+- os traces mais lentos, em árvore, com o caminho crítico marcado por ``*``.
+
+Uso:
+    python trace_report.py [arquivos ou diretórios ...] [--root 'proxy GET'] [--slowest 5] [--top 15]
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+
+from tracing import default_trace_dir
+
+# Folga (s) para filhos que parecem terminar depois do pai por diferença de relógio entre processos
+CLOCK_SLACK = 0.001
+
+
+class SpanNode:
+    __slots__ = ('record', 'start', 'end', 'children')
+
+    def __init__(self, record):
+        self.record = record
+        self.start = record['start']
+        self.end = record['start'] + record['ms'] / 1000
+        self.children = []
+
+    @property
+    def name(self):
+        return self.record['name']
+
+    @property
+    def ms(self):
+        return self.record['ms']
+
+
+def trace_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.jsonl')) + glob.glob(os.path.join(path, '*.jsonl.1'))))
+        else:
+            files.append(path)
+    return files
+
+
+def load_traces(files):
+    """{trace_id: [SpanNode raiz]}; linhas inválidas são ignoradas."""
+    spans = {}  # {trace_id: {span_id: SpanNode}}
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    spans.setdefault(record['trace'], {})[record['span']] = SpanNode(record)
+                except (ValueError, KeyError, TypeError):
+                    continue
+    traces = {}
+    for trace_id, by_id in spans.items():
+        roots = []
+        for node in by_id.values():
+            parent = by_id.get(node.record.get('parent'))
+            # Pai de outro processo que não está nos arquivos (cliente, Node.js): vira raiz
+            (parent.children if parent is not None else roots).append(node)
+        for node in by_id.values():
+            node.children.sort(key=lambda child: child.start)
+        traces[trace_id] = sorted(roots, key=lambda node: node.start)
+    return traces
+
+
+def critical_path(node, end=None):
+    """[(span, ms próprios no caminho crítico)] de ``node`` até ``end`` (padrão: o fim dele)."""
+    end = node.end if end is None else min(node.end, end)
+    cursor = end
+    steps = []
+    covered = 0.0
+    for child in sorted(node.children, key=lambda c: c.end, reverse=True):
+        # Terminou depois do ponto (ex.: a tentativa que perdeu o hedge): não atrasou o pai
+        if child.start >= cursor or child.end > cursor + CLOCK_SLACK:
+            continue
+        # Relógios de processos diferentes: o filho não começa antes do pai
+        start = max(child.start, node.start)
+        steps.extend(critical_path(child, cursor))
+        covered += min(child.end, cursor) - start
+        cursor = start
+    steps.insert(0, (node, max(0.0, (end - node.start - covered) * 1000)))
+    return steps
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def print_tree(node, origin, on_path, depth=0):
+    attrs = node.record.get('attrs') or {}
+    details = ' '.join(f'{key}={value}' for key, value in attrs.items())
+    if node.record.get('error'):
+        details += f" erro={node.record['error']!r}"
+    mark = '*' if id(node) in on_path else ' '
+    print(f"  {mark} {(node.start - origin) * 1000:8.1f} {node.ms:9.1f}  {'  ' * depth}{node.name}"
+          f" [{node.record.get('service', '?')}] {details}")
+    for child in node.children:
+        print_tree(child, origin, on_path, depth + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='Arquivos .jsonl ou diretórios (padrão: data/traces)')
+    parser.add_argument('--root', help='Só traces cuja raiz começa com este nome (ex.: "socketio join_room")')
+    parser.add_argument('--slowest', type=int, default=5, help='Traces mais lentos mostrados em árvore')
+    parser.add_argument('--top', type=int, default=15, help='Linhas do resumo por nome de span')
+    args = parser.parse_args()
+
+    files = trace_files(args.paths or [default_trace_dir()])
+    traces = load_traces(files)
+    roots = [root for trace_roots in traces.values() for root in trace_roots
+             if not args.root or root.name.startswith(args.root)]
+    if not roots:
+        print(f"Nenhum span encontrado em {', '.join(files) or args.paths or default_trace_dir()}")
+        return 1
+
+    by_name = {}  # {nome: [ms próprios no caminho crítico, ocorrências]}
+    total = 0.0
+    for root in roots:
+        for node, self_ms in critical_path(root):
+            entry = by_name.setdefault(node.name, [0.0, 0])
+            entry[0] += self_ms
+            entry[1] += 1
+            total += self_ms
+    print(f"{len(roots)} raízes em {len(traces)} traces ({len(files)} arquivo(s))")
+    print()
+    print("Onde foi o tempo (tempo próprio no caminho crítico):")
+    print(f"  {'span':<40}{'total ms':>12}{'%':>7}{'vezes':>8}{'média ms':>10}")
+    for name, (self_ms, count) in sorted(by_name.items(), key=lambda item: item[1][0], reverse=True)[:args.top]:
+        print(f"  {name[:39]:<40}{self_ms:>12.1f}{100 * self_ms / (total or 1):>6.1f}%{count:>8}{self_ms / count:>10.2f}")
+
+    print()
+    print("Duração das raízes:")
+    print(f"  {'raiz':<40}{'n':>7}{'p50 ms':>10}{'p99 ms':>10}{'máx ms':>10}")
+    durations = {}
+    for root in roots:
+        durations.setdefault(root.name, []).append(root.ms)
+    for name, values in sorted(durations.items(), key=lambda item: percentile(item[1], 0.99), reverse=True)[:args.top]:
+        print(f"  {name[:39]:<40}{len(values):>7}{percentile(values, 0.5):>10.1f}"
+              f"{percentile(values, 0.99):>10.1f}{max(values):>10.1f}")
+
+    for root in sorted(roots, key=lambda node: node.ms, reverse=True)[:args.slowest]:
+        print()
+        print(f"Trace {root.record['trace']} ({root.ms:.1f} ms)   início(ms) duração(ms)")
+        on_path = {id(node) for node, _ in critical_path(root)}
+        print_tree(root, root.start, on_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Tracing leve das requisições do proxy e dos eventos Socket.IO.
+
+Cada requisição no ``pythonanywhere_wsgi.application``, cada requisição
+HTTP do Flask e cada evento ``@socketio.on`` abre um span raiz. O
+identificador segue o formato W3C ``traceparent``
+(``00-<trace 32 hex>-<span 16 hex>-<flags>``): se a requisição já traz um
+(outro proxy, o cliente ou, nos eventos Socket.IO, o campo ``traceparent``
+do payload), o trace continua; senão, um novo é criado. O proxy repassa o
+header ao Node.js em cada tentativa.
+
+Dentro do trace, ``tracer.span(nome)`` abre spans filhos (tentativas no
+upstream, emits com o fan-out, chamadas ao yt_dlp) ligados ao span corrente
+da thread (``contextvars``). Para outra thread (ex.: o pool do hedge), o pai
+é passado explicitamente.
+
+A amostragem é decidida na raiz (``SAMPLE_RATE``) e herdada pelos filhos e
+pelo header repassado (flag ``01``). Spans não amostrados não gravam nada e
+os filhos deles são um objeto nulo. Os amostrados viram uma linha JSON num
+arquivo por processo em ``data/traces/`` (``<serviço>-<pid>.jsonl``),
+gravada por uma thread própria; com a fila cheia o span é descartado.
+Analise com ``python trace_report.py``.
+"""
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+
+from config import SERVER_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('mesa_span', default=None)
+
+
+def default_trace_dir():
+    """``data/traces`` na raiz do projeto."""
+    project_dir = os.environ.get('PROJECT_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(project_dir, 'data', 'traces')
+
+
+def parse_traceparent(value):
+    """(trace_id, span_id, amostrado) de um header ``traceparent``, ou None se inválido."""
+    if not value or not isinstance(value, str):
+        return None
+    parts = value.strip().lower().split('-')
+    if len(parts) != 4 or parts[0] == 'ff' or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class Span:
+    """Um trecho cronometrado de um trace; use com ``with``."""
+
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'sampled', 'attrs',
+                 'start', '_clock', '_token', 'error')
+
+    def __init__(self, tracer, name, trace_id, parent_id, sampled, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attrs = attrs if sampled else None
+        self.start = time.time()
+        self._clock = time.perf_counter()
+        self._token = None
+        self.error = None
+
+    def set(self, key, value):
+        if self.sampled:
+            self.attrs[key] = value
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def finish(self):
+        if self.sampled:
+            self.tracer.export(self, (time.perf_counter() - self._clock) * 1000)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.sampled:
+            self.error = f'{exc_type.__name__}: {exc}'
+        _current.reset(self._token)
+        self.finish()
+        return False
+
+
+class _NoopSpan:
+    """Filho de um span não amostrado (ou sem pai): não mede nem grava nada."""
+
+    sampled = False
+
+    def set(self, key, value):
+        pass
+
+    def traceparent(self):
+        return None
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    """Span corrente desta thread (ou o span nulo)."""
+    span = _current.get()
+    return NOOP_SPAN if span is None else span
+
+
+class FileExporter:
+    """Grava spans como JSON Lines numa thread própria; com a fila cheia, descarta.
+
+    O arquivo é aberto na primeira gravação, no processo que grava (os
+    workers do WSGI podem ser criados por fork depois do import).
+    """
+
+    def __init__(self, directory, max_bytes, queue_size):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.path = None
+        self.failed = False  # Diretório ou arquivo inacessível: tracing desligado no processo
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, service, record):
+        if self.failed:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            # Primeira gravação, ou um processo filho de fork (a thread ficou no pai)
+            self._start(service)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self, service):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.path = os.path.join(self.directory, f'{service}-{os.getpid()}.jsonl')
+            self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            f = open(self.path, 'a', encoding='utf-8')
+        except OSError as e:
+            logger.error(f"Tracing desativado: não foi possível abrir {self.path}: {str(e)}")
+            self.failed = True
+            return
+        try:
+            while True:
+                record = self.queue.get()
+                try:
+                    f.write(json.dumps(record, separators=(',', ':'), default=str) + '\n')
+                    if self.queue.empty():
+                        f.flush()
+                        if f.tell() > self.max_bytes:
+                            # O arquivo anterior fica como .1 (sobrescrevendo o antigo)
+                            f.close()
+                            os.replace(self.path, self.path + '.1')
+                            f = open(self.path, 'a', encoding='utf-8')
+                except Exception as e:
+                    logger.error(f"Erro ao gravar span em {self.path}: {str(e)}")
+                finally:
+                    self.queue.task_done()
+        finally:
+            f.close()
+
+    def flush(self):
+        """Espera a fila esvaziar (testes e benchmarks)."""
+        if self._thread is not None and not self.failed:
+            self.queue.join()
+
+
+class Tracer:
+    """Cria spans, decide a amostragem e os entrega ao exportador."""
+
+    def __init__(self, config=None):
+        config = config or SERVER_CONFIG['TRACING']
+        self.sample_rate = config['SAMPLE_RATE']
+        self.service = 'app'
+        self.exporter = FileExporter(config['DIR'] or default_trace_dir(), config['MAX_BYTES'],
+                                     config['QUEUE_SIZE'])
+
+    def configure(self, service=None, sample_rate=None):
+        """Nome do processo nos spans (``proxy``, ``app``) e, opcionalmente, a taxa de amostragem."""
+        if service is not None:
+            self.service = service
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+
+    def root(self, name, traceparent=None, **attrs):
+        """Span raiz: continua o trace de ``traceparent`` ou começa um, sorteando a amostragem."""
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        return Span(self, name, trace_id, parent_id, sampled, attrs)
+
+    def span(self, name, parent=None, **attrs):
+        """Filho de ``parent`` (padrão: o span corrente); nulo fora de um trace amostrado."""
+        if parent is None:
+            parent = _current.get()
+        if parent is None or not parent.sampled:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, True, attrs)
+
+    def export(self, span, duration_ms):
+        record = {
+            'trace': span.trace_id,
+            'span': span.span_id,
+            'parent': span.parent_id,
+            'name': span.name,
+            'service': self.service,
+            'start': round(span.start, 6),
+            'ms': round(duration_ms, 3),
+            'thread': threading.current_thread().name,
+        }
+        if span.attrs:
+            record['attrs'] = span.attrs
+        if span.error:
+            record['error'] = span.error
+        self.exporter.export(self.service, record)
+
+
+def trace_event(event, handler):
+    """Envolve um handler Socket.IO num span raiz (``traceparent`` opcional no payload)."""
+    name = f'socketio {event}'
+
+    def traced(*args):
+        data = args[0] if args else None
+        traceparent = data.get('traceparent') if isinstance(data, dict) else None
+        with tracer.root(name, traceparent):
+            return handler(*args)
+
+    return traced
+
+
+# Instância global
+tracer = Tracer()
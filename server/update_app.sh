@@ -18,6 +18,10 @@ npm install
 echo "Construindo o app React..."
 npm run build
 
+# Gerar versões pré-comprimidas (.gz/.br) dos assets do build
+echo "Pré-comprimindo arquivos estáticos..."
+python3 server/static_files.py precompress build
+
 # Ir para o diretório do servidor
 cd server
 
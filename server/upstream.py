@@ -0,0 +1,641 @@
+"""
+Conexões do proxy WSGI com o servidor Node.js.
+
+Em vez de abrir um socket de teste e uma conexão HTTP nova a cada requisição,
+o proxy usa uma única ``requests.Session`` com pool de conexões keep-alive e
+consulta um estado de saúde mantido por uma thread de monitoramento. Um
+circuit breaker por backend faz o caminho da requisição falhar rápido
+enquanto o Node.js está fora do ar, sem nenhuma sondagem síncrona.
+
+Os corpos de requisição e resposta atravessam o proxy em blocos de tamanho
+fixo (``BoundedInput`` e ``stream_body``): a memória por requisição em voo
+fica constante qualquer que seja o tamanho do upload ou do download, e o
+ritmo de leitura de um lado é ditado pelo ritmo de escrita do outro.
+
+Com vários processos Node.js, o ``BackendPool`` distribui o tráfego: uma
+sessão Socket.IO fica presa ao processo que a criou (pelo prefixo do sid,
+pelo mapa sid -> backend ou pelo cookie ``mesa_backend``), salas são
+mapeadas por hash consistente para que todos os membros caiam no mesmo
+processo, e o restante vai para o backend saudável com menos requisições
+em andamento.
+
+Cada prefixo de rota tem o seu timeout (``SERVER_CONFIG['PROXY']``). GETs e
+HEADs fora do Socket.IO podem ganhar uma nova tentativa depois de erro de
+transporte e um pedido "hedge" (uma segunda cópia em outro backend, se a
+primeira não respondeu em ``hedge_ms``). As tentativas extras saem de um
+orçamento proporcional ao tráfego: com o Node.js lento para todos, repetir
+tudo só dobraria a carga. O polling do Engine.IO nunca é repetido (um GET
+consome as mensagens da sessão).
+"""
+import re
+import time
+import socket
+import bisect
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse, parse_qsl
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from config import SERVER_CONFIG
+
+# Intervalo e timeout da sondagem de saúde feita em segundo plano
+HEALTH_INTERVAL = 2.0
+HEALTH_TIMEOUT = 1.0
+# Falhas consecutivas de requisições que abrem o circuito
+FAILURE_THRESHOLD = 3
+# Tempo com o circuito aberto antes de liberar uma requisição de teste
+OPEN_COOLDOWN = 5.0
+# Conexões keep-alive mantidas por backend
+POOL_SIZE = 16
+# Tamanho dos blocos copiados entre cliente e backend
+CHUNK_SIZE = 64 * 1024
+# Pontos por backend no anel de hash consistente
+VIRTUAL_NODES = 64
+# Limite do mapa sid -> backend mantido em memória
+MAX_STICKY_SIDS = 10000
+STICKY_COOKIE = 'mesa_backend'
+HANDSHAKE_SID_RE = re.compile(rb'"sid"\s*:\s*"([^"]+)"')
+
+# Métodos que podem ser repetidos sem efeito colateral
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD'])
+# Falhas de transporte que justificam outra tentativa (nada foi repassado ao cliente ainda)
+RETRYABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+EXTRA_ATTEMPTS = metrics.counter('mesa_proxy_extra_attempts_total',
+                                 'Tentativas extras do proxy (retry, hedge, hedge vencedor, sem orçamento)',
+                                 ('kind',))
+
+# Headers que valem só para uma conexão e não podem ser repassados (RFC 7230)
+HOP_BY_HOP_HEADERS = frozenset([
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade',
+])
+
+
+class CircuitBreaker:
+    """Circuit breaker clássico: fechado -> aberto -> meio-aberto."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, cooldown=OPEN_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Indica se uma requisição pode seguir para o backend."""
+        if self.state == self.CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and (
+                    not self._trial_in_flight or now - self._trial_started >= self.cooldown):
+                # Apenas uma requisição de teste por vez no estado meio-aberto
+                # (uma nova é liberada se a anterior não reportou resultado)
+                self._trial_in_flight = True
+                self._trial_started = now
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info("Circuito do backend fechado novamente")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._trip()
+
+    def force_open(self):
+        """Abre o circuito imediatamente (backend sabidamente fora do ar)."""
+        with self._lock:
+            self._trip()
+
+    def _trip(self):
+        if self.state != self.OPEN:
+            logging.warning(f"Circuito do backend aberto ({self.failures} falha(s) consecutivas)")
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+class Backend:
+    """Um servidor Node.js de destino e o seu estado de saúde."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        parsed = urlparse(self.url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        # Mesmo valor do BACKEND_ID do processo Node.js; a porta sozinha colide entre hosts
+        self.id = f'{self.host}:{self.port}'
+        self.breaker = CircuitBreaker()
+        self.healthy = True
+        self.checked_at = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self._count_lock = threading.Lock()
+
+    def probe(self):
+        """Sondagem TCP do backend; atualiza o estado de saúde."""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=HEALTH_TIMEOUT)
+            sock.close()
+            healthy = True
+        except OSError:
+            healthy = False
+
+        if healthy != self.healthy:
+            logging.log(logging.INFO if healthy else logging.ERROR,
+                        f"Backend {self.url} {'voltou a responder' if healthy else 'não está respondendo'}")
+        self.healthy = healthy
+        self.checked_at = time.monotonic()
+        if healthy:
+            if self.breaker.state == CircuitBreaker.OPEN:
+                # Backend voltou: libera o teste sem esperar o cooldown inteiro
+                self.breaker.opened_at = 0.0
+        else:
+            self.breaker.force_open()
+        return healthy
+
+    def is_available(self):
+        """Consulta o estado em cache; não faz I/O no caminho da requisição.
+
+        Se o monitor não estiver rodando (ex.: servidor WSGI sem suporte a
+        threads), a sondagem é refeita no máximo uma vez por HEALTH_INTERVAL.
+        """
+        if time.monotonic() - self.checked_at > 3 * HEALTH_INTERVAL:
+            self.probe()
+        return self.healthy and self.breaker.allow()
+
+    def record_success(self):
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.breaker.record_failure()
+
+    def acquire(self):
+        """Contabiliza uma requisição em andamento neste backend."""
+        with self._count_lock:
+            self.in_flight += 1
+            self.requests += 1
+
+    def release(self):
+        with self._count_lock:
+            self.in_flight -= 1
+
+
+def _ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class BackendPool:
+    """Conjunto de backends Node.js com afinidade por sessão e por sala."""
+
+    def __init__(self, urls, virtual_nodes=VIRTUAL_NODES):
+        self.backends = [Backend(url) for url in urls]
+        self.by_id = {backend.id: backend for backend in self.backends}
+        # BACKEND_ID antigo (só a porta) continua valendo enquanto não for ambíguo
+        ports = [backend.port for backend in self.backends]
+        for backend in self.backends:
+            if ports.count(backend.port) == 1:
+                self.by_id.setdefault(str(backend.port), backend)
+        ring = sorted((_ring_hash(f'{backend.url}#{i}'), index)
+                      for index, backend in enumerate(self.backends)
+                      for i in range(virtual_nodes))
+        self._ring_keys = [point for point, _ in ring]
+        self._ring_backends = [self.backends[index] for _, index in ring]
+        self._sids = OrderedDict()  # {sid: Backend}
+        self._sids_lock = threading.Lock()
+
+    def for_room(self, room_id, exclude=()):
+        """Backend dono da sala no anel; pula backends indisponíveis (e os de ``exclude``, se houver outro)."""
+        if not self._ring_keys:
+            return None
+        start = bisect.bisect(self._ring_keys, _ring_hash(room_id))
+        ordered = []
+        for offset in range(len(self._ring_keys)):
+            backend = self._ring_backends[(start + offset) % len(self._ring_keys)]
+            if backend not in ordered:
+                ordered.append(backend)
+                if len(ordered) == len(self.backends):
+                    break
+        return _first_available(ordered, exclude)
+
+    def least_loaded(self, exclude=()):
+        """Backend disponível com menos requisições em andamento."""
+        return _first_available(sorted(self.backends, key=lambda b: b.in_flight), exclude)
+
+    def for_sid(self, sid, pinned=None):
+        """Backend que guarda a sessão Socket.IO ``sid``, se conhecido."""
+        # O id pode ter pontos (IP); a parte aleatória do sid não tem
+        prefix, sep, _ = sid.rpartition('.')
+        if sep and prefix in self.by_id:
+            return self.by_id[prefix]
+        with self._sids_lock:
+            backend = self._sids.get(sid)
+        if backend is None and pinned:
+            backend = self.by_id.get(pinned)
+        return backend
+
+    def bind_sid(self, sid, backend):
+        with self._sids_lock:
+            self._sids[sid] = backend
+            self._sids.move_to_end(sid)
+            while len(self._sids) > MAX_STICKY_SIDS:
+                self._sids.popitem(last=False)
+
+    def select(self, sid=None, room_id=None, pinned=None, exclude=()):
+        """Escolhe o backend: sessão existente > sala > menor carga.
+
+        Se o backend da sessão estiver fora do ar, a requisição vai para
+        outro; o Socket.IO responde "sid desconhecido" e o cliente refaz o
+        handshake, que então cai num backend saudável. ``exclude`` (backends
+        já tentados) só é respeitado se sobrar outro disponível.
+        """
+        if sid:
+            backend = self.for_sid(sid, pinned)
+            if backend is not None and backend not in exclude and backend.is_available():
+                return backend
+        if room_id:
+            return self.for_room(room_id, exclude)
+        return self.least_loaded(exclude)
+
+    def capture_handshake(self, backend):
+        """Callback que registra o sid devolvido no handshake do Engine.IO."""
+        def on_first_chunk(chunk):
+            match = HANDSHAKE_SID_RE.search(chunk)
+            if match:
+                self.bind_sid(match.group(1).decode('ascii', 'replace'), backend)
+        return on_first_chunk
+
+    def snapshot(self):
+        """Estado de cada backend (saúde, circuito e contadores)."""
+        with self._sids_lock:
+            sessions = {}
+            for backend in self._sids.values():
+                sessions[backend.id] = sessions.get(backend.id, 0) + 1
+        return [{
+            'url': backend.url,
+            'healthy': backend.healthy,
+            'circuit': backend.breaker.state,
+            'in_flight': backend.in_flight,
+            'requests': backend.requests,
+            'sessions': sessions.get(backend.id, 0),
+        } for backend in self.backends]
+
+
+def _first_available(backends, exclude=()):
+    """Primeiro backend disponível fora de ``exclude``; senão, o primeiro disponível de ``exclude``.
+
+    ``is_available`` pode consumir a requisição de teste do circuito meio-aberto,
+    então só é consultado para os backends que seriam de fato escolhidos.
+    """
+    for backend in backends:
+        if backend not in exclude and backend.is_available():
+            return backend
+    for backend in backends:
+        if backend in exclude and backend.is_available():
+            return backend
+    return None
+
+
+def affinity_keys(environ):
+    """Extrai (sid, sala, backend fixado por cookie) de uma requisição WSGI.
+
+    A sala vem de ``roomId``/``room`` na query (o cliente Socket.IO deve
+    enviá-la no handshake) ou do header ``X-Room-Id``.
+    """
+    query = dict(parse_qsl(environ.get('QUERY_STRING', '')))
+    room_id = query.get('roomId') or query.get('room') or environ.get('HTTP_X_ROOM_ID')
+    pinned = None
+    for part in environ.get('HTTP_COOKIE', '').split(';'):
+        name, _, value = part.strip().partition('=')
+        if name == STICKY_COOKIE:
+            pinned = value
+            break
+    return query.get('sid'), room_id, pinned
+
+
+class HealthMonitor:
+    """Thread que sonda periodicamente a saúde de um conjunto de backends."""
+
+    def __init__(self, backends, interval=HEALTH_INTERVAL):
+        self.backends = backends
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='backend-health', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for backend in self.backends:
+                try:
+                    backend.probe()
+                except Exception as e:
+                    logging.error(f"Erro ao sondar backend {backend.url}: {str(e)}")
+            self._stop.wait(self.interval)
+
+
+def create_session(pool_size=POOL_SIZE):
+    """Cria a sessão HTTP compartilhada com pool de conexões keep-alive."""
+    session = requests.Session()
+    # Sem retries automáticos: a política de falha fica a cargo do proxy
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # O proxy repassa os headers do cliente; a sessão não deve acrescentar os seus
+    session.headers.clear()
+    return session
+
+
+class RoutePolicy:
+    """Timeouts e tentativas extras de um prefixo de rota."""
+
+    __slots__ = ('prefix', 'connect_timeout', 'read_timeout', 'retries', 'hedge_after')
+
+    def __init__(self, prefix, read_timeout, connect_timeout, retries=0, hedge_after=None):
+        self.prefix = prefix
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.hedge_after = hedge_after  # segundos sem resposta antes do hedge (None = sem hedge)
+
+    @property
+    def timeout(self):
+        """Par (conexão, leitura) do ``requests``; a leitura vale por pacote recebido, não pelo total."""
+        return (self.connect_timeout, self.read_timeout)
+
+
+class RoutePolicies:
+    """Política de cada requisição pelo prefixo mais longo de ``SERVER_CONFIG['PROXY']['ROUTES']``."""
+
+    def __init__(self, config=None):
+        config = config or SERVER_CONFIG['PROXY']
+        connect = config['CONNECT_TIMEOUT']
+        self.default = RoutePolicy('', config['DEFAULT_TIMEOUT'], connect)
+        self._routes = []  # [(política, mesma política sem tentativas extras)], prefixo mais longo primeiro
+        for prefix, route in sorted(config['ROUTES'].items(), key=lambda item: len(item[0]), reverse=True):
+            timeout = route.get('timeout', config['DEFAULT_TIMEOUT'])
+            hedge_ms = route.get('hedge_ms')
+            policy = RoutePolicy(prefix, timeout, connect, route.get('retries', 0),
+                                 hedge_ms / 1000 if hedge_ms else None)
+            self._routes.append((policy, RoutePolicy(prefix, timeout, connect)))
+
+    def match(self, method, path, has_body=False):
+        """Política de ``method path``; retries e hedge só para GET/HEAD sem corpo."""
+        for policy, single in self._routes:
+            if path.startswith(policy.prefix):
+                return policy if method in IDEMPOTENT_METHODS and not has_body else single
+        return self.default
+
+
+class RetryBudget:
+    """Orçamento das tentativas extras, proporcional ao tráfego.
+
+    Cada requisição deposita ``ratio`` fichas, o tempo rende
+    ``min_per_second`` (tráfego baixo ainda pode repetir) e cada tentativa
+    extra gasta uma. O saldo é limitado a ``cap``: uma onda de falhas depois
+    de um período calmo não vira uma onda de repetições.
+    """
+
+    def __init__(self, ratio, min_per_second, cap=None):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap if cap is not None else max(1.0, min_per_second * 10)
+        self._tokens = self.cap
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount):
+        now = time.monotonic()
+        self._tokens = min(self.cap, self._tokens + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Gasta uma ficha; False se o orçamento acabou."""
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class Hedger:
+    """Executa chamadas idempotentes ao backend com retry e hedge.
+
+    ``attempt()`` faz uma tentativa completa (escolhe o backend, envia e
+    contabiliza) e retorna o resultado ou levanta uma exceção do ``requests``.
+    No hedge as tentativas rodam num pool de threads próprio; a perdedora
+    termina em segundo plano e o seu resultado vai para ``discard`` (ex.:
+    fechar a resposta e liberar o backend). Com o pool cheio a chamada segue
+    sem hedge na thread do worker, em vez de esperar na fila.
+    """
+
+    def __init__(self, budget, workers):
+        self.budget = budget
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='proxy-hedge')
+        self._retried = EXTRA_ATTEMPTS.labels('retry')
+        self._hedged = EXTRA_ATTEMPTS.labels('hedge')
+        self._hedge_won = EXTRA_ATTEMPTS.labels('hedge_won')
+        self._denied = EXTRA_ATTEMPTS.labels('no_budget')
+
+    def call(self, policy, attempt, discard=None):
+        self.budget.deposit()
+        retries = policy.retries
+        while True:
+            try:
+                if policy.hedge_after is None:
+                    return attempt()
+                return self._race(policy.hedge_after, attempt, discard)
+            except RETRYABLE_ERRORS:
+                if not retries:
+                    raise
+                if not self.budget.withdraw():
+                    self._denied.inc()
+                    raise
+                retries -= 1
+                self._retried.inc()
+
+    def _submit(self, attempt):
+        future = self._executor.submit(attempt)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _race(self, delay, attempt, discard):
+        """Primeira tentativa e, se ela não responder em ``delay``, uma segunda; vence a primeira que der certo."""
+        if not self._slots.acquire(blocking=False):
+            return attempt()
+        futures = [self._submit(attempt)]
+        done, _ = wait(futures, timeout=delay)
+        if not done and self._slots.acquire(blocking=False):
+            if self.budget.withdraw():
+                self._hedged.inc()
+                futures.append(self._submit(attempt))
+            else:
+                self._slots.release()
+                self._denied.inc()
+
+        pending = set(futures)
+        winner = error = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                elif winner is None:
+                    winner = future
+                else:
+                    self._discard(discard, future)
+        for future in pending:
+            future.add_done_callback(lambda f: self._discard(discard, f))
+        if winner is None:
+            raise error
+        if winner is not futures[0]:
+            self._hedge_won.inc()
+        return winner.result()
+
+    @staticmethod
+    def _discard(discard, future):
+        if discard is not None and future.exception() is None:
+            try:
+                discard(future.result())
+            except Exception as e:
+                logging.error(f"Erro ao descartar tentativa perdedora: {str(e)}")
+
+
+class BoundedInput:
+    """Corpo da requisição lido do cliente sob demanda, em blocos.
+
+    Expõe ``len()`` para que o ``requests`` envie Content-Length em vez de
+    chunked, e nunca lê além de ``length`` bytes do ``wsgi.input``.
+    """
+
+    def __init__(self, stream, length, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.length = length
+        self.remaining = length
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+        data = self.stream.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        if not data:
+            # Cliente encerrou antes do Content-Length anunciado
+            self.remaining = 0
+        return data
+
+
+def iter_input(stream, chunk_size=CHUNK_SIZE):
+    """Lê um corpo sem Content-Length (wsgi.input_terminated) até o fim."""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        yield data
+
+
+def request_body(stream, content_length, input_terminated=False):
+    """Monta o corpo a repassar ao backend sem carregá-lo em memória."""
+    try:
+        length = int(content_length or 0)
+    except ValueError:
+        length = 0
+    if length > 0:
+        return BoundedInput(stream, length)
+    if input_terminated:
+        # Corpo chunked do cliente segue chunked para o backend
+        return iter_input(stream)
+    return None
+
+
+def forward_headers(headers):
+    """Remove headers hop-by-hop (e os listados em Connection)."""
+    connection_tokens = set()
+    for name, value in headers:
+        if name.lower() == 'connection':
+            connection_tokens.update(token.strip().lower() for token in value.split(','))
+    return [(name, value) for name, value in headers
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in connection_tokens]
+
+
+class StreamedBody:
+    """Repassa o corpo da resposta do backend em blocos, sem decodificá-lo.
+
+    O corpo segue exatamente como veio (inclusive com Content-Encoding) e a
+    conexão volta ao pool quando o servidor WSGI chama ``close()``, mesmo que
+    o cliente desista antes de ler tudo.
+    """
+
+    def __init__(self, response, chunk_size=CHUNK_SIZE, on_close=None, on_first_chunk=None):
+        self.response = response
+        self.on_close = on_close
+        self.on_first_chunk = on_first_chunk
+        self._chunks = response.raw.stream(chunk_size, decode_content=False)
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            chunk = next(self._chunks)
+            if chunk:
+                if self.on_first_chunk is not None:
+                    on_first_chunk, self.on_first_chunk = self.on_first_chunk, None
+                    on_first_chunk(chunk)
+                return chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.response.close()
+        if self.on_close is not None:
+            self.on_close()
@@ -1,11 +1,9 @@
 #!/usr/bin/env python
-import os
-import sys
-import subprocess
 import logging
-import json
 from datetime import datetime
 from flask import Flask, request, jsonify
+from deploy_queue import deploy_queue
+from profiling import require_admin
 
 # Configurar logging
 logging.basicConfig(
@@ -17,56 +15,6 @@ logging.basicConfig(
 # Criar aplicação Flask dedicada apenas para o webhook
 app = Flask(__name__)
 
-def run_command(command):
-    """Executa um comando shell e retorna o resultado"""
-    try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-        return True, result.stdout
-    except subprocess.CalledProcessError as e:
-        return False, f"Erro: {e.stderr}"
-
-def perform_update():
-    """Executa a atualização do código via Git pull"""
-    # Registrar início da atualização
-    logging.info(f"Iniciando atualização em {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    
-    # Diretório do projeto no PythonAnywhere
-    project_dir = "/home/kluferso/MesaDigital"
-    
-    # Mudar para o diretório do projeto
-    try:
-        os.chdir(project_dir)
-        logging.info(f"Trabalhando no diretório: {project_dir}")
-    except Exception as e:
-        logging.error(f"Erro ao mudar para o diretório: {str(e)}")
-        return {"status": "error", "message": f"Erro ao mudar para o diretório: {str(e)}"}
-    
-    # Atualizar do GitHub
-    logging.info("Atualizando código do GitHub...")
-    success, output = run_command("git pull origin main")
-    
-    if not success:
-        logging.error(f"Erro no git pull: {output}")
-        return {"status": "error", "message": f"Erro no git pull: {output}"}
-    
-    # Instalar dependências
-    logging.info("Instalando dependências...")
-    run_command("pip install --user -r requirements.txt")
-    
-    # Recarregar a aplicação principal
-    logging.info("Recarregando aplicação...")
-    run_command("touch /var/www/kluferso_pythonanywhere_com_wsgi.py")
-    
-    logging.info("Atualização concluída com sucesso!")
-    return {"status": "success", "message": "Atualização concluída com sucesso!"}
-
 @app.route('/', methods=['GET'])
 def health_check():
     """Endpoint para verificar se o webhook está funcionando"""
@@ -97,9 +45,14 @@ def webhook_handler():
         # Verificar se é um push para a branch main
         ref = payload.get('ref', '')
         if event_type == 'push' and 'refs/heads/main' in ref:
-            # Executar atualização em processo separado para não bloquear a resposta
-            result = perform_update()
-            return jsonify(result)
+            # Enfileirar o deploy (git/pip rodam em segundo plano); responde na hora
+            job = deploy_queue.submit(ref, commit=payload.get('after'), source='webhook_handler')
+            return jsonify({
+                "status": "queued",
+                "message": "Atualização enfileirada",
+                "job": job['id'],
+                "status_url": f"/deploy/jobs/{job['id']}"
+            }), 202
         else:
             logging.info(f"Ignorando evento {event_type} para ref {ref}")
             return jsonify({"status": "ignored", "message": f"Evento ignorado: {event_type} para {ref}"}), 200
@@ -108,6 +61,21 @@ def webhook_handler():
         logging.error(f"Erro ao processar webhook: {str(e)}")
         return jsonify({"status": "error", "message": f"Erro ao processar webhook: {str(e)}"}), 500
 
+@app.route('/deploy/jobs', methods=['GET'])
+@require_admin
+def deploy_jobs():
+    """Deploys recentes"""
+    return jsonify({"jobs": deploy_queue.recent()})
+
+@app.route('/deploy/jobs/<job_id>', methods=['GET'])
+@require_admin
+def deploy_job_status(job_id):
+    """Status de um deploy enfileirado"""
+    job = deploy_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job não encontrado"}), 404
+    return jsonify(job)
+
 # Configuração para PythonAnywhere WSGI
 application = app
 
@@ -2,25 +2,20 @@ import logging
 import sys
 import os
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='/tmp/mesa_digital_wsgi.log',  # Salvar logs em arquivo acessível
-    filemode='a'
-)
+# Adicionar o diretório atual ao path (necessário para importar log_setup e config)
+path = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(path)
+if path not in sys.path:
+    sys.path.append(path)
+
+# Configurar logging: fila + thread de escrita com rotação em arquivo acessível
+from log_setup import setup_logging
+setup_logging('/tmp/mesa_digital_wsgi.log')
 
 # Log de inicialização
 logging.info("Iniciando aplicação WSGI do Mesa Digital")
 
 try:
-    # Adicionar o diretório atual ao path
-    path = os.path.dirname(os.path.abspath(__file__))
-    project_dir = os.path.dirname(path)
-    if path not in sys.path:
-        sys.path.append(path)
-        logging.info(f"Adicionado {path} ao sys.path")
-    
     if project_dir not in sys.path:
         sys.path.append(project_dir)
         logging.info(f"Adicionado {project_dir} ao sys.path")
@@ -29,21 +24,8 @@ try:
     os.environ['PROJECT_DIR'] = project_dir  # Pasta principal do projeto
     logging.info(f"Diretório do projeto: {os.environ.get('PROJECT_DIR')}")
     
-    # Verificar se a pasta existe
-    if not os.path.exists(project_dir):
-        logging.error(f"ERRO: Diretório do projeto não existe: {project_dir}")
-    else:
-        logging.info(f"Diretório do projeto existe: {project_dir}")
-        
-    # Listar conteúdo do diretório para debug
-    logging.info(f"Conteúdo do diretório servidor: {os.listdir(path)}")
-    
-    # Verificar arquivo flask_app.py
-    flask_app_path = os.path.join(path, 'flask_app.py')
-    if not os.path.exists(flask_app_path):
-        logging.error(f"ERRO: flask_app.py não encontrado em: {flask_app_path}")
-    else:
-        logging.info(f"flask_app.py encontrado: {flask_app_path}")
+    # Sem verificações de diretório aqui: cada reload pagaria esse I/O antes da
+    # primeira requisição, e um flask_app.py ausente já aparece no ImportError
     
     # Importar a aplicação Flask
     from flask_app import app as application
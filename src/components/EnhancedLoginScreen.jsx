@@ -642,7 +642,7 @@ export default function EnhancedLoginScreen() {
                           <Box sx={{ display: 'flex', gap: 1, alignItems: 'center', mt: 1 }}>
                             <Chip
                               icon={<GroupIcon />}
-                              label={`${activeRoom.userCount} participante${activeRoom.userCount !== 1 ? 's' : ''}`}
+                              label={`${activeRoom.usersCount} participante${activeRoom.usersCount !== 1 ? 's' : ''}`}
                               size="small"
                               color="primary"
                               variant="outlined"
@@ -80,6 +80,7 @@ export const WebRTCProvider = ({ children }) => {
     
     // Configurar listeners de sinal WebRTC
     socket.on('webrtc_signal', handleWebRTCSignal);
+    socket.on('webrtc_signals', handleWebRTCSignals);
     
     // Configurar listeners para entrada/saída de usuários
     socket.on('user_joined', handleUserJoined);
@@ -93,6 +94,7 @@ export const WebRTCProvider = ({ children }) => {
     
     return () => {
       socket.off('webrtc_signal');
+      socket.off('webrtc_signals');
       socket.off('user_joined');
       socket.off('user_left');
       socket.off('room_users');
@@ -140,11 +142,21 @@ export const WebRTCProvider = ({ children }) => {
         peerConnection.addIceCandidate(new RTCIceCandidate(signal))
           .catch(error => console.error('Erro ao adicionar candidato ICE:', error));
       }
+      else if (type === 'end-of-candidates') {
+        peerConnection.addIceCandidate()
+          .catch(error => console.error('Erro ao finalizar candidatos ICE:', error));
+      }
     } catch (error) {
       console.error('Erro ao processar sinal WebRTC:', error);
     }
   }, [socket, roomId]);
   
+  // Candidatos ICE agrupados pelo servidor (um frame por par)
+  const handleWebRTCSignals = useCallback((data) => {
+    const { from, signals } = data;
+    signals.forEach(({ type, signal }) => handleWebRTCSignal({ from, type, signal }));
+  }, [handleWebRTCSignal]);
+  
   // Criação de conexão peer
   const createPeerConnection = useCallback((userId, isInitiator) => {
     if (peerConnectionsRef.current[userId]) {
@@ -174,6 +186,13 @@ export const WebRTCProvider = ({ children }) => {
             signal: candidate,
             roomId
           });
+        } else {
+          // Coleta encerrada: o par pode concluir a verificação ICE
+          socket.emit('webrtc_signal', {
+            to: userId,
+            type: 'end-of-candidates',
+            roomId
+          });
         }
       };
       
@@ -1,6 +1,35 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import { useSocket } from './useSocket';
 
+// Posição logo depois de `after` (null = início; uuid desconhecido = fim)
+const insertAfter = (songs, song, after) => {
+  const next = songs.slice();
+  const index = after == null ? 0 : next.findIndex((s) => s.uuid === after) + 1;
+  next.splice(after != null && index === 0 ? next.length : index, 0, song);
+  return next;
+};
+
+// Aplica uma operação da playlist como registrada pelo servidor (server/playlist_log.py):
+// o `after` já vem resolvido, então o resultado é o mesmo em todos os clientes
+export const applyPlaylistOp = (songs, op) => {
+  switch (op.type) {
+    case 'add':
+      if (songs.some((s) => s.uuid === op.song.uuid)) return songs;
+      return insertAfter(songs, op.song, op.after);
+    case 'remove':
+      return songs.filter((s) => s.uuid !== op.uuid);
+    case 'move': {
+      const song = songs.find((s) => s.uuid === op.uuid);
+      if (!song) return songs;
+      return insertAfter(songs.filter((s) => s.uuid !== op.uuid), song, op.after);
+    }
+    case 'status':
+      return songs.map((s) => (s.uuid === op.uuid ? { ...s, status: op.status } : s));
+    default:
+      return songs;
+  }
+};
+
 export const useMusicPlayer = (roomId) => {
   const { socket } = useSocket();
   const [playlist, setPlaylist] = useState([]);
@@ -9,22 +38,57 @@ export const useMusicPlayer = (roomId) => {
   const [loading, setLoading] = useState(false);
   const [isPlaying, setIsPlaying] = useState(false);
   const [volume, setVolume] = useState(0.5);
+  // Versão da playlist já aplicada; deltas que chegam durante um music_sync esperam em `buffer`
+  const syncRef = useRef({ epoch: null, version: 0, syncing: false, buffer: [] });
 
-  // Fetch playlist inicial
+  // Playlist inicial e deltas (music_playlist_ops)
   useEffect(() => {
     if (socket && roomId) {
-      socket.emit('get_playlist', { roomId }, (response) => {
-        if (response && response.playlist) {
-          setPlaylist(response.playlist);
-        }
-      });
+      const state = syncRef.current;
+      state.epoch = null;
+      state.version = 0;
+      state.buffer = [];
 
-      const handlePlaylistUpdated = (data) => {
-        if (data.playlist) {
-          setPlaylist(data.playlist);
+      const handlePlaylistOps = (data) => {
+        if (state.syncing) {
+          state.buffer.push(data);
+          return;
+        }
+        const ops = data.epoch === state.epoch ? data.ops.filter((op) => op.version > state.version) : data.ops;
+        if (ops.length === 0) return;
+        if (data.epoch !== state.epoch || ops[0].version !== state.version + 1) {
+          // Perdemos operações (ou o servidor reiniciou): pedir o que falta
+          state.buffer.push(data);
+          resync();
+          return;
         }
+        setPlaylist((songs) => ops.reduce(applyPlaylistOp, songs));
+        state.version = ops[ops.length - 1].version;
       };
 
+      // Sem epoch conhecida (início, reconexão) o servidor responde com a playlist inteira
+      const resync = () => {
+        if (state.syncing) return;
+        state.syncing = true;
+        socket.emit('music_sync', { roomId, epoch: state.epoch, version: state.version }, (response) => {
+          state.syncing = false;
+          if (response && !response.error) {
+            if (response.playlist) {
+              setPlaylist(response.playlist);
+            } else if (response.ops.length > 0) {
+              setPlaylist((songs) => response.ops.reduce(applyPlaylistOp, songs));
+            }
+            state.epoch = response.epoch;
+            state.version = response.version;
+          }
+          const buffered = state.buffer;
+          state.buffer = [];
+          buffered.forEach(handlePlaylistOps);
+        });
+      };
+
+      resync();
+
       const handleNowPlaying = (data) => {
         // Encontrar a música na playlist
         // Se a lógica de 'now playing' for apenas sincronizar o início, 
@@ -35,12 +99,19 @@ export const useMusicPlayer = (roomId) => {
         console.log('Now playing:', data);
       };
 
-      socket.on('music_playlist_updated', handlePlaylistUpdated);
+      const handleReconnect = () => {
+        state.epoch = null;
+        resync();
+      };
+
+      socket.on('music_playlist_ops', handlePlaylistOps);
       socket.on('music_now_playing', handleNowPlaying);
+      socket.on('connect', handleReconnect);
 
       return () => {
-        socket.off('music_playlist_updated', handlePlaylistUpdated);
+        socket.off('music_playlist_ops', handlePlaylistOps);
         socket.off('music_now_playing', handleNowPlaying);
+        socket.off('connect', handleReconnect);
       };
     }
   }, [socket, roomId]);
@@ -76,6 +147,19 @@ export const useMusicPlayer = (roomId) => {
     }
   }, [socket, roomId]);
 
+  // after: uuid da música que fica antes (null = início)
+  const moveSong = useCallback((uuid, after) => {
+    if (socket && roomId) {
+      socket.emit('music_move_song', { roomId, uuid, after });
+    }
+  }, [socket, roomId]);
+
+  const reorderPlaylist = useCallback((order) => {
+    if (socket && roomId) {
+      socket.emit('music_reorder_playlist', { roomId, order });
+    }
+  }, [socket, roomId]);
+
   const playSong = useCallback((uuid) => {
     if (socket && roomId) {
       socket.emit('music_play', { roomId, uuid });
@@ -100,6 +184,8 @@ export const useMusicPlayer = (roomId) => {
     searchMusic,
     addSong,
     removeSong,
+    moveSong,
+    reorderPlaylist,
     playSong
   };
 };
@@ -311,6 +311,34 @@ class QualityMonitor {
     };
   }
 
+  /**
+   * Medições do áudio recebido de um usuário no último intervalo, no formato
+   * do evento qos_report (jitter em ms, perda como fração, bitrate em kbps)
+   * @param {string} userId - ID do usuário
+   * @returns {Object|null} - Medições ou null se ainda não houver duas coletas
+   */
+  getLinkReport(userId) {
+    const history = this.metricsHistory.get(userId);
+    if (!history || history.length < 2) return null;
+
+    const previous = history[history.length - 2];
+    const latest = history[history.length - 1];
+    const seconds = (latest.timestamp - previous.timestamp) / 1000;
+    if (!latest.audio || !previous.audio || seconds <= 0) return null;
+
+    // Contadores do getStats são acumulados: perda e bitrate do intervalo saem das diferenças
+    const received = (latest.audio.packetsReceived || 0) - (previous.audio.packetsReceived || 0);
+    const lost = Math.max(0, (latest.audio.packetsLost || 0) - (previous.audio.packetsLost || 0));
+    const bytes = (latest.audio.bytesReceived || 0) - (previous.audio.bytesReceived || 0);
+    if (received < 0 || bytes < 0) return null; // Contadores reiniciados (conexão refeita)
+
+    return {
+      jitterMs: (latest.audio.jitter || 0) * 1000,
+      packetLoss: received + lost > 0 ? lost / (received + lost) : undefined,
+      bitrateKbps: (bytes * 8) / 1000 / seconds
+    };
+  }
+
   /**
    * Registra um callback para um evento específico
    */
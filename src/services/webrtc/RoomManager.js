@@ -19,6 +19,17 @@ class RoomManager {
     this.callbacks = {};
     this.initialized = false;
 
+    // Parte do plano de conexões que cabe a este cliente (mesh ou relays):
+    // só as próprias conexões e, com relays, o streamId de cada participante
+    this.connectionPlan = null;
+    this.receivedTracks = new Map();
+    this.networkReportTimer = null;
+    this.qosReportTimer = null;
+    this.audioLevelTimer = null;
+
+    // Dicas de falante ativo (bitrate/pausa do envio do áudio local)
+    this.speakerHints = null;
+
     // Inicializar AudioProcessor quando o WebRTC estiver pronto
     this.webRTC.on('onInitialized', () => {
       if (this.webRTC.audioContext) {
@@ -72,14 +83,26 @@ class RoomManager {
     }
 
     // Eventos WebRTC
-    this.webRTC.on('onTrack', ({ userId, streams }) => {
-      this.triggerCallback('onUserMediaReceived', { userId, streams });
+    this.webRTC.on('onTrack', ({ userId, streams, track }) => {
+      // Áudio encaminhado por um relay é atribuído ao dono do stream
+      const owner = this._streamOwner(streams[0]) || userId;
+      this.triggerCallback('onUserMediaReceived', { userId: owner, streams });
+
+      if (track && streams[0]) {
+        this.receivedTracks.set(track.id, { track, stream: streams[0], from: userId });
+        track.addEventListener('ended', () => this.receivedTracks.delete(track.id));
+        this._forwardTrack(userId, track, streams[0]);
+      }
     });
 
     this.webRTC.on('onIceCandidate', ({ userId, candidate }) => {
       this._sendSignal(userId, candidate, 'candidate');
     });
 
+    this.webRTC.on('onIceGatheringComplete', ({ userId }) => {
+      this._sendSignal(userId, null, 'end-of-candidates');
+    });
+
     this.webRTC.on('onOfferCreated', ({ userId, offer }) => {
       this._sendSignal(userId, offer, 'offer');
     });
@@ -89,6 +112,10 @@ class RoomManager {
     });
 
     this.webRTC.on('onConnectionStateChange', ({ userId, state }) => {
+      // Conexão nova: o envio segue as dicas de falante ativo já recebidas
+      if (state === 'connected' && this.speakerHints) {
+        this._applySpeakerHints(this.speakerHints, true);
+      }
       this.triggerCallback('onConnectionStateChange', { userId, state });
     });
 
@@ -161,30 +188,213 @@ class RoomManager {
   _setupSignalingHandlers() {
     // Remover handlers existentes
     this.socket.off('webrtc_signal');
+    this.socket.off('webrtc_signals');
+    this.socket.off('connection_plan');
 
-    // Adicionar novos handlers
-    this.socket.on('webrtc_signal', async (data) => {
+    // Ofertas e respostas chegam uma a uma
+    this.socket.on('webrtc_signal', (data) => {
       const { from, signal, type } = data;
+      return this._handleSignal(from, signal, type);
+    });
 
-      console.log(`Sinal ${type} recebido de ${from}`);
+    // Candidatos ICE chegam agrupados por par, na ordem em que foram gerados
+    this.socket.on('webrtc_signals', async (data) => {
+      const { from, signals } = data;
+      for (const { signal, type } of signals) {
+        await this._handleSignal(from, signal, type);
+      }
+    });
 
-      try {
-        if (type === 'offer') {
-          await this.webRTC.processOffer(from, signal);
-        } else if (type === 'answer') {
-          await this.webRTC.processAnswer(from, signal);
-        } else if (type === 'candidate') {
-          await this.webRTC.addIceCandidate(from, signal);
+    // Plano de conexões recalculado pelo servidor (entradas, saídas, medições)
+    this.socket.on('connection_plan', (plan) => {
+      this._applyConnectionPlan(plan);
+    });
+  }
+
+  /**
+   * Aplica um plano de conexões: abre as conexões do plano e fecha as demais
+   * @private
+   */
+  _applyConnectionPlan(plan) {
+    if (!plan || plan.roomId !== this.roomId) return;
+    if (this.connectionPlan && this.connectionPlan.version >= plan.version) return;
+
+    console.log(`Plano de conexões v${plan.version}: ${plan.mode} (${plan.relays.length} relays)`);
+    this.connectionPlan = plan;
+
+    const me = this.socket.id;
+    const peers = this._planPeers();
+
+    this.webRTC.connections.forEach((connection, userId) => {
+      if (!peers.includes(userId)) {
+        this.webRTC.closePeerConnection(userId);
+      }
+    });
+
+    // Quem inicia cada conexão vem do plano (o último a entrar, como no join)
+    plan.links.forEach(([initiator, other]) => {
+      if (initiator === me && !this.webRTC.connections.has(other)) {
+        try {
+          this.webRTC.createPeerConnection(other, true);
+        } catch (e) {
+          console.error(`Erro ao criar conexão com ${other}:`, e);
         }
-      } catch (error) {
-        console.error(`Erro ao processar sinal ${type} de ${from}:`, error);
-        this.triggerCallback('onError', {
-          type: 'signaling_error',
-          message: error.message,
-          error
-        });
       }
     });
+
+    // Como relay, repassar o que já foi recebido para as conexões novas
+    this.receivedTracks.forEach(({ track, stream, from }) => {
+      this._forwardTrack(from, track, stream);
+    });
+
+    this.triggerCallback('onConnectionPlan', plan);
+  }
+
+  /**
+   * Peers com quem o plano atual manda manter conexão
+   * @private
+   */
+  _planPeers() {
+    const me = this.socket.id;
+    const peers = [];
+    (this.connectionPlan ? this.connectionPlan.links : []).forEach(([a, b]) => {
+      if (a === me) peers.push(b);
+      else if (b === me) peers.push(a);
+    });
+    return peers;
+  }
+
+  /**
+   * Encaminha um track recebido quando este cliente é relay no plano.
+   * Track vindo de uma folha vai para todas as outras conexões; vindo de
+   * outro relay (que já o enviou aos demais relays), só para as folhas.
+   * @private
+   */
+  _forwardTrack(from, track, stream) {
+    const plan = this.connectionPlan;
+    const me = this.socket.id;
+    if (!plan || plan.mode !== 'relay' || !plan.relays.includes(me)) return;
+
+    const fromRelay = plan.relays.includes(from);
+    this._planPeers()
+      .filter(peer => peer !== from && (!fromRelay || !plan.relays.includes(peer)))
+      .forEach(peer => this.webRTC.forwardTrack(peer, track, stream));
+  }
+
+  /**
+   * Usuário dono de um stream, pelo streamId informado no plano
+   * @private
+   */
+  _streamOwner(stream) {
+    if (!stream || !this.connectionPlan) return null;
+    const peers = this.connectionPlan.peers || {};
+    return Object.keys(peers).find(userId => peers[userId].streamId === stream.id) || null;
+  }
+
+  /**
+   * Envia periodicamente o uplink estimado e os RTTs medidos para o planejador
+   * @private
+   */
+  _startNetworkReports() {
+    this._stopNetworkReports();
+
+    const report = () => {
+      if (!this.roomId || !this.socket || !this.socket.connected) return;
+
+      const rtts = {};
+      let uplinkKbps = 0;
+      this.webRTC.connectionQuality.forEach((quality, userId) => {
+        const { roundTripTime, availableOutgoingBitrate } = quality.details || {};
+        if (roundTripTime) rtts[userId] = roundTripTime * 1000;
+        if (availableOutgoingBitrate) uplinkKbps = Math.max(uplinkKbps, availableOutgoingBitrate / 1000);
+      });
+
+      this.socket.emit('network_report', {
+        roomId: this.roomId,
+        rtts,
+        uplinkKbps: uplinkKbps || undefined,
+        streamId: this.webRTC.localStream ? this.webRTC.localStream.id : undefined
+      });
+    };
+
+    report();
+    this.networkReportTimer = setInterval(report, 10000);
+
+    // Jitter, perda e bitrate do áudio recebido de cada par, para a telemetria da sala
+    const qosReport = () => {
+      if (!this.roomId || !this.socket || !this.socket.connected) return;
+
+      const links = {};
+      this.qualityMonitor.metrics.forEach((metrics, userId) => {
+        const link = this.qualityMonitor.getLinkReport(userId);
+        if (link) links[userId] = link;
+      });
+
+      if (Object.keys(links).length > 0) {
+        this.socket.emit('qos_report', { roomId: this.roomId, links });
+      }
+    };
+
+    this.qosReportTimer = setInterval(qosReport, 5000);
+
+    // Nível do microfone numa janela curta (média de amostras a cada 100 ms) para o falante ativo
+    let levels = [];
+    this.audioLevelTimer = setInterval(() => {
+      const level = this.webRTC.getLocalAudioLevel();
+      if (level !== null) levels.push(level);
+      if (levels.length < 5) return;
+
+      if (this.roomId && this.socket && this.socket.connected) {
+        const mean = levels.reduce((sum, value) => sum + value, 0) / levels.length;
+        this.socket.emit('audio_level', { roomId: this.roomId, level: mean });
+      }
+      levels = [];
+    }, 100);
+  }
+
+  /**
+   * @private
+   */
+  _stopNetworkReports() {
+    if (this.networkReportTimer) {
+      clearInterval(this.networkReportTimer);
+      this.networkReportTimer = null;
+    }
+    if (this.qosReportTimer) {
+      clearInterval(this.qosReportTimer);
+      this.qosReportTimer = null;
+    }
+    if (this.audioLevelTimer) {
+      clearInterval(this.audioLevelTimer);
+      this.audioLevelTimer = null;
+    }
+  }
+
+  /**
+   * Processa um sinal WebRTC recebido
+   * @private
+   */
+  async _handleSignal(from, signal, type) {
+    console.log(`Sinal ${type} recebido de ${from}`);
+
+    try {
+      if (type === 'offer') {
+        await this.webRTC.processOffer(from, signal);
+      } else if (type === 'answer') {
+        await this.webRTC.processAnswer(from, signal);
+      } else if (type === 'candidate') {
+        await this.webRTC.addIceCandidate(from, signal);
+      } else if (type === 'end-of-candidates') {
+        await this.webRTC.addIceCandidate(from, null);
+      }
+    } catch (error) {
+      console.error(`Erro ao processar sinal ${type} de ${from}:`, error);
+      this.triggerCallback('onError', {
+        type: 'signaling_error',
+        message: error.message,
+        error
+      });
+    }
   }
 
   /**
@@ -225,6 +435,10 @@ class RoomManager {
       // Remover da lista de usuários
       this.users.delete(userId);
 
+      this.receivedTracks.forEach((entry, trackId) => {
+        if (entry.from === userId) this.receivedTracks.delete(trackId);
+      });
+
       this.triggerCallback('onUserLeft', { userId, userName });
     });
 
@@ -232,6 +446,39 @@ class RoomManager {
     this.socket.on('chat_message', (message) => {
       this.triggerCallback('onChatMessage', message);
     });
+
+    // Link de áudio da sala degradado ou recuperado (telemetria de QoS do servidor)
+    this.socket.on('qos_alert', (alert) => {
+      this.triggerCallback('onQosAlert', alert);
+    });
+
+    // Falante dominante e conjunto ativo recalculados pelo servidor
+    this.socket.on('speaker_hints', (hints) => {
+      this._applySpeakerHints(hints);
+    });
+  }
+
+  /**
+   * Aplica as dicas de falante ativo: fora do conjunto ativo o áudio local é
+   * enviado com bitrate reduzido; na lista de pausados, o envio é pausado
+   * até o servidor perceber que voltamos a tocar
+   * @private
+   */
+  _applySpeakerHints(hints, force = false) {
+    if (!hints || hints.roomId !== this.roomId) return;
+    if (!force && this.speakerHints && this.speakerHints.version >= hints.version) return;
+    this.speakerHints = hints;
+
+    const me = this.socket.id;
+    if (hints.paused.includes(me)) {
+      this.webRTC.setLocalSendLimits(hints.inactiveKbps, false);
+    } else if (hints.inactive.includes(me)) {
+      this.webRTC.setLocalSendLimits(hints.inactiveKbps, true);
+    } else {
+      this.webRTC.setLocalSendLimits(null, true);
+    }
+
+    this.triggerCallback('onSpeakerHints', hints);
   }
 
   /**
@@ -276,8 +523,14 @@ class RoomManager {
         // Adicionar usuário local
         this.users.set(this.socket.id, this.localUser);
 
+        this.connectionPlan = null;
+        this._applyConnectionPlan(response.room.plan);
+
         // Configurar handlers de eventos da sala
         this._setupRoomEventHandlers();
+        if (response.room.plan) {
+          this._startNetworkReports();
+        }
 
         this.triggerCallback('onRoomCreated', {
           roomId: this.roomId,
@@ -310,6 +563,30 @@ class RoomManager {
     });
   }
 
+  /**
+   * Busca uma página de salas com filtros (servidor Python)
+   * @param {Object} filters - { limit, cursor, sort: 'created'|'occupancy', order: 'asc'|'desc',
+   *   needs: [instrumentos ausentes], has: [instrumentos presentes], minUsers, maxUsers }
+   * @returns {Promise<{rooms: Array, nextCursor: string|null}>}
+   */
+  async findRooms(filters = {}) {
+    await this.initialize();
+
+    if (!this.socket || !this.socket.connected) {
+      throw new Error('Socket não está conectado');
+    }
+
+    return new Promise((resolve, reject) => {
+      this.socket.emit('list_rooms', filters, (response) => {
+        if (response.error) {
+          reject(new Error(response.error));
+          return;
+        }
+        resolve({ rooms: response.rooms, nextCursor: response.nextCursor || null });
+      });
+    });
+  }
+
   /**
    * Entra em uma sala existente
    * @param {string} roomId - ID da sala
@@ -464,13 +741,20 @@ class RoomManager {
         };
 
         this.users.clear();
+        this.connectionPlan = null;
+
+        // Servidor com planejamento de topologia: conectar só ao que o plano indica
+        const plan = response.room.plan;
+        this._applyConnectionPlan(plan);
+        this.speakerHints = null;
+        this._applySpeakerHints(response.room.speakers);
 
         // Adicionar todos os usuários
         response.room.users.forEach(user => {
           this.users.set(user.id, user);
 
-          // Iniciar conexão WebRTC com todos, exceto nós mesmos
-          if (user.id !== this.socket.id) {
+          // Sem plano, iniciar conexão WebRTC com todos, exceto nós mesmos
+          if (!plan && user.id !== this.socket.id) {
             console.log(`Iniciando conexão WebRTC com ${user.name} (${user.id})`);
             try {
               this.webRTC.createPeerConnection(user.id, true);
@@ -483,6 +767,9 @@ class RoomManager {
 
         // Configurar handlers de eventos da sala
         this._setupRoomEventHandlers();
+        if (plan) {
+          this._startNetworkReports();
+        }
 
         // Salvar no localStorage para recuperação de emergência
         try {
@@ -522,14 +809,20 @@ class RoomManager {
     this.socket.emit('leave_room', { roomId: this.roomId });
 
     // Limpar estado
+    this._stopNetworkReports();
+    this.speakerHints = null;
     this.roomId = null;
     this.localUser = null;
     this.users.clear();
+    this.connectionPlan = null;
+    this.receivedTracks.clear();
 
     // Remover handlers de eventos da sala
     this.socket.off('user_joined');
     this.socket.off('user_left');
     this.socket.off('chat_message');
+    this.socket.off('qos_alert');
+    this.socket.off('speaker_hints');
 
     this.triggerCallback('onRoomLeft');
   }
@@ -553,45 +846,117 @@ class RoomManager {
   }
 
   /**
-   * Compartilha um arquivo com a sala
+   * Compartilha um arquivo com a sala: upload em partes, retomável, e a
+   * mensagem do chat leva só a referência do arquivo
    * @param {File} file - Arquivo a ser compartilhado
+   * @param {Function} onProgress - Chamado com (bytes enviados, tamanho total)
    */
-  async shareFile(file) {
+  async shareFile(file, onProgress) {
     if (!this.roomId) {
       throw new Error('Não está em nenhuma sala');
     }
 
     try {
-      // 1. Upload do arquivo
-      const formData = new FormData();
-      formData.append('file', file);
+      const roomId = this.roomId;
+      const sha256 = await this._fileDigest(file);
+      const resumeKey = `upload_${roomId}_${sha256}`;
+
+      // 1. Retomar um upload interrompido deste arquivo ou abrir um novo
+      let upload = null;
+      const pendingId = localStorage.getItem(resumeKey);
+      if (pendingId) {
+        const response = await fetch(`/api/uploads/${pendingId}`);
+        if (response.ok) upload = await response.json();
+      }
 
-      const response = await fetch('/api/upload', {
-        method: 'POST',
-        body: formData
-      });
+      let shared = null;
+      if (!upload) {
+        const response = await fetch(`/api/rooms/${roomId}/uploads`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ sid: this.socket.id, filename: file.name, size: file.size, sha256 })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+          throw new Error(data.error || 'Falha no upload do arquivo');
+        }
+        // Conteúdo já estava no servidor: nada a enviar
+        if (data.file) shared = data.file;
+        else upload = data;
+      }
 
-      if (!response.ok) {
-        throw new Error('Falha no upload do arquivo');
+      // 2. Enviar as partes a partir do offset que o servidor já tem
+      if (!shared) {
+        localStorage.setItem(resumeKey, upload.uploadId);
+        shared = await this._uploadChunks(file, upload, onProgress);
+        localStorage.removeItem(resumeKey);
       }
 
-      const data = await response.json();
+      if (onProgress) onProgress(file.size, file.size);
 
-      // 2. Notificar socket
-      this.socket.emit('share_file', {
-        roomId: this.roomId,
-        url: data.url,
-        filename: data.filename,
-        type: 'pdf' // Por enquanto assumimos PDF, mas o backend valida
-      });
+      // 3. Mensagem no chat com a referência (o servidor completa os metadados)
+      this.socket.emit('send_message', { roomId, fileId: shared.id });
 
-      return data;
+      return shared;
     } catch (error) {
       console.error('Erro ao compartilhar arquivo:', error);
       throw error;
     }
   }
 
+  /**
+   * Envia as partes de um upload; retoma do offset do servidor após falhas
+   * @private
+   */
+  async _uploadChunks(file, upload, onProgress) {
+    let offset = upload.offset;
+    let failures = 0;
+
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + upload.chunkSize);
+      let response;
+      try {
+        response = await fetch(`/api/uploads/${upload.uploadId}`, {
+          method: 'PATCH',
+          headers: { 'Upload-Offset': String(offset), 'Content-Type': 'application/offset+octet-stream' },
+          body: chunk
+        });
+      } catch (error) {
+        response = null;
+      }
+
+      const data = response ? await response.json().catch(() => ({})) : {};
+      if (response && response.ok) {
+        failures = 0;
+        if (data.file) return data.file;
+        offset = data.offset;
+      } else if (response && response.status === 409 && typeof data.offset === 'number') {
+        // Parte repetida ou fora de ordem: seguir do offset que o servidor tem
+        offset = data.offset;
+      } else if (response && response.status !== 400 && response.status < 500) {
+        throw new Error(data.error || 'Falha no upload do arquivo');
+      } else {
+        failures += 1;
+        if (failures > 5) throw new Error('Falha no upload do arquivo');
+        await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+        const status = await fetch(`/api/uploads/${upload.uploadId}`).catch(() => null);
+        if (status && status.ok) offset = (await status.json()).offset;
+      }
+
+      if (onProgress) onProgress(offset, file.size);
+    }
+    throw new Error('Upload terminou sem confirmação do servidor');
+  }
+
+  /**
+   * SHA-256 (hex) do conteúdo do arquivo
+   * @private
+   */
+  async _fileDigest(file) {
+    const hash = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(hash)).map(byte => byte.toString(16).padStart(2, '0')).join('');
+  }
+
   /**
    * Ativa/desativa o Modo Música (áudio de alta fidelidade sem processamento)
    * @param {boolean} enabled - Se o modo música deve ser ativado
@@ -25,6 +25,8 @@ class WebRTCManager {
     this.connectionQuality = new Map(); // Armazenar qualidade de conexão por usuário
     this.statsInterval = null; // Intervalo para coleta de estatísticas
     this._reconnectionTimers = {}; // Timers para tentativas de reconexão
+    this.pendingRenegotiations = new Set(); // Conexões com oferta de encaminhamento agendada
+    this.levelAnalyser = null; // Analisador do microfone local para o falante ativo
     this.config = {
       iceServers: [
         { urls: 'stun:stun.l.google.com:19302' },
@@ -293,6 +295,7 @@ class WebRTCManager {
           });
         } else {
           console.log(`Coleta de ICE candidatos completa para ${userId}`);
+          this.triggerCallback('onIceGatheringComplete', { userId });
         }
       };
 
@@ -412,6 +415,33 @@ class WebRTCManager {
     }
   }
 
+  /**
+   * Encaminha um track recebido de outro peer para ``userId`` (relay no plano de
+   * conexões) e renegocia a conexão
+   */
+  forwardTrack(userId, track, stream) {
+    const connection = this.connections.get(userId);
+    if (!connection) return false;
+
+    const { pc } = connection;
+    if (pc.getSenders().some(sender => sender.track === track)) return false;
+
+    console.log(`Encaminhando track ${track.kind} para ${userId}`);
+    pc.addTrack(track, stream);
+
+    // Vários tracks adicionados juntos geram uma única renegociação
+    if (!this.pendingRenegotiations.has(userId)) {
+      this.pendingRenegotiations.add(userId);
+      Promise.resolve().then(() => {
+        this.pendingRenegotiations.delete(userId);
+        if (this.connections.has(userId)) {
+          this._createOffer(userId, pc);
+        }
+      });
+    }
+    return true;
+  }
+
   /**
    * Processa uma oferta SDP recebida de um peer
    */
@@ -496,7 +526,7 @@ class WebRTCManager {
       
       // Verificar se descrição remota está definida
       if (pc.remoteDescription && pc.remoteDescription.type) {
-        await pc.addIceCandidate(new RTCIceCandidate(candidate));
+        await this._addCandidate(pc, candidate);
         console.log(`ICE candidato adicionado para ${userId}`);
       } else {
         // Armazenar candidato na fila para aplicação posterior
@@ -513,6 +543,17 @@ class WebRTCManager {
     }
   }
 
+  /**
+   * Adiciona um candidato à conexão; null indica o fim dos candidatos remotos
+   * @private
+   */
+  _addCandidate(pc, candidate) {
+    if (candidate === null) {
+      return pc.addIceCandidate();
+    }
+    return pc.addIceCandidate(new RTCIceCandidate(candidate));
+  }
+
   /**
    * Armazena um candidato ICE na fila para aplicação posterior
    * @private
@@ -538,7 +579,7 @@ class WebRTCManager {
     
     for (const candidate of candidates) {
       try {
-        await pc.addIceCandidate(new RTCIceCandidate(candidate));
+        await this._addCandidate(pc, candidate);
       } catch (error) {
         console.error(`Erro ao aplicar candidato ICE para ${userId}:`, error);
       }
@@ -664,6 +705,67 @@ class WebRTCManager {
     return true;
   }
 
+  /**
+   * Nível RMS (0-1) do microfone local neste instante
+   * @returns {number|null} - Nível, ou null sem stream local
+   */
+  getLocalAudioLevel() {
+    const track = this.localStream && this.localStream.getAudioTracks()[0];
+    if (!track || !this.audioContext) return null;
+    if (!track.enabled) return 0;
+
+    // Um analisador por track (o stream é trocado no modo música)
+    if (!this.levelAnalyser || this.levelAnalyser.track !== track) {
+      if (this.levelAnalyser) this.levelAnalyser.source.disconnect();
+      const source = this.audioContext.createMediaStreamSource(new MediaStream([track]));
+      const analyser = this.audioContext.createAnalyser();
+      analyser.fftSize = 1024;
+      source.connect(analyser);
+      this.levelAnalyser = { track, source, analyser, buffer: new Float32Array(analyser.fftSize) };
+    }
+
+    const { analyser, buffer } = this.levelAnalyser;
+    analyser.getFloatTimeDomainData(buffer);
+    let sum = 0;
+    for (let i = 0; i < buffer.length; i++) {
+      sum += buffer[i] * buffer[i];
+    }
+    return Math.sqrt(sum / buffer.length);
+  }
+
+  /**
+   * Limita o bitrate ou pausa o envio do áudio local em todas as conexões
+   * (dicas de falante ativo). Tracks encaminhados como relay não mudam.
+   * @param {number|null} maxKbps - Limite em kbps (null remove o limite)
+   * @param {boolean} active - false pausa o envio
+   */
+  async setLocalSendLimits(maxKbps, active = true) {
+    const track = this.localStream && this.localStream.getAudioTracks()[0];
+    if (!track) return;
+
+    for (const [userId, connection] of this.connections) {
+      const sender = connection.pc.getSenders().find(s => s.track === track);
+      if (!sender || !sender.getParameters) continue;
+
+      try {
+        const params = sender.getParameters();
+        // Sem encodings a conexão ainda não foi negociada; as dicas são reaplicadas ao conectar
+        if (!params.encodings || params.encodings.length === 0) continue;
+        params.encodings.forEach(encoding => {
+          encoding.active = active;
+          if (maxKbps) {
+            encoding.maxBitrate = maxKbps * 1000;
+          } else {
+            delete encoding.maxBitrate;
+          }
+        });
+        await sender.setParameters(params);
+      } catch (error) {
+        console.warn(`Não foi possível ajustar o envio de áudio para ${userId}:`, error);
+      }
+    }
+  }
+
   /**
    * Registra um callback para um evento específico
    */
@@ -749,6 +851,7 @@ class WebRTCManager {
     let audioLevel = 0;
     let jitter = 0;
     let roundTripTime = 0;
+    let availableOutgoingBitrate = 0;
     let statsCounter = 0;
     
     // Processar estatísticas
@@ -778,6 +881,11 @@ class WebRTCManager {
         statsCounter++;
       }
       
+      // Banda de subida estimada no par de candidatos em uso
+      if (stat.type === 'candidate-pair' && stat.nominated && stat.availableOutgoingBitrate) {
+        availableOutgoingBitrate = stat.availableOutgoingBitrate;
+      }
+      
       // Coletar RTT
       if (stat.type === 'remote-inbound-rtp' && stat.kind === 'audio') {
         if (stat.roundTripTime !== undefined) {
@@ -836,7 +944,8 @@ class WebRTCManager {
           packetLoss: packetLossRate,
           jitter,
           roundTripTime,
-          audioLevel
+          audioLevel,
+          availableOutgoingBitrate
         }
       });
       
@@ -253,6 +253,18 @@ describe('WebRTCManager', () => {
       });
     });
     
+    test('deve disparar onIceGatheringComplete ao fim da coleta de candidatos', () => {
+      const mockCallback = jest.fn();
+      webRTCManager.on('onIceGatheringComplete', mockCallback);
+      
+      const pc = webRTCManager.createPeerConnection('test-user', true);
+      
+      // Candidato null indica o fim da coleta
+      pc.onicecandidate({ candidate: null });
+      
+      expect(mockCallback).toHaveBeenCalledWith({ userId: 'test-user' });
+    });
+    
     test('deve fechar conexão peer corretamente', () => {
       const pc = webRTCManager.createPeerConnection('test-user', true);
       const mockCallback = jest.fn();
@@ -328,6 +340,16 @@ describe('WebRTCManager', () => {
       expect(addIceCandidateSpy).toHaveBeenCalled();
     });
     
+    test('deve sinalizar fim dos candidatos remotos sem criar RTCIceCandidate', async () => {
+      const pc = webRTCManager.createPeerConnection('test-user', true);
+      const addIceCandidateSpy = jest.spyOn(pc, 'addIceCandidate');
+      pc.remoteDescription = { type: 'answer' };
+      
+      await webRTCManager.addIceCandidate('test-user', null);
+      
+      expect(addIceCandidateSpy).toHaveBeenCalledWith();
+    });
+    
     test('deve colocar candidato ICE na fila se não houver descrição remota', async () => {
       webRTCManager.createPeerConnection('test-user', true);
       const mockCandidate = { sdpMid: 'audio', candidate: 'test-candidate' };